@@ -39,18 +39,20 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     # Instantiate and connect widgets ...
 
     self.registrationInProgress = False
+    self.registrationRun = None
+    self.frameViewer = None
     self.logic = SequenceRegistrationLogic()
     self.logic.logCallback = self.addLog
 
     #
     # Parameters Area
     #
-    parametersCollapsibleButton = ctk.ctkCollapsibleButton()
-    parametersCollapsibleButton.text = "Parameters"
-    self.layout.addWidget(parametersCollapsibleButton)
+    self.parametersCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.parametersCollapsibleButton.text = "Parameters"
+    self.layout.addWidget(self.parametersCollapsibleButton)
 
     # Layout within the dummy collapsible button
-    parametersFormLayout = qt.QFormLayout(parametersCollapsibleButton)
+    parametersFormLayout = qt.QFormLayout(self.parametersCollapsibleButton)
 
     #
     # input volume selector
@@ -84,6 +86,20 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     self.outputVolumesSelector.setToolTip("Select a node for storing computed motion-compensated volume sequence.")
     parametersFormLayout.addRow("Output volume sequence:", self.outputVolumesSelector)
 
+    self.resampleOnDemandCheckBox = qt.QCheckBox("Resample on demand")
+    self.resampleOnDemandCheckBox.checked = False
+    self.resampleOnDemandCheckBox.setToolTip("Do not store motion-compensated volumes. Instead, only the transform sequence is computed"
+      " and the currently browsed frame is resampled when it is selected. Reduces memory usage for large sequences.")
+    parametersFormLayout.addRow("", self.resampleOnDemandCheckBox)
+
+    self.outputVolumeDirectorySelector = ctk.ctkPathLineEdit()
+    self.outputVolumeDirectorySelector.filters = ctk.ctkPathLineEdit.Dirs
+    self.outputVolumeDirectorySelector.setSizePolicy(qt.QSizePolicy.MinimumExpanding, qt.QSizePolicy.Preferred)
+    self.outputVolumeDirectorySelector.setToolTip("If a folder is specified then motion-compensated frames are written there"
+      " as soon as they are computed, instead of storing them in an output volume sequence. Frames are read from the folder"
+      " when they are browsed, therefore memory usage does not depend on the length of the sequence.")
+    parametersFormLayout.addRow("Output volume folder:", self.outputVolumeDirectorySelector)
+
     #
     # output transform selector
     #
@@ -106,8 +122,6 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     #
     self.registrationPresetSelector = qt.QComboBox()
     self.registrationPresetSelector.setToolTip("Pick preset to register with.")
-    for preset in self.logic.elastixLogic.getRegistrationPresets():
-      self.registrationPresetSelector.addItem(preset.getName())
     parametersFormLayout.addRow("Preset:", self.registrationPresetSelector)
 
     self.refreshRegistrationPresetList()
@@ -155,6 +169,171 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     self.transformDirectionSelector.addItem("fixed frame to moving frames")
     advancedFormLayout.addRow("Transform direction:", self.transformDirectionSelector)
 
+    self.transformGridShrinkFactorSpinBox = qt.QSpinBox()
+    self.transformGridShrinkFactorSpinBox.minimum = 1
+    self.transformGridShrinkFactorSpinBox.maximum = 32
+    self.transformGridShrinkFactorSpinBox.specialValueText = "full resolution"
+    self.transformGridShrinkFactorSpinBox.prefix = "1/"
+    self.transformGridShrinkFactorSpinBox.value = self.logic.transformGridShrinkFactor
+    self.transformGridShrinkFactorSpinBox.setToolTip("Resolution of displacement fields in the output transform sequence,"
+      " relative to the fixed frame. Displacement fields are smooth, so they can be stored at lower resolution, which"
+      " greatly reduces memory usage and scene saving/loading time.")
+    advancedFormLayout.addRow("Transform resolution:", self.transformGridShrinkFactorSpinBox)
+
+    #
+    # fixed volume mask selector
+    #
+    self.fixedVolumeMaskSelector = slicer.qMRMLNodeComboBox()
+    self.fixedVolumeMaskSelector.nodeTypes = ["vtkMRMLLabelMapVolumeNode"]
+    self.fixedVolumeMaskSelector.selectNodeUponCreation = False
+    self.fixedVolumeMaskSelector.addEnabled = False
+    self.fixedVolumeMaskSelector.removeEnabled = False
+    self.fixedVolumeMaskSelector.noneEnabled = True
+    self.fixedVolumeMaskSelector.showHidden = False
+    self.fixedVolumeMaskSelector.showChildNodeTypes = False
+    self.fixedVolumeMaskSelector.setMRMLScene(slicer.mrmlScene)
+    self.fixedVolumeMaskSelector.setToolTip("Optional mask on the fixed frame. Only the non-zero region of the mask is considered during registration.")
+    advancedFormLayout.addRow("Fixed frame mask:", self.fixedVolumeMaskSelector)
+
+    #
+    # registration region selector
+    #
+    self.registrationRegionSelector = slicer.qMRMLNodeComboBox()
+    self.registrationRegionSelector.nodeTypes = ["vtkMRMLMarkupsROINode", "vtkMRMLAnnotationROINode", "vtkMRMLSegmentationNode"]
+    self.registrationRegionSelector.selectNodeUponCreation = False
+    self.registrationRegionSelector.addEnabled = False
+    self.registrationRegionSelector.removeEnabled = False
+    self.registrationRegionSelector.noneEnabled = True
+    self.registrationRegionSelector.showHidden = False
+    self.registrationRegionSelector.showChildNodeTypes = False
+    self.registrationRegionSelector.setMRMLScene(slicer.mrmlScene)
+    self.registrationRegionSelector.setToolTip("Optional ROI or segmentation. Frames are cropped to this region before registration,"
+      " which makes registration faster if the region of interest is small. If a segmentation is selected then it is also used"
+      " as fixed frame mask (unless a fixed frame mask is selected). Output volumes and transforms still cover the full frame.")
+    advancedFormLayout.addRow("Registration region:", self.registrationRegionSelector)
+
+    #
+    # Parallel processing
+    #
+    self.numberOfParallelRegistrationsSpinBox = qt.QSpinBox()
+    self.numberOfParallelRegistrationsSpinBox.minimum = 0
+    self.numberOfParallelRegistrationsSpinBox.maximum = 256
+    self.numberOfParallelRegistrationsSpinBox.specialValueText = "automatic"
+    self.numberOfParallelRegistrationsSpinBox.value = self.logic.numberOfParallelRegistrations
+    self.numberOfParallelRegistrationsSpinBox.setToolTip("Number of frames that are registered at the same time."
+      " If automatic then it is computed from the number of CPU cores and threads per registration.")
+    advancedFormLayout.addRow("Parallel registrations:", self.numberOfParallelRegistrationsSpinBox)
+
+    self.numberOfThreadsPerRegistrationSpinBox = qt.QSpinBox()
+    self.numberOfThreadsPerRegistrationSpinBox.minimum = 0
+    self.numberOfThreadsPerRegistrationSpinBox.maximum = 256
+    self.numberOfThreadsPerRegistrationSpinBox.specialValueText = "all cores"
+    self.numberOfThreadsPerRegistrationSpinBox.value = self.logic.numberOfThreadsPerRegistration
+    self.numberOfThreadsPerRegistrationSpinBox.setToolTip("Maximum number of threads used by each elastix process.")
+    advancedFormLayout.addRow("Threads per registration:", self.numberOfThreadsPerRegistrationSpinBox)
+
+    self.initializeFromNeighborFrameCheckBox = qt.QCheckBox(" ")
+    self.initializeFromNeighborFrameCheckBox.checked = self.logic.initializeFromNeighborFrame
+    self.initializeFromNeighborFrameCheckBox.setToolTip("Register frames in order, starting from the fixed frame,"
+      " and initialize each registration with the result of the previous frame. Recommended for sequences with"
+      " small changes between consecutive frames. Fewer frames can be registered in parallel.")
+    self.neighborInitializedIterationsScaleSpinBox = qt.QDoubleSpinBox()
+    self.neighborInitializedIterationsScaleSpinBox.minimum = 0.05
+    self.neighborInitializedIterationsScaleSpinBox.maximum = 1.0
+    self.neighborInitializedIterationsScaleSpinBox.singleStep = 0.05
+    self.neighborInitializedIterationsScaleSpinBox.prefix = "iterations: "
+    self.neighborInitializedIterationsScaleSpinBox.suffix = "x"
+    self.neighborInitializedIterationsScaleSpinBox.value = self.logic.neighborInitializedMaximumNumberOfIterationsScale
+    self.neighborInitializedIterationsScaleSpinBox.setToolTip("Maximum number of iterations of registrations that are initialized"
+      " from the neighbor frame, relative to the preset. Since the initial transform is already close to the solution,"
+      " fewer iterations are enough.")
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.initializeFromNeighborFrameCheckBox)
+    hbox.addWidget(self.neighborInitializedIterationsScaleSpinBox)
+    advancedFormLayout.addRow("Initialize from neighbor frame:", hbox)
+
+    self.motionScreeningThresholdSpinBox = qt.QDoubleSpinBox()
+    self.motionScreeningThresholdSpinBox.minimum = 0.0
+    self.motionScreeningThresholdSpinBox.maximum = 10.0
+    self.motionScreeningThresholdSpinBox.singleStep = 0.01
+    self.motionScreeningThresholdSpinBox.decimals = 3
+    self.motionScreeningThresholdSpinBox.specialValueText = "disabled"
+    self.motionScreeningThresholdSpinBox.value = self.logic.motionScreeningThreshold
+    self.motionScreeningThresholdSpinBox.setToolTip("Frames are compared to the fixed frame at low resolution before registration."
+      " Frames whose intensity difference (relative to the intensity variation of the fixed frame) is below this threshold"
+      " are not registered but identity transform is used. Speeds up processing of sequences with many static frames.")
+    advancedFormLayout.addRow("Skip static frames below:", self.motionScreeningThresholdSpinBox)
+
+    self.groupwiseNumberOfIterationsSpinBox = qt.QSpinBox()
+    self.groupwiseNumberOfIterationsSpinBox.minimum = 0
+    self.groupwiseNumberOfIterationsSpinBox.maximum = 10
+    self.groupwiseNumberOfIterationsSpinBox.specialValueText = "disabled"
+    self.groupwiseNumberOfIterationsSpinBox.suffix = " iterations"
+    self.groupwiseNumberOfIterationsSpinBox.value = self.logic.groupwiseNumberOfIterations
+    self.groupwiseNumberOfIterationsSpinBox.setToolTip("Register frames to the average of all frames instead of the fixed frame,"
+      " so results do not depend on the choice of the fixed frame. The average is refined in the specified number of iterations"
+      " (each iteration registers all frames). The fixed frame only defines the image grid of the average.")
+    advancedFormLayout.addRow("Groupwise registration:", self.groupwiseNumberOfIterationsSpinBox)
+
+    self.temporalSmoothingSigmaSpinBox = qt.QDoubleSpinBox()
+    self.temporalSmoothingSigmaSpinBox.minimum = 0.0
+    self.temporalSmoothingSigmaSpinBox.maximum = 20.0
+    self.temporalSmoothingSigmaSpinBox.singleStep = 0.5
+    self.temporalSmoothingSigmaSpinBox.decimals = 1
+    self.temporalSmoothingSigmaSpinBox.specialValueText = "disabled"
+    self.temporalSmoothingSigmaSpinBox.suffix = " frames"
+    self.temporalSmoothingSigmaSpinBox.value = self.logic.temporalSmoothingSigma
+    self.temporalSmoothingSigmaSpinBox.setToolTip("After all frames are registered, smooth the transforms over time"
+      " using a Gaussian filter with this standard deviation, to remove jitter between independently registered frames."
+      " Output volumes are then computed from the smoothed transforms.")
+    advancedFormLayout.addRow("Temporal smoothing:", self.temporalSmoothingSigmaSpinBox)
+
+    self.useResultCacheCheckBox = qt.QCheckBox(" ")
+    self.useResultCacheCheckBox.checked = self.logic.useResultCache
+    self.useResultCacheCheckBox.setToolTip("Store registration results in a cache in the application cache folder"
+      " and reuse them if the same frame is registered again with the same settings.")
+    self.resultCacheMaximumSizeSpinBox = qt.QSpinBox()
+    self.resultCacheMaximumSizeSpinBox.minimum = 0
+    self.resultCacheMaximumSizeSpinBox.maximum = 10000000
+    self.resultCacheMaximumSizeSpinBox.suffix = " MB"
+    self.resultCacheMaximumSizeSpinBox.value = self.logic.resultCacheMaximumSizeMB
+    self.resultCacheMaximumSizeSpinBox.setToolTip("Least recently used results are removed when the cache exceeds this size.")
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.useResultCacheCheckBox)
+    hbox.addWidget(self.resultCacheMaximumSizeSpinBox)
+    advancedFormLayout.addRow("Use result cache:", hbox)
+
+    self.checkpointDirectorySelector = ctk.ctkPathLineEdit()
+    self.checkpointDirectorySelector.filters = ctk.ctkPathLineEdit.Dirs
+    self.checkpointDirectorySelector.setSizePolicy(qt.QSizePolicy.MinimumExpanding, qt.QSizePolicy.Preferred)
+    self.checkpointDirectorySelector.setToolTip("If a folder is specified then results of each frame are saved there as soon as"
+      " the frame is completed. Leave empty to not save checkpoints.")
+    self.resumeFromCheckpointCheckBox = qt.QCheckBox("Resume")
+    self.resumeFromCheckpointCheckBox.checked = False
+    self.resumeFromCheckpointCheckBox.setToolTip("Reuse results saved in the checkpoint folder and only register the missing frames.")
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.checkpointDirectorySelector)
+    hbox.addWidget(self.resumeFromCheckpointCheckBox)
+    advancedFormLayout.addRow("Checkpoint folder:", hbox)
+
+    #
+    # Registration report
+    #
+    self.reportTableSelector = slicer.qMRMLNodeComboBox()
+    self.reportTableSelector.nodeTypes = ["vtkMRMLTableNode"]
+    self.reportTableSelector.baseName = "RegistrationReport"
+    self.reportTableSelector.selectNodeUponCreation = True
+    self.reportTableSelector.addEnabled = True
+    self.reportTableSelector.removeEnabled = True
+    self.reportTableSelector.renameEnabled = True
+    self.reportTableSelector.noneEnabled = True
+    self.reportTableSelector.showHidden = False
+    self.reportTableSelector.showChildNodeTypes = False
+    self.reportTableSelector.setMRMLScene(slicer.mrmlScene)
+    self.reportTableSelector.setToolTip("Optional table that is filled with time spent in each processing step"
+      " and final registration metric value of each frame.")
+    advancedFormLayout.addRow("Report table:", self.reportTableSelector)
+
     #
     # Option to show detailed log
     #
@@ -204,6 +383,48 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
       "If value is empty then default elastix (bundled with SlicerElastix extension) will be used.")
     advancedFormLayout.addRow("Custom Elastix toolbox location:", self.customElastixBinDirSelector)
 
+    self.registrationBackendSelector = qt.QComboBox()
+    self.registrationBackendSelector.addItem("elastix executable", "executable")
+    self.registrationBackendSelector.addItem("in-process (itk-elastix)", "itk")
+    self.registrationBackendSelector.currentIndex = self.registrationBackendSelector.findData(self.logic.registrationBackend)
+    self.registrationBackendSelector.setToolTip("In-process registration passes images to elastix in memory, which saves"
+      " starting elastix and transformix processes and writing and reading files for each frame. It requires itk-elastix"
+      " Python package (can be installed by pip_install('itk-elastix')). Elastix executable is used if itk-elastix is not installed.")
+    advancedFormLayout.addRow("Registration backend:", self.registrationBackendSelector)
+
+    #
+    # Batch Area
+    #
+    self.batchCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.batchCollapsibleButton.text = "Batch"
+    self.batchCollapsibleButton.collapsed = 1
+    self.layout.addWidget(self.batchCollapsibleButton)
+    batchFormLayout = qt.QFormLayout(self.batchCollapsibleButton)
+
+    # Parameters of each registration in the batch (arguments of SequenceRegistrationLogic.createRegistrationRun)
+    self.batchRegistrationParameters = []
+    self.batchListWidget = qt.QListWidget()
+    self.batchListWidget.setToolTip("Volume sequences that are registered by 'Register all'. Frames of all sequences"
+      " are registered using a shared queue, which keeps all CPU cores busy.")
+    batchFormLayout.addRow(self.batchListWidget)
+
+    self.addToBatchButton = qt.QPushButton("Add to batch")
+    self.addToBatchButton.toolTip = "Add the input volume sequence with the current parameters and outputs to the batch."
+    self.removeFromBatchButton = qt.QPushButton("Remove")
+    self.removeFromBatchButton.toolTip = "Remove the selected registration from the batch."
+    self.clearBatchButton = qt.QPushButton("Clear")
+    self.clearBatchButton.toolTip = "Remove all registrations from the batch."
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.addToBatchButton)
+    hbox.addWidget(self.removeFromBatchButton)
+    hbox.addWidget(self.clearBatchButton)
+    batchFormLayout.addRow(hbox)
+
+    self.registerAllButton = qt.QPushButton("Register all")
+    self.registerAllButton.toolTip = "Register all volume sequences of the batch."
+    self.registerAllButton.enabled = False
+    batchFormLayout.addRow(self.registerAllButton)
+
     #
     # Apply Button
     #
@@ -212,6 +433,9 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     self.applyButton.enabled = False
     self.layout.addWidget(self.applyButton)
 
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.setVisible(False)
+    self.layout.addWidget(self.progressBar)
 
     self.statusLabel = qt.QPlainTextEdit()
     self.statusLabel.setTextInteractionFlags(qt.Qt.TextSelectableByMouse)
@@ -220,9 +444,15 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
 
     # connections
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
+    self.addToBatchButton.connect('clicked(bool)', self.onAddToBatch)
+    self.removeFromBatchButton.connect('clicked(bool)', self.onRemoveFromBatch)
+    self.clearBatchButton.connect('clicked(bool)', self.onClearBatch)
+    self.registerAllButton.connect('clicked(bool)', self.onRegisterAll)
     self.inputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onInputSelect)
     self.outputVolumesSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
     self.outputTransformSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
+    self.resampleOnDemandCheckBox.connect("toggled(bool)", self.onSelect)
+    self.outputVolumeDirectorySelector.connect("currentPathChanged(QString)", self.onSelect)
     self.sequenceFixedItemIndexWidget.connect('valueChanged(double)', self.setSequenceItemIndex)
     self.sequenceStartItemIndexWidget.connect('valueChanged(double)', self.setSequenceItemIndex)
     self.sequenceEndItemIndexWidget.connect('valueChanged(double)', self.setSequenceItemIndex)
@@ -240,6 +470,11 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     # Variable initializations
     self.newParameterButtons = []
 
+    # Registration runs in background processes, this timer checks their status
+    self.registrationTimer = qt.QTimer()
+    self.registrationTimer.setInterval(200)
+    self.registrationTimer.connect('timeout()', self.onRegistrationTimer)
+
     # Refresh Apply button state
     self.onInputSelect()
 
@@ -248,11 +483,21 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
     if sequenceBrowserNode is not None:
       sequenceBrowserNode.SetSelectedItemNumber(int(index))
 
+  def enter(self):
+    # Presets may have been changed while the module was not shown (presets are only read again if they are changed)
+    self.refreshRegistrationPresetList()
+
   def refreshRegistrationPresetList(self):
+    presetNames = [preset.getName() for preset in self.logic.getRegistrationPresets()]
+    if presetNames == [self.registrationPresetSelector.itemText(index) for index in range(self.registrationPresetSelector.count)]:
+      return
     wasBlocked = self.registrationPresetSelector.blockSignals(True)
+    currentPresetName = self.registrationPresetSelector.currentText
     self.registrationPresetSelector.clear()
-    for preset in self.logic.elastixLogic.getRegistrationPresets(force_refresh=True):
-      self.registrationPresetSelector.addItem(preset.getName())
+    for presetName in presetNames:
+      self.registrationPresetSelector.addItem(presetName)
+    if currentPresetName in presetNames:
+      self.registrationPresetSelector.currentIndex = presetNames.index(currentPresetName)
     self.registrationPresetSelector.blockSignals(wasBlocked)
 
   def overwriteParFile(self, filename):
@@ -266,7 +511,12 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
         return self.newParameterButtons.index(row)
 
   def cleanup(self):
-    pass
+    self.stopFrameViewer()
+    self.registrationTimer.stop()
+    if self.registrationRun:
+      self.registrationRun.cancel()
+      self.registrationRun = None
+    self.logic.cleanup()
 
   def onInputSelect(self):
     if not self.inputSelector.currentNode():
@@ -290,52 +540,223 @@ class SequenceRegistrationWidget(ScriptedLoadableModuleWidget):
 
   def onSelect(self):
 
-    self.applyButton.enabled = self.inputSelector.currentNode() and (self.outputVolumesSelector.currentNode() or self.outputTransformSelector.currentNode())
-
-    if not self.registrationInProgress:
-      self.applyButton.text = "Register"
+    if self.registrationInProgress:
+      # Apply button is used for cancelling the registration
       return
-    self.updateBrowsers()
+
+    resampleOnDemand = self.resampleOnDemandCheckBox.checked
+    streamOutputVolumes = bool(self.outputVolumeDirectorySelector.currentPath)
+    self.outputVolumesSelector.enabled = not resampleOnDemand and not streamOutputVolumes
+    self.outputVolumeDirectorySelector.enabled = not resampleOnDemand
+    if resampleOnDemand:
+      # transforms are needed for resampling
+      self.applyButton.enabled = self.inputSelector.currentNode() and self.outputTransformSelector.currentNode()
+    elif streamOutputVolumes:
+      self.applyButton.enabled = self.inputSelector.currentNode() is not None
+    else:
+      self.applyButton.enabled = self.inputSelector.currentNode() and (self.outputVolumesSelector.currentNode() or self.outputTransformSelector.currentNode())
+    self.applyButton.text = "Register"
+    self.addToBatchButton.enabled = self.applyButton.enabled
+    self.registerAllButton.enabled = len(self.batchRegistrationParameters) > 0
 
   def onApplyButton(self):
 
     if self.registrationInProgress:
-      self.registrationInProgress = False
-      self.logic.setAbortRequested(True)
-      self.applyButton.text = "Cancelling..."
-      self.applyButton.enabled = False
+      # Registration processes are killed immediately
+      self.registrationRun.cancel()
+      self.addLog("Registration is cancelled.")
+      self.onRegistrationFinished()
+      return
+
+    self.statusLabel.plainText = ''
+    self.stopFrameViewer()
+    try:
+      self.updateLogicFromGUI()
+      self.registrationRun = self.logic.createRegistrationRun(**self.getRegistrationParameters())
+      self.registrationRun.progressCallback = self.onRegistrationProgress
+      self.registrationRun.start()
+    except Exception as e:
+      self.onRegistrationError(e)
+      self.registrationRun = None
+      return
+    self.onRegistrationStarted()
+
+  def onRegisterAll(self):
+    self.statusLabel.plainText = ''
+    self.stopFrameViewer()
+    try:
+      self.updateLogicFromGUI()
+      registrationParametersList = []
+      for batchRegistrationParameters in self.batchRegistrationParameters:
+        registrationParameters = dict(batchRegistrationParameters)
+        # Presets are identified by name, as the preset list may have been refreshed since the sequence was added
+        registrationParameters["presetIndex"] = self.logic.getRegistrationPresetIndexByName(registrationParameters.pop("presetName"))
+        registrationParametersList.append(registrationParameters)
+      self.registrationRun = self.logic.createRegistrationBatch(registrationParametersList)
+      self.registrationRun.progressCallback = self.onRegistrationProgress
+      self.registrationRun.start()
+    except Exception as e:
+      self.onRegistrationError(e)
+      self.registrationRun = None
+      return
+    self.onRegistrationStarted()
+
+  def onAddToBatch(self):
+    try:
+      registrationParameters = self.getRegistrationParameters()
+    except ValueError as e:
+      slicer.util.errorDisplay(str(e))
+      return
+    outputNodes = [registrationParameters["outputVolSeq"], registrationParameters["outputTransformSeq"]]
+    for batchRegistrationParameters in self.batchRegistrationParameters:
+      for outputNode in [batchRegistrationParameters["outputVolSeq"], batchRegistrationParameters["outputTransformSeq"]]:
+        if outputNode and outputNode in outputNodes:
+          slicer.util.errorDisplay("Output sequence {0} is already used in the batch. Select a different output.".format(outputNode.GetName()))
+          return
+    del registrationParameters["presetIndex"]
+    presetName = self.registrationPresetSelector.currentText
+    registrationParameters["presetName"] = presetName
+    self.batchRegistrationParameters.append(registrationParameters)
+    self.batchListWidget.addItem("{0}: frames {1}-{2}, fixed frame {3}, {4}".format(
+      registrationParameters["inputVolSeq"].GetName(), registrationParameters["startFrameIndex"], registrationParameters["endFrameIndex"],
+      registrationParameters["fixedVolumeItemNumber"], presetName))
+    self.onSelect()
+
+  def onRemoveFromBatch(self):
+    row = self.batchListWidget.currentRow
+    if row < 0:
       return
+    del self.batchRegistrationParameters[row]
+    self.batchListWidget.takeItem(row)
+    self.onSelect()
+
+  def onClearBatch(self):
+    self.batchRegistrationParameters = []
+    self.batchListWidget.clear()
+    self.onSelect()
 
+  def getRegistrationParameters(self):
+    """Get arguments of SequenceRegistrationLogic.createRegistrationRun from the GUI."""
+    storeOutputVolumes = not self.resampleOnDemandCheckBox.checked and not self.outputVolumeDirectorySelector.currentPath
+    return {
+      "inputVolSeq": self.inputSelector.currentNode(),
+      "outputVolSeq": self.outputVolumesSelector.currentNode() if storeOutputVolumes else None,
+      "outputTransformSeq": self.outputTransformSelector.currentNode(),
+      "fixedVolumeItemNumber": int(self.sequenceFixedItemIndexWidget.value),
+      # The preset list is read again when presets are changed, so the index in the selector may be outdated
+      "presetIndex": self.logic.getRegistrationPresetIndexByName(self.registrationPresetSelector.currentText),
+      "computeMovingToFixedTransform": (self.transformDirectionSelector.currentIndex == 0),
+      "startFrameIndex": int(self.sequenceStartItemIndexWidget.value),
+      "endFrameIndex": int(self.sequenceEndItemIndexWidget.value),
+      "fixedVolumeMask": self.fixedVolumeMaskSelector.currentNode(),
+      "registrationRegion": self.registrationRegionSelector.currentNode(),
+      }
+
+  def updateLogicFromGUI(self):
+    """Set processing options of the logic from the GUI."""
+    self.logic.elastixLogic.setCustomElastixBinDir(self.customElastixBinDirSelector.currentPath)
+    self.logic.registrationBackend = self.registrationBackendSelector.currentData
+    self.logic.logStandardOutput = self.showDetailedLogDuringExecutionCheckBox.checked
+    self.logic.numberOfParallelRegistrations = self.numberOfParallelRegistrationsSpinBox.value
+    self.logic.numberOfThreadsPerRegistration = self.numberOfThreadsPerRegistrationSpinBox.value
+    self.logic.initializeFromNeighborFrame = self.initializeFromNeighborFrameCheckBox.checked
+    self.logic.neighborInitializedMaximumNumberOfIterationsScale = self.neighborInitializedIterationsScaleSpinBox.value
+    self.logic.motionScreeningThreshold = self.motionScreeningThresholdSpinBox.value
+    self.logic.groupwiseNumberOfIterations = self.groupwiseNumberOfIterationsSpinBox.value
+    self.logic.temporalSmoothingSigma = self.temporalSmoothingSigmaSpinBox.value
+    self.logic.transformGridShrinkFactor = self.transformGridShrinkFactorSpinBox.value
+    self.logic.useResultCache = self.useResultCacheCheckBox.checked
+    self.logic.resultCacheMaximumSizeMB = self.resultCacheMaximumSizeSpinBox.value
+    self.logic.checkpointDirectory = self.checkpointDirectorySelector.currentPath
+    self.logic.resumeFromCheckpoint = self.resumeFromCheckpointCheckBox.checked
+    resampleOnDemand = self.resampleOnDemandCheckBox.checked
+    self.logic.outputVolumeDirectory = None if resampleOnDemand else self.outputVolumeDirectorySelector.currentPath or None
+
+  def onRegistrationStarted(self):
     self.registrationInProgress = True
     self.applyButton.text = "Cancel"
-    self.statusLabel.plainText = ''
-    slicer.app.setOverrideCursor(qt.Qt.WaitCursor)
+    self.setRegistrationParametersEnabled(False)
+    self.progressBar.maximum = self.registrationRun.getNumberOfFrames()
+    self.progressBar.value = 0
+    self.progressBar.format = "Starting..."
+    self.progressBar.setVisible(True)
+    self.registrationTimer.start()
+
+  def onRegistrationTimer(self):
     try:
-      computeMovingToFixedTransform = (self.transformDirectionSelector.currentIndex == 0)
-      fixedFrameIndex = int(self.sequenceFixedItemIndexWidget.value)
-      startFrameIndex = int(self.sequenceStartItemIndexWidget.value)
-      endFrameIndex = int(self.sequenceEndItemIndexWidget.value)
-      self.logic.elastixLogic.setCustomElastixBinDir(self.customElastixBinDirSelector.currentPath)
-      self.logic.logStandardOutput = self.showDetailedLogDuringExecutionCheckBox.checked
-      self.logic.registerVolumeSequence(self.inputSelector.currentNode(),
-        self.outputVolumesSelector.currentNode(), self.outputTransformSelector.currentNode(),
-        fixedFrameIndex, self.registrationPresetSelector.currentIndex, computeMovingToFixedTransform,
-        startFrameIndex, endFrameIndex)
+      if not self.registrationRun.poll():
+        return
+      self.addLog("Registration is completed in {0}.".format(self.formatDuration(self.registrationRun.getElapsedTime())))
+      # Report and frame viewers are only available for a single registration
+      isSingleRegistration = not isinstance(self.registrationRun, SequenceRegistrationBatch)
+      if isSingleRegistration and self.reportTableSelector.currentNode():
+        self.logic.updateTableFromRegistrationReport(self.registrationRun.getReport(), self.reportTableSelector.currentNode())
+      if isSingleRegistration and self.resampleOnDemandCheckBox.checked:
+        # Frames are resampled using the original (moving to fixed) transforms, even if fixed to moving transforms are computed
+        self.frameViewer = self.logic.createLazyResampler(self.registrationRun.inputVolSeq, self.registrationRun.resamplingTransformSeq)
+        slicer.util.setSliceViewerLayers(background=self.frameViewer.outputVolume)
+      elif isSingleRegistration and self.registrationRun.outputVolumeDirectory:
+        self.frameViewer = self.logic.createStreamedVolumeViewer(self.registrationRun.inputVolSeq, self.registrationRun.outputVolumeDirectory)
+        slicer.util.setSliceViewerLayers(background=self.frameViewer.outputVolume)
     except Exception as e:
-      print(e)
-      self.addLog("Error: {0}".format(str(e)))
-      import traceback
-      traceback.print_exc()
-    finally:
-      slicer.app.restoreOverrideCursor()
-      self.registrationInProgress = False
-      self.onSelect() # restores default Apply button state
+      self.onRegistrationError(e)
+    self.onRegistrationFinished()
+
+  def onRegistrationProgress(self, registrationRun):
+    numberOfCompletedFrames = registrationRun.getNumberOfCompletedFrames()
+    progressText = "Frame {0} of {1} completed, elapsed time: {2}".format(numberOfCompletedFrames,
+      registrationRun.getNumberOfFrames(), self.formatDuration(registrationRun.getElapsedTime()))
+    estimatedRemainingTime = registrationRun.getEstimatedRemainingTime()
+    if estimatedRemainingTime is not None:
+      progressText += ", remaining: {0}".format(self.formatDuration(estimatedRemainingTime))
+    postProcessingProgress = registrationRun.getPostProcessingProgress()
+    if postProcessingProgress is not None:
+      progressText = "Smoothing transforms over time: {0} of {1} frames completed, elapsed time: {2}".format(
+        postProcessingProgress[0], postProcessingProgress[1], self.formatDuration(registrationRun.getElapsedTime()))
+    self.progressBar.value = numberOfCompletedFrames
+    self.progressBar.format = progressText
+
+  def onRegistrationError(self, e):
+    self.addLog("Error: {0}".format(str(e)))
+    import traceback
+    traceback.print_exc()
+
+  def onRegistrationFinished(self):
+    self.registrationTimer.stop()
+    self.registrationRun = None
+    self.registrationInProgress = False
+    self.setRegistrationParametersEnabled(True)
+    self.progressBar.setVisible(False)
+    self.onSelect() # restores default Apply button state
+
+  def stopFrameViewer(self):
+    if self.frameViewer:
+      self.frameViewer.stop()
+      self.frameViewer = None
+
+  def setRegistrationParametersEnabled(self, enabled):
+    """Prevent changing parameters while registration is in progress.
+    Logging and temporary file options remain editable.
+    """
+    self.parametersCollapsibleButton.enabled = enabled
+    self.batchCollapsibleButton.enabled = enabled
+    for widget in [self.transformDirectionSelector, self.transformGridShrinkFactorSpinBox, self.fixedVolumeMaskSelector, self.registrationRegionSelector, self.numberOfParallelRegistrationsSpinBox,
+      self.numberOfThreadsPerRegistrationSpinBox, self.initializeFromNeighborFrameCheckBox, self.neighborInitializedIterationsScaleSpinBox, self.motionScreeningThresholdSpinBox, self.groupwiseNumberOfIterationsSpinBox, self.temporalSmoothingSigmaSpinBox, self.useResultCacheCheckBox, self.resultCacheMaximumSizeSpinBox,
+      self.checkpointDirectorySelector, self.resumeFromCheckpointCheckBox, self.reportTableSelector, self.customElastixBinDirSelector, self.registrationBackendSelector]:
+      widget.enabled = enabled
+    inputVolSeq = self.inputSelector.currentNode()
+    for sequenceItemSelectorWidget in [self.sequenceFixedItemIndexWidget, self.sequenceStartItemIndexWidget, self.sequenceEndItemIndexWidget]:
+      sequenceItemSelectorWidget.enabled = enabled and inputVolSeq is not None and inputVolSeq.GetNumberOfDataNodes() > 0
+
+  def formatDuration(self, seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
 
   def addLog(self, text):
     """Append text to log window
     """
     self.statusLabel.appendPlainText(text)
-    slicer.app.processEvents()  # force update
 
   def onShowTemporaryFilesFolder(self):
     from ElastixLib.utils import showFolder, getTempDirectoryBase
@@ -369,6 +790,61 @@ class SequenceRegistrationLogic(ScriptedLoadableModuleLogic):
     ScriptedLoadableModuleLogic.__init__(self)
     self.logStandardOutput = False
     self.logCallback = None
+    # Number of elastix processes running at the same time (0 = automatic, based on number of CPU cores)
+    self.numberOfParallelRegistrations = 0
+    # Number of threads each elastix process may use (0 = all CPU cores)
+    self.numberOfThreadsPerRegistration = 4
+    # Register frames in order, starting from the fixed frame, and use the displacement field computed
+    # for the neighbor frame as initial transform
+    self.initializeFromNeighborFrame = False
+    # Scale applied to MaximumNumberOfIterations for frames that are initialized from the neighbor frame
+    # (since the initial transform is already close to the solution, fewer iterations are enough)
+    self.neighborInitializedMaximumNumberOfIterationsScale = 0.5
+    # Store registration results in a persistent cache and reuse them when the same frame is registered again
+    self.useResultCache = False
+    # Cache location (None = default location in the application cache folder)
+    self.resultCacheDirectory = None
+    # Least recently used cache entries are removed when the cache grows larger than this size
+    self.resultCacheMaximumSizeMB = 20000
+    # Store resampled volumes in the cache (if disabled then only transforms are cached and resampling is performed again)
+    self.cacheResampledVolumes = True
+    # If set then results of each frame are saved into this folder as soon as the frame is completed
+    self.checkpointDirectory = None
+    # Reuse results found in checkpointDirectory and only register the missing frames
+    self.resumeFromCheckpoint = False
+    # If set then motion-compensated frames are written into this folder as soon as they are computed
+    # (see SequenceRegistrationStreamedVolumeSequence) instead of keeping all of them in memory
+    self.outputVolumeDirectory = None
+    # Displacement fields in the output transform sequence are computed on a grid that is this many times coarser
+    # than the fixed frame (along each axis). Coarse grids use much less memory and disk space, and are interpolated
+    # smoothly (with cubic interpolation) when the transform is used. 1 means the full resolution of the fixed frame.
+    self.transformGridShrinkFactor = 1
+    # Margin added around the registration region (in mm), as image content near the boundary of the region
+    # is needed for registering the region itself
+    self.registrationRegionMargin = 10.0
+    # Frames that differ from the fixed frame less than this threshold are not registered (identity transform is used).
+    # The difference is the RMS intensity difference of downsampled frames, relative to the standard deviation
+    # of the fixed frame intensities. 0 means all frames are registered.
+    self.motionScreeningThreshold = 0.0
+    self.motionScreeningShrinkFactor = 4
+    # If greater than 0 then frames are registered to a template (average of the registered frames) instead of the fixed frame,
+    # and the template is refined in this many iterations (see SequenceRegistrationGroupwiseRun)
+    self.groupwiseNumberOfIterations = 0
+    # If greater than 0 then displacement fields in the output transform sequence are smoothed over time using a Gaussian
+    # with this standard deviation (in frames) after all frames are registered, to remove jitter between independently
+    # registered frames. Motion-compensated volumes are then computed from the smoothed transforms.
+    self.temporalSmoothingSigma = 0.0
+    # Displacement fields of all frames are smoothed in blocks of slices of about this size, to limit memory usage
+    self.temporalSmoothingBlockSizeMB = 256
+    # "executable": elastix and transformix executables are run in background processes, images are passed in files.
+    # "itk": elastix is run in-process (in background threads) using the itk-elastix Python package,
+    # images are passed in memory. If itk-elastix is not installed then executables are used.
+    self.registrationBackend = "executable"
+    self.inProcessRegistrationExecutor = None
+    self.inProcessRegistrationExecutorSize = 0
+
+    # File names and modification times in the registration preset database folder when presets were last read
+    self.registrationPresetsDatabaseState = None
 
     import Elastix
     self.elastixLogic = Elastix.ElastixLogic()
@@ -377,124 +853,695 @@ class SequenceRegistrationLogic(ScriptedLoadableModuleLogic):
     self.elastixLogic.abortRequested = abortRequested
 
   def findBrowserForSequence(self, sequenceNode):
-    browserNodes = slicer.util.getNodesByClass("vtkMRMLSequenceBrowserNode")
-    for browserNode in browserNodes:
-      if browserNode.IsSynchronizedSequenceNode(sequenceNode, True):
-        return browserNode
-    return None
+    return SequenceRegistrationBrowserIndex.getSharedIndex(slicer.mrmlScene).getBrowserForSequence(sequenceNode)
 
-  def registerVolumeSequence(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True,
-    startFrameIndex=None, endFrameIndex=None):
+  def cleanup(self):
+    """Remove scene observers (e.g., before reloading the module). Lookups after this recreate them."""
+    SequenceRegistrationBrowserIndex.releaseSharedIndex()
+
+  def getRegistrationPresets(self):
+    """Returns registration presets. The preset database is only read again if files in the database folder
+    have been added, removed, or modified since it was last read.
     """
-    computeMovingToFixedTransform: if True then moving->fixed else fixed->moving transforms are computed
+    presetsDatabaseState = []
+    presetsDir = self.elastixLogic.getBuiltinPresetsDir()
+    if os.path.isdir(presetsDir):
+      for entry in os.scandir(presetsDir):
+        if entry.is_file():
+          presetsDatabaseState.append((entry.name, entry.stat().st_mtime))
+    presetsDatabaseState.sort()
+    forceRefresh = (presetsDatabaseState != self.registrationPresetsDatabaseState)
+    registrationPresets = self.elastixLogic.getRegistrationPresets(force_refresh=forceRefresh)
+    self.registrationPresetsDatabaseState = presetsDatabaseState
+    return registrationPresets
+
+  def getNumberOfParallelRegistrations(self):
+    """Get number of elastix processes that are run at the same time.
+    If numberOfParallelRegistrations is not set (0) then it is computed from the number of CPU cores
+    and the number of threads used by each elastix process.
     """
-    self.elastixLogic.logStandardOutput = self.logStandardOutput
-    self.elastixLogic.logCallback = self.logCallback
-    self.abortRequested = False
+    if self.numberOfParallelRegistrations > 0:
+      return self.numberOfParallelRegistrations
+    if self.numberOfThreadsPerRegistration <= 0:
+      # each elastix process uses all the cores
+      return 1
+    import multiprocessing
+    return max(1, multiprocessing.cpu_count() // self.numberOfThreadsPerRegistration)
 
-    preset = self.elastixLogic.getRegistrationPresets()[presetIndex]
-    parameterFilenames = preset.getParameterFiles()
+  def isInProcessRegistrationAvailable(self):
+    """Returns True if itk-elastix Python package is installed."""
+    try:
+      import itk
+      return hasattr(itk, "ElastixRegistrationMethod")
+    except ImportError:
+      return False
 
-    fixedSeqBrowser = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode")
-    fixedSeqBrowser.SetAndObserveMasterSequenceNodeID(inputVolSeq.GetID())
-    fixedSeqBrowser.SetSelectedItemNumber(fixedVolumeItemNumber)
-    if slicer.app.majorVersion*100+slicer.app.minorVersion < 411:
-      sequencesModule = slicer.modules.sequencebrowser
-    else:
-      sequencesModule = slicer.modules.sequences
-    sequencesModule.logic().UpdateAllProxyNodes()
-    slicer.app.processEvents()
-    fixedVolume = fixedSeqBrowser.GetProxyNode(inputVolSeq)
+  def useInProcessRegistration(self):
+    """Returns True if frames are registered in-process. Executables are used as fallback if itk-elastix is not available."""
+    if self.registrationBackend != "itk":
+      return False
+    if not self.isInProcessRegistrationAvailable():
+      self.elastixLogic.addLog("itk-elastix Python package is not installed, elastix executables are used for registration")
+      return False
+    return True
 
-    movingSeqBrowser = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode")
-    movingSeqBrowser.SetAndObserveMasterSequenceNodeID(inputVolSeq.GetID())
+  def getInProcessRegistrationExecutor(self):
+    """Thread pool that runs in-process registrations and other long computations of frame jobs (such as inverting
+    displacement fields). Registrations only run at the same time (and the application only remains responsive meanwhile)
+    if the Python wrapping of ITK releases the global interpreter lock during computations, which depends on how
+    ITK was built. The "in-process" mode of the benchmark (Testing/Python/SequenceRegistrationBenchmark.py) reports
+    how much the registrations overlap. Displacement fields are inverted slice by slice, so the application can process
+    events between slices.
+    """
+    import concurrent.futures
+    numberOfParallelRegistrations = self.getNumberOfParallelRegistrations()
+    if self.inProcessRegistrationExecutor is None or self.inProcessRegistrationExecutorSize != numberOfParallelRegistrations:
+      if self.inProcessRegistrationExecutor is not None:
+        self.inProcessRegistrationExecutor.shutdown(wait=False)
+      self.inProcessRegistrationExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=numberOfParallelRegistrations)
+      self.inProcessRegistrationExecutorSize = numberOfParallelRegistrations
+    return self.inProcessRegistrationExecutor
 
-    # Initialize output sequences
-    for seq in [outputVolSeq, outputTransformSeq]:
-      if seq:
-        seq.RemoveAllDataNodes()
-        seq.SetIndexType(inputVolSeq.GetIndexType())
-        seq.SetIndexName(inputVolSeq.GetIndexName())
-        seq.SetIndexUnit(inputVolSeq.GetIndexUnit())
+  def releaseInProcessRegistrationExecutor(self):
+    """Stop using the current thread pool. Computations that are already running there are completed in the background
+    (they cannot be interrupted), but new computations are started in a new thread pool, so they do not wait for them.
+    """
+    if self.inProcessRegistrationExecutor is not None:
+      self.inProcessRegistrationExecutor.shutdown(wait=False)
+      self.inProcessRegistrationExecutor = None
 
-    outputVol = slicer.mrmlScene.AddNewNodeByClass(fixedVolume.GetClassName())
+  def getParameterFilePaths(self, preset):
+    return [os.path.abspath(os.path.join(self.elastixLogic.getBuiltinPresetsDir(), parameterFilename))
+      for parameterFilename in preset.getParameterFiles()]
 
-    # Only request output transform if it is needed, to save some time on computing it
-    if outputTransformSeq:
-      outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode")
-    else:
-      outputTransform = None
+  def getResultCache(self):
+    """Returns the result cache or None if caching is disabled."""
+    if not self.useResultCache:
+      return None
+    resultCacheDirectory = self.resultCacheDirectory
+    if not resultCacheDirectory:
+      resultCacheDirectory = os.path.join(slicer.app.cachePath, "SequenceRegistration")
+    return SequenceRegistrationResultCache(resultCacheDirectory, self.resultCacheMaximumSizeMB * 1024 * 1024,
+      self.cacheResampledVolumes)
+
+  def updateHashWithVolume(self, hashObject, volumeNode):
+    """Add voxel values and geometry of a volume node to a hashlib object."""
+    from vtk.util import numpy_support
+    imageData = volumeNode.GetImageData()
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    hashObject.update(str([imageData.GetDimensions(), imageData.GetScalarType(), imageData.GetNumberOfScalarComponents(),
+      [ijkToRas.GetElement(row, column) for row in range(4) for column in range(4)]]).encode())
+    hashObject.update(numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).data)
+
+  def startElastixProcess(self, executableFilename, cmdLineArguments, logFilePath):
+    """Start elastix or transformix executable in the background.
+    Process output is written into logFilePath to prevent the process from blocking on a full output pipe.
+    """
+    import subprocess
+    executableFilePath = os.path.join(self.elastixLogic.getElastixBinDir(), executableFilename)
+    with open(logFilePath, 'w') as logFile:
+      return subprocess.Popen([executableFilePath] + cmdLineArguments, env=self.elastixLogic.getElastixEnv(),
+        stdout=logFile, stderr=subprocess.STDOUT, universal_newlines=True, startupinfo=self.elastixLogic.getStartupInfo())
+
+  def writeVolumeToFile(self, volumeNode, filePath):
+    storageNode = slicer.vtkMRMLVolumeArchetypeStorageNode()
+    storageNode.SetFileName(filePath)
+    storageNode.SetUseCompression(False)
+    if not storageNode.WriteData(volumeNode):
+      raise ValueError("Failed to write volume to "+filePath)
+
+  def readVolumeFromFile(self, volumeNode, filePath):
+    storageNode = slicer.vtkMRMLVolumeArchetypeStorageNode()
+    storageNode.SetFileName(filePath)
+    if not storageNode.ReadData(volumeNode):
+      raise ValueError("Failed to read volume from "+filePath)
+
+  def readTransformFromFile(self, transformNode, filePath):
+    storageNode = slicer.vtkMRMLTransformStorageNode()
+    storageNode.SetFileName(filePath)
+    if not storageNode.ReadData(transformNode):
+      raise ValueError("Failed to read transform from "+filePath)
 
+  def createItkImage(self, volumeNode, pixelType="float32"):
+    """Returns an ITK image (and the numpy array that holds its voxels) of a volume node, for in-process registration.
+    elastix registers float images (and uses unsigned char masks). The image shares the voxels of the volume only if
+    the volume already has the required pixel type, otherwise (e.g., short CT images) voxels are converted into a new array.
+    The returned numpy array must be kept as long as the image is used.
+    """
+    import itk
+    import numpy as np
+    from vtk.util import numpy_support
+    imageData = volumeNode.GetImageData()
+    dimensions = imageData.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+    voxels = voxels.astype(pixelType, copy=False)
+    itkImage = itk.image_view_from_array(voxels)
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    spacing = np.array(volumeNode.GetSpacing())
+    # ITK uses LPS coordinate system
+    rasToLps = np.diag([-1.0, -1.0, 1.0])
+    directions = np.array([[ijkToRas.GetElement(row, column) for column in range(3)] for row in range(3)]) / spacing
+    itkImage.SetSpacing(spacing.tolist())
+    itkImage.SetOrigin(rasToLps.dot([ijkToRas.GetElement(row, 3) for row in range(3)]).tolist())
+    itkImage.SetDirection(itk.matrix_from_array(np.ascontiguousarray(rasToLps.dot(directions))))
+    return itkImage, voxels
+
+  def createItkImageView(self, itkImage):
+    """Returns a new ITK image object that has the same geometry as itkImage and shares its voxels (they are not copied).
+    """
+    import itk
+    imageView = itk.image_view_from_array(itk.array_view_from_image(itkImage))
+    imageView.SetSpacing(itkImage.GetSpacing())
+    imageView.SetOrigin(itkImage.GetOrigin())
+    imageView.SetDirection(itkImage.GetDirection())
+    return imageView
+
+  def getItkImageToRasMatrix(self, itkImage):
+    """Returns IJK to RAS matrix (as numpy array) of an ITK image."""
+    import itk
+    import numpy as np
+    lpsToRas = np.diag([-1.0, -1.0, 1.0])
+    ijkToRas = np.eye(4)
+    ijkToRas[:3, :3] = lpsToRas.dot(itk.array_from_matrix(itkImage.GetDirection())) * np.array(itkImage.GetSpacing())
+    ijkToRas[:3, 3] = lpsToRas.dot(np.array(itkImage.GetOrigin()))
+    return ijkToRas
+
+  def updateVolumeFromItkImage(self, volumeNode, itkImage, pixelType="float32"):
+    """Set voxels and geometry of a volume node from an ITK image computed by in-process registration.
+    """
+    import itk
+    import numpy as np
+    from vtk.util import numpy_support
+    voxels = itk.array_from_image(itkImage)
+    if np.dtype(pixelType).kind in "iu":
+      voxels = np.rint(voxels)
+    voxels = voxels.astype(pixelType, copy=False)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(voxels.shape[::-1])
+    imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(), deep=False))
+    ijkToRas = vtk.vtkMatrix4x4()
+    ijkToRas.DeepCopy(self.getItkImageToRasMatrix(itkImage).ravel())
+    volumeNode.SetIJKToRASMatrix(ijkToRas)
+    volumeNode.SetAndObserveImageData(imageData)
+
+  def createGridTransformFromItkDisplacementField(self, displacementField):
+    """Returns a displacement field transform (to be used as transform from parent, same as a displacement field
+    read from file) of a displacement field computed by in-process transformix.
+    """
+    import itk
+    import numpy as np
+    from vtk.util import numpy_support
+    displacements = itk.array_from_image(displacementField).reshape(-1, 3).astype(np.float32)
+    # ITK uses LPS coordinate system
+    displacements[:, 0:2] *= -1
+    gridIjkToRas = self.getItkImageToRasMatrix(displacementField)
+    spacing = np.array(displacementField.GetSpacing())
+    displacementGrid = vtk.vtkImageData()
+    displacementGrid.SetOrigin(gridIjkToRas[:3, 3].tolist())
+    displacementGrid.SetSpacing(spacing.tolist())
+    displacementGrid.SetDimensions([int(size) for size in displacementField.GetLargestPossibleRegion().GetSize()])
+    displacementGrid.GetPointData().SetScalars(numpy_support.numpy_to_vtk(displacements, deep=True))
+    gridDirectionMatrix = vtk.vtkMatrix4x4()
+    for row in range(3):
+      for column in range(3):
+        gridDirectionMatrix.SetElement(row, column, gridIjkToRas[row, column] / spacing[column])
+    gridTransform = slicer.vtkOrientedGridTransform()
+    gridTransform.SetGridDirectionMatrix(gridDirectionMatrix)
+    gridTransform.SetDisplacementGridData(displacementGrid)
+    return gridTransform
+
+  def readTransformParameterObject(self, transformParametersFilePath):
+    """Read an elastix transform parameter file and all the initial transform parameter files it refers to
+    into an itk-elastix parameter object, for in-process transformix.
+    """
+    import itk
+    import re
+    transformParametersFilePaths = []
+    while transformParametersFilePath and transformParametersFilePath != "NoInitialTransform":
+      transformParametersFilePaths.insert(0, transformParametersFilePath)
+      with open(transformParametersFilePath) as parameterFile:
+        match = re.search(r'\(InitialTransformParametersFileName\s+"([^"]*)"\)', parameterFile.read())
+      transformParametersFilePath = match.group(1) if match else None
+    parameterObject = itk.ParameterObject.New()
+    for transformParametersFilePath in transformParametersFilePaths:
+      parameterObject.AddParameterFile(transformParametersFilePath)
+    # Transforms are applied in the order of parameter maps, they must not be loaded from files again
+    for parameterMapIndex in range(parameterObject.GetNumberOfParameterMaps()):
+      parameterObject.SetParameter(parameterMapIndex, "InitialTransformParametersFileName", "NoInitialTransform")
+    return parameterObject
+
+  def getDirectorySize(self, path):
+    """Total size of files in a folder and its subfolders, in bytes."""
+    size = 0
+    for root, dirs, files in os.walk(path):
+      size += sum(os.path.getsize(os.path.join(root, filename)) for filename in files)
+    return size
+
+  def parseElastixLog(self, logFilePath):
+    """Get optimization results from an elastix log file.
+    Returns a list with one dict for each resolution level of each parameter file, containing
+    parameterFileIndex, resolution, numberOfIterations, finalMetricValue, timeSec, and stoppingCondition.
+    """
+    import re
+    levels = []
+    parameterFileIndex = 0
+    level = None
+    metricColumn = None
+    with open(logFilePath) as logFile:
+      for line in logFile:
+        line = line.strip()
+        match = re.match(r'Running elastix with parameter file (\d+)', line)
+        if match:
+          parameterFileIndex = int(match.group(1))
+          continue
+        match = re.match(r'Resolution: (\d+)', line)
+        if match:
+          level = {"parameterFileIndex": parameterFileIndex, "resolution": int(match.group(1)), "numberOfIterations": 0,
+            "finalMetricValue": None, "timeSec": None, "stoppingCondition": None}
+          levels.append(level)
+          metricColumn = None
+          continue
+        if level is None:
+          continue
+        if line.startswith('1:ItNr'):
+          columnNames = line.split('\t')
+          metricColumn = columnNames.index('2:Metric') if '2:Metric' in columnNames else None
+          continue
+        match = re.match(r'Time spent in resolution \d+ \(ITK initialization and iterating\): ([\d.]+)', line)
+        if match:
+          level["timeSec"] = float(match.group(1))
+          continue
+        match = re.match(r'Stopping condition: (.*)', line)
+        if match:
+          level["stoppingCondition"] = match.group(1).rstrip('.')
+          continue
+        if metricColumn is not None and line[:1].isdigit():
+          values = line.split('\t')
+          try:
+            level["finalMetricValue"] = float(values[metricColumn])
+            level["numberOfIterations"] = int(values[0]) + 1
+          except (IndexError, ValueError):
+            # end of the iteration table
+            metricColumn = None
+    return levels
+
+  def writeRegistrationReport(self, report, filePath):
+    """Write report of a registration run (see SequenceRegistrationRun.getReport) into a JSON file."""
+    import json
+    with open(filePath, 'w') as reportFile:
+      json.dump(report, reportFile, indent=2)
+
+  def updateTableFromRegistrationReport(self, report, tableNode):
+    """Show per-frame information of a registration report in a table node (one row for each frame)."""
+    stages = ["restore", "write", "elastix", "transformix", "load", "insert"]
+    columns = [("Item", vtk.vtkIntArray), ("Index value", vtk.vtkStringArray), ("Source", vtk.vtkStringArray)]
+    columns += [(stage.capitalize()+" time (s)", vtk.vtkDoubleArray) for stage in stages]
+    columns += [("Bytes written", vtk.vtkDoubleArray), ("Iterations", vtk.vtkIntArray), ("Final metric", vtk.vtkDoubleArray),
+      ("Motion screening metric", vtk.vtkDoubleArray)]
+    wasModified = tableNode.StartModify()
+    table = tableNode.GetTable()
+    table.Initialize()
+    for columnName, arrayClass in columns:
+      array = arrayClass()
+      array.SetName(columnName)
+      table.AddColumn(array)
+    table.SetNumberOfRows(len(report["frames"]))
+    for rowIndex, frame in enumerate(report["frames"]):
+      values = [frame["itemNumber"], frame["indexValue"], frame["source"]]
+      values += [frame["timingsSec"].get(stage, 0.0) for stage in stages]
+      finalMetricValue = frame["finalMetricValue"]
+      motionScreeningMetricValue = frame["motionScreeningMetricValue"]
+      values += [frame["bytesWritten"], sum(level["numberOfIterations"] for level in frame["elastix"]),
+        finalMetricValue if finalMetricValue is not None else float('nan'),
+        motionScreeningMetricValue if motionScreeningMetricValue is not None else float('nan')]
+      for columnIndex, value in enumerate(values):
+        table.SetValue(rowIndex, columnIndex, vtk.vtkVariant(value))
+    tableNode.Modified()
+    tableNode.EndModify(wasModified)
+
+  def invertTransform(self, transformNode):
+    """Invert the transform node. Displacement field transforms are inverted by computing the inverse displacement
+    at each grid point, because evaluating the inverse of a displacement field on-the-fly (iteratively, at each point)
+    makes resampling with the transform very slow.
+    """
+    resamplingTransform = transformNode.GetTransformFromParent()
+    if not resamplingTransform or not resamplingTransform.IsA("vtkOrientedGridTransform"):
+      transformNode.Inverse()
+      return
+    transformNode.SetAndObserveTransformFromParent(self.createInverseGridTransform(resamplingTransform))
+
+  def createInverseGridTransform(self, gridTransform):
+    """Returns a displacement field transform that is the inverse of gridTransform, sampled on the same grid.
+    It does not use the scene, therefore it can be called from a background thread.
+    """
+    return self.createGridTransformFromTransform(gridTransform.GetInverse(), gridTransform)
+
+  def createGridTransformFromTransform(self, transform, referenceGridTransform):
+    """Returns a displacement field transform that is transform sampled on the grid of referenceGridTransform.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    displacementGrid = referenceGridTransform.GetDisplacementGrid()
+    dimensions = displacementGrid.GetDimensions()
+    gridDirectionMatrix = vtk.vtkMatrix4x4()
+    gridDirectionMatrix.DeepCopy(referenceGridTransform.GetGridDirectionMatrix())
+    # Grid point positions: origin + direction * (spacing * ijk)
+    gridIndexToWorld = np.array([[gridDirectionMatrix.GetElement(row, column) for column in range(3)] for row in range(3)])
+    gridIndexToWorld = gridIndexToWorld * np.array(displacementGrid.GetSpacing())
+    origin = np.array(displacementGrid.GetOrigin())
+    j, i = np.meshgrid(np.arange(dimensions[1]), np.arange(dimensions[0]), indexing='ij')
+    sliceIndices = np.stack([i.ravel(), j.ravel(), np.zeros(i.size)], axis=1)
+    # Displacements are written directly into the array of the output grid
+    displacementArray = vtk.vtkFloatArray()
+    displacementArray.SetNumberOfComponents(3)
+    displacementArray.SetNumberOfTuples(dimensions[0] * dimensions[1] * dimensions[2])
+    displacements = numpy_support.vtk_to_numpy(displacementArray).reshape(dimensions[2], i.size, 3)
+    inputPoints = vtk.vtkPoints()
+    outputPoints = vtk.vtkPoints()
+    # Process the grid slice by slice to limit memory usage
+    for k in range(dimensions[2]):
+      sliceIndices[:, 2] = k
+      points = sliceIndices.dot(gridIndexToWorld.T) + origin
+      inputPoints.SetData(numpy_support.numpy_to_vtk(points, deep=True))
+      outputPoints.Reset()
+      transform.TransformPoints(inputPoints, outputPoints)
+      displacements[k] = numpy_support.vtk_to_numpy(outputPoints.GetData()) - points
+    sampledDisplacementGrid = vtk.vtkImageData()
+    sampledDisplacementGrid.SetOrigin(displacementGrid.GetOrigin())
+    sampledDisplacementGrid.SetSpacing(displacementGrid.GetSpacing())
+    sampledDisplacementGrid.SetDimensions(dimensions)
+    sampledDisplacementGrid.GetPointData().SetScalars(displacementArray)
+    sampledGridTransform = slicer.vtkOrientedGridTransform()
+    sampledGridTransform.SetGridDirectionMatrix(gridDirectionMatrix)
+    sampledGridTransform.SetDisplacementGridData(sampledDisplacementGrid)
+    sampledGridTransform.SetInterpolationMode(referenceGridTransform.GetInterpolationMode())
+    return sampledGridTransform
+
+  def smoothTransformSequence(self, transformSeq, sigma, fixedItemNumber=None):
+    """Smooth displacement fields of all items of transformSeq over time with a Gaussian
+    of sigma standard deviation (in frames). Displacement fields must be on the same grid.
+    Non-grid transforms (such as identity transforms of skipped frames) are replaced by displacement fields,
+    except the transform of fixedItemNumber, which remains unchanged.
+    """
+    transformNodes = [transformSeq.GetNthDataNode(itemNumber) for itemNumber in range(transformSeq.GetNumberOfDataNodes())]
+    smoothedTransforms = self.smoothTransforms([transformNode.GetTransformFromParent() for transformNode in transformNodes], sigma,
+      fixedItemNumber)
+    self.setSmoothedTransforms(transformNodes, smoothedTransforms)
+
+  def smoothTransforms(self, transforms, sigma, fixedTransformIndex=None):
+    """Smooth displacement field transforms (a list, in temporal order) over time with a Gaussian
+    of sigma standard deviation (in frames). Returns the list of smoothed transforms, which are new transform objects:
+    the input transforms are not modified, so they can be used (e.g., displayed) while smoothing is in progress.
+    Non-grid transforms are sampled on the same grid. The transform at fixedTransformIndex (the fixed frame)
+    is used for smoothing the other transforms but it is returned unchanged.
+    It does not use the scene, therefore it can be called from a background thread. Call setSmoothedTransforms
+    to update the transform nodes.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    numberOfFrames = len(transforms)
+    if sigma <= 0 or numberOfFrames < 2:
+      return transforms
+    referenceGridTransform = None
+    for transform in transforms:
+      if transform and transform.IsA("vtkOrientedGridTransform"):
+        referenceGridTransform = transform
+        break
+    if referenceGridTransform is None:
+      # No displacement fields (all frames are identical to the fixed frame)
+      return transforms
+    referenceGrid = referenceGridTransform.GetDisplacementGrid()
+    dimensions = referenceGrid.GetDimensions()
+    smoothedTransforms = []
+    displacementArrays = []
+    smoothedDisplacementArrays = []
+    for transformIndex, transform in enumerate(transforms):
+      gridTransform = transform
+      if not gridTransform or not gridTransform.IsA("vtkOrientedGridTransform"):
+        gridTransform = self.createGridTransformFromTransform(transform, referenceGridTransform)
+      displacementGrid = gridTransform.GetDisplacementGrid()
+      if (displacementGrid.GetDimensions() != dimensions or displacementGrid.GetNumberOfScalarComponents() != 3
+        or not np.allclose(displacementGrid.GetOrigin(), referenceGrid.GetOrigin())
+        or not np.allclose(displacementGrid.GetSpacing(), referenceGrid.GetSpacing())):
+        raise ValueError("Temporal smoothing requires all displacement fields on the same grid")
+      # Displacement vectors, indexed by slice
+      displacementArrays.append(numpy_support.vtk_to_numpy(displacementGrid.GetPointData().GetScalars()).reshape(
+        dimensions[2], dimensions[1]*dimensions[0], 3))
+      if transformIndex == fixedTransformIndex:
+        smoothedTransforms.append(transform)
+        smoothedDisplacementArrays.append(None)
+        continue
+      # Smoothed displacements are written directly into the array of a new grid
+      smoothedDisplacements = displacementGrid.GetPointData().GetScalars().NewInstance()
+      smoothedDisplacements.SetNumberOfComponents(3)
+      smoothedDisplacements.SetNumberOfTuples(dimensions[0] * dimensions[1] * dimensions[2])
+      smoothedDisplacementGrid = vtk.vtkImageData()
+      smoothedDisplacementGrid.SetOrigin(displacementGrid.GetOrigin())
+      smoothedDisplacementGrid.SetSpacing(displacementGrid.GetSpacing())
+      smoothedDisplacementGrid.SetDimensions(dimensions)
+      smoothedDisplacementGrid.GetPointData().SetScalars(smoothedDisplacements)
+      smoothedGridTransform = slicer.vtkOrientedGridTransform()
+      smoothedGridTransform.SetGridDirectionMatrix(gridTransform.GetGridDirectionMatrix())
+      smoothedGridTransform.SetDisplacementGridData(smoothedDisplacementGrid)
+      smoothedGridTransform.SetInterpolationMode(gridTransform.GetInterpolationMode())
+      smoothedTransforms.append(smoothedGridTransform)
+      smoothedDisplacementArrays.append(numpy_support.vtk_to_numpy(smoothedDisplacements).reshape(
+        dimensions[2], dimensions[1]*dimensions[0], 3))
+
+    # All frames of a block of slices are smoothed at once
+    sliceSizeBytes = numberOfFrames * dimensions[1] * dimensions[0] * 3 * np.dtype(np.float64).itemsize
+    numberOfSlicesPerBlock = max(1, int(self.temporalSmoothingBlockSizeMB * 1024 * 1024 / sliceSizeBytes))
+    for startSlice in range(0, dimensions[2], numberOfSlicesPerBlock):
+      endSlice = min(startSlice + numberOfSlicesPerBlock, dimensions[2])
+      block = np.stack([displacementArray[startSlice:endSlice] for displacementArray in displacementArrays]).astype(np.float64)
+      smoothedBlock = self.smoothArrayOverTime(block, sigma)
+      for smoothedDisplacementArray, smoothedDisplacements in zip(smoothedDisplacementArrays, smoothedBlock):
+        if smoothedDisplacementArray is not None:
+          smoothedDisplacementArray[startSlice:endSlice] = smoothedDisplacements
+    return smoothedTransforms
+
+  def setSmoothedTransforms(self, transformNodes, smoothedTransforms):
+    """Update transform nodes with the transforms returned by smoothTransforms. Must be called from the main thread.
+    """
+    for transformNode, smoothedTransform in zip(transformNodes, smoothedTransforms):
+      if transformNode.GetTransformFromParent() is not smoothedTransform:
+        transformNode.SetAndObserveTransformFromParent(smoothedTransform)
+
+  def smoothArrayOverTime(self, array, sigma):
+    """Returns array filtered along the first (time) axis with a Gaussian of sigma standard deviation.
+    Values beyond the first and last frames are assumed to be the same as the first and last frames.
+    """
     try:
-      numberOfDataNodes = inputVolSeq.GetNumberOfDataNodes()
-      if startFrameIndex is None:
-        startFrameIndex = 0
-      if endFrameIndex is None:
-        endFrameIndex = numberOfDataNodes-1
-      movingVolIndices = list(range(startFrameIndex, endFrameIndex+1))
-      for movingVolumeItemNumber in movingVolIndices:
-        if movingVolumeItemNumber>movingVolIndices[0]:
-          self.elastixLogic.addLog("---------------------")
-        self.elastixLogic.addLog("Registering item {0} of {1}".format(movingVolumeItemNumber-movingVolIndices[0]+1, len(movingVolIndices)))
-        movingSeqBrowser.SetSelectedItemNumber(movingVolumeItemNumber)
-        sequencesModule.logic().UpdateProxyNodesFromSequences(movingSeqBrowser)
-        movingVolume = movingSeqBrowser.GetProxyNode(inputVolSeq)
-
-        if movingVolumeItemNumber != fixedVolumeItemNumber:
-          self.elastixLogic.registerVolumes(
-            fixedVolume, movingVolume,
-            outputVolumeNode = outputVol,
-            parameterFilenames = parameterFilenames,
-            outputTransformNode = outputTransform
-            )
-
-          if outputVolSeq:
-            outputVolSeq.SetDataNodeAtValue(outputVol, inputVolSeq.GetNthIndexValue(movingVolumeItemNumber))
-          if outputTransformSeq:
-            if not computeMovingToFixedTransform:
-              outputTransform.Inverse()
-            outputTransformSeq.SetDataNodeAtValue(outputTransform, inputVolSeq.GetNthIndexValue(movingVolumeItemNumber))
-        else:
-          self.elastixLogic.addLog("Same as fixed volume.")
-          if outputVolSeq:
-            outputVolSeq.SetDataNodeAtValue(fixedVolume, inputVolSeq.GetNthIndexValue(movingVolumeItemNumber))
-            outputVolSeq.GetDataNodeAtValue(inputVolSeq.GetNthIndexValue(movingVolumeItemNumber)).SetName(slicer.mrmlScene.GetUniqueNameByString("Volume"))
-
-          if outputTransformSeq:
-            # Set identity as transform (vtkTransform is initialized to identity transform by default)
-            outputTransform.SetAndObserveTransformToParent(vtk.vtkTransform())
-            outputTransformSeq.SetDataNodeAtValue(outputTransform, inputVolSeq.GetNthIndexValue(movingVolumeItemNumber))
-
-      if outputVolSeq:
-        # Make scalar type of the fixed volume in the output sequence to the other volumes
-        outputFixedVol = outputVolSeq.GetDataNodeAtValue(inputVolSeq.GetNthIndexValue(fixedVolumeItemNumber))
-        imageCast = vtk.vtkImageCast()
-        ijkToRasMatrix = vtk.vtkMatrix4x4()
-        imageCast.SetInputData(outputFixedVol.GetImageData())
-        imageCast.SetOutputScalarTypeToShort()
-        imageCast.Update()
-        outputFixedVol.SetAndObserveImageData(imageCast.GetOutput())
-        # Make origin and spacing match exactly other volumes
-        movingVolIndices.remove(fixedVolumeItemNumber)
-        if len(movingVolIndices) >= 1:
-          matchedVolumeIndex = movingVolIndices[0]
-          matchedVolume = outputVolSeq.GetDataNodeAtValue(inputVolSeq.GetNthIndexValue(matchedVolumeIndex))
-          outputFixedVol.SetOrigin(matchedVolume.GetOrigin())
-          outputFixedVol.SetSpacing(matchedVolume.GetSpacing())
+      from scipy.ndimage import gaussian_filter1d
+      return gaussian_filter1d(array, sigma, axis=0, mode='nearest', truncate=3.0)
+    except ImportError:
+      pass
+    import numpy as np
+    # Same kernel as gaussian_filter1d
+    radius = int(3.0 * sigma + 0.5)
+    offsets = np.arange(-radius, radius+1)
+    weights = np.exp(-0.5 * (offsets / sigma)**2)
+    weights /= weights.sum()
+    paddedArray = np.concatenate([np.repeat(array[:1], radius, axis=0), array, np.repeat(array[-1:], radius, axis=0)])
+    smoothedArray = np.zeros_like(array)
+    for offsetIndex, weight in enumerate(weights):
+      smoothedArray += weight * paddedArray[offsetIndex:offsetIndex+len(array)]
+    return smoothedArray
 
-    finally:
+  def runRegistration(self, registrationRun):
+    """Run registration and wait until it is completed.
+    """
+    import time
+    registrationRun.start()
+    while not registrationRun.poll():
+      if self.elastixLogic.abortRequested:
+        registrationRun.cancel()
+        raise ValueError("User requested cancel.")
+      slicer.app.processEvents()
+      time.sleep(0.05)
+
+  def writeDisplacementFieldTransformParameters(self, displacementFieldPath, transformParametersFilePath):
+    """Write an elastix transform parameter file that uses the displacement field (written by transformix) as transform.
+    """
+    with open(transformParametersFilePath, 'w') as parameterFile:
+      parameterFile.write('(Transform "DeformationFieldTransform")\n')
+      parameterFile.write('(NumberOfParameters 0)\n')
+      parameterFile.write('(InitialTransformParametersFileName "NoInitialTransform")\n')
+      parameterFile.write('(HowToCombineTransforms "Compose")\n')
+      parameterFile.write('(DeformationFieldFileName "{0}")\n'.format(displacementFieldPath.replace('\\', '/')))
+      parameterFile.write('(DeformationFieldInterpolationOrder 1)\n')
+      parameterFile.write('(FixedImageDimension 3)\n')
+      parameterFile.write('(MovingImageDimension 3)\n')
+      parameterFile.write('(FixedInternalImagePixelType "float")\n')
+      parameterFile.write('(MovingInternalImagePixelType "float")\n')
+
+  def stageParameterFiles(self, parameterFilenames, outputDir, maximumNumberOfIterationsScale):
+    """Write copies of parameter files into outputDir with MaximumNumberOfIterations scaled.
+    Returns list of written parameter file paths.
+    """
+    import re
+    def scaleIterations(match):
+      iterations = [str(max(1, int(round(int(value) * maximumNumberOfIterationsScale)))) for value in match.group(2).split()]
+      return match.group(1) + " ".join(iterations) + ")"
+    os.makedirs(outputDir)
+    stagedParameterFilenames = []
+    for parameterFileIndex, parameterFilename in enumerate(parameterFilenames):
+      with open(parameterFilename) as parameterFile:
+        parameters = parameterFile.read()
+      parameters = re.sub(r'(\(\s*MaximumNumberOfIterations\s+)([\d\s]+)\)', scaleIterations, parameters)
+      stagedParameterFilename = os.path.join(outputDir, "{0}-{1}".format(parameterFileIndex, os.path.basename(parameterFilename)))
+      with open(stagedParameterFilename, 'w') as parameterFile:
+        parameterFile.write(parameters)
+      stagedParameterFilenames.append(stagedParameterFilename)
+    return stagedParameterFilenames
+
+  def getCroppingExtent(self, volumeNode, regionNode):
+    """Get IJK extent of the part of the volume that contains the region (ROI or segmentation node),
+    expanded by registrationRegionMargin.
+    """
+    import math
+    bounds = [0.0] * 6
+    regionNode.GetRASBounds(bounds)
+    if bounds[0] > bounds[1]:
+      raise ValueError("Registration region {0} is empty".format(regionNode.GetName()))
+    for axis in range(3):
+      bounds[axis*2] -= self.registrationRegionMargin
+      bounds[axis*2+1] += self.registrationRegionMargin
+    rasToIjk = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIjk)
+    cornersIjk = [rasToIjk.MultiplyPoint([bounds[0+i], bounds[2+j], bounds[4+k], 1.0])[:3]
+      for i in range(2) for j in range(2) for k in range(2)]
+    dimensions = volumeNode.GetImageData().GetDimensions()
+    extent = []
+    for axis in range(3):
+      axisMin = max(0, int(math.floor(min(corner[axis] for corner in cornersIjk))))
+      axisMax = min(dimensions[axis]-1, int(math.ceil(max(corner[axis] for corner in cornersIjk))))
+      if axisMin > axisMax:
+        raise ValueError("Registration region {0} is outside of volume {1}".format(regionNode.GetName(), volumeNode.GetName()))
+      extent += [axisMin, axisMax]
+    return extent
+
+  def cropVolume(self, volumeNode, extent):
+    """Returns a new volume node (not added to the scene) that contains the voxels of volumeNode within the IJK extent.
+    Voxels are not resampled, so the cropped volume has the same spacing and axis directions as the input.
+    """
+    extractVoi = vtk.vtkExtractVOI()
+    extractVoi.SetInputData(volumeNode.GetImageData())
+    extractVoi.SetVOI(extent)
+    # Make extent of the cropped image start at 0, the offset is stored in the volume origin instead
+    changeInformation = vtk.vtkImageChangeInformation()
+    changeInformation.SetInputConnection(extractVoi.GetOutputPort())
+    changeInformation.SetOutputExtentStart(0, 0, 0)
+    changeInformation.Update()
+    croppedVolume = volumeNode.CreateNodeInstance()
+    croppedVolume.UnRegister(None)
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    croppedVolume.SetIJKToRASMatrix(ijkToRas)
+    croppedVolume.SetOrigin(ijkToRas.MultiplyPoint([extent[0], extent[2], extent[4], 1.0])[:3])
+    croppedVolume.SetAndObserveImageData(changeInformation.GetOutput())
+    return croppedVolume
+
+  def createMaskFromSegmentation(self, segmentationNode, referenceVolumeNode):
+    """Returns a labelmap volume node (not added to the scene) in the geometry of referenceVolumeNode,
+    where voxels inside any of the segments are non-zero.
+    """
+    referenceGeometry = slicer.vtkSlicerSegmentationsModuleLogic.CreateOrientedImageDataFromVolumeNode(referenceVolumeNode)
+    mergedImage = slicer.vtkOrientedImageData()
+    if not segmentationNode.GenerateMergedLabelmapForAllSegments(mergedImage, slicer.vtkSegmentation.EXTENT_REFERENCE_GEOMETRY, referenceGeometry):
+      raise ValueError("Failed to create mask from segmentation "+segmentationNode.GetName())
+    maskNode = slicer.vtkMRMLLabelMapVolumeNode()
+    slicer.vtkSlicerSegmentationsModuleLogic.CreateLabelmapVolumeFromOrientedImageData(mergedImage, maskNode)
+    return maskNode
+
+  def setTransformParametersOutputGeometry(self, transformParametersFilePath, size, origin):
+    """Change size and origin of the output image grid (that transformix computes results on) in an elastix transform
+    parameter file. Spacing and axis directions are not changed. origin is specified in RAS coordinate system.
+    """
+    import re
+    with open(transformParametersFilePath) as parameterFile:
+      parameters = parameterFile.read()
+    # ITK uses LPS coordinate system
+    originLps = [-origin[0], -origin[1], origin[2]]
+    parameters = re.sub(r'\(Size\s[^)]*\)', '(Size {0})'.format(" ".join(str(value) for value in size)), parameters)
+    parameters = re.sub(r'\(Index\s[^)]*\)', '(Index 0 0 0)', parameters)
+    parameters = re.sub(r'\(Origin\s[^)]*\)', '(Origin {0})'.format(" ".join("{0:.10g}".format(value) for value in originLps)), parameters)
+    with open(transformParametersFilePath, 'w') as parameterFile:
+      parameterFile.write(parameters)
+
+  def setTransformParametersResultPixelType(self, transformParametersFilePath, pixelType):
+    """Change the pixel type of the image that transformix computes (elastix type name, such as "short" or "float")
+    in an elastix transform parameter file.
+    """
+    import re
+    with open(transformParametersFilePath) as parameterFile:
+      parameters = parameterFile.read()
+    resultImagePixelType = '(ResultImagePixelType "{0}")'.format(pixelType)
+    if re.search(r'\(ResultImagePixelType\s[^)]*\)', parameters):
+      parameters = re.sub(r'\(ResultImagePixelType\s[^)]*\)', resultImagePixelType, parameters)
+    else:
+      parameters += "\n" + resultImagePixelType + "\n"
+    with open(transformParametersFilePath, 'w') as parameterFile:
+      parameterFile.write(parameters)
+
+  def getDownsampledVoxels(self, volumeNode):
+    """Returns voxel values of the volume, downsampled by motionScreeningShrinkFactor, as a numpy array."""
+    from vtk.util import numpy_support
+    shrink = vtk.vtkImageShrink3D()
+    shrink.SetInputData(volumeNode.GetImageData())
+    shrink.SetShrinkFactors(self.motionScreeningShrinkFactor, self.motionScreeningShrinkFactor, self.motionScreeningShrinkFactor)
+    shrink.AveragingOn()
+    shrink.Update()
+    return numpy_support.vtk_to_numpy(shrink.GetOutput().GetPointData().GetScalars()).astype(float)
+
+  def computeMotionScreeningMetric(self, fixedVoxels, movingVoxels):
+    """Returns RMS difference of the downsampled voxel values relative to the standard deviation of the fixed voxels."""
+    import numpy as np
+    if fixedVoxels.shape != movingVoxels.shape:
+      # different geometry, cannot be compared
+      return float('inf')
+    fixedStd = fixedVoxels.std()
+    rmsDifference = np.sqrt(np.mean((movingVoxels - fixedVoxels) ** 2))
+    if fixedStd == 0:
+      return 0.0 if rmsDifference == 0 else float('inf')
+    return float(rmsDifference / fixedStd)
+
+  def writeShrunkTransformParameters(self, transformParametersFilePath, shrunkTransformParametersFilePath, shrinkFactor):
+    """Write a copy of an elastix transform parameter file with an output grid (that transformix computes results on)
+    that has shrinkFactor times larger spacing and covers the same region.
+    """
+    import re
+    with open(transformParametersFilePath) as parameterFile:
+      parameters = parameterFile.read()
+    size = [int(value) for value in re.search(r'\(Size\s([^)]*)\)', parameters).group(1).split()]
+    spacing = [float(value) for value in re.search(r'\(Spacing\s([^)]*)\)', parameters).group(1).split()]
+    shrunkSize = [(value-2) // shrinkFactor + 2 if value > 1 else 1 for value in size]
+    parameters = re.sub(r'\(Size\s[^)]*\)', '(Size {0})'.format(" ".join(str(value) for value in shrunkSize)), parameters)
+    parameters = re.sub(r'\(Spacing\s[^)]*\)', '(Spacing {0})'.format(" ".join("{0:.10g}".format(value * shrinkFactor) for value in spacing)), parameters)
+    with open(shrunkTransformParametersFilePath, 'w') as parameterFile:
+      parameterFile.write(parameters)
 
-      # Temporary result nodes
-      slicer.mrmlScene.RemoveNode(outputVol)
-      if outputTransformSeq:
-        slicer.mrmlScene.RemoveNode(outputTransform)
-      # Temporary input browser nodes
-      slicer.mrmlScene.RemoveNode(fixedSeqBrowser)
-      slicer.mrmlScene.RemoveNode(movingSeqBrowser)
-      # Temporary input volume proxy nodes
-      slicer.mrmlScene.RemoveNode(fixedVolume)
-      slicer.mrmlScene.RemoveNode(movingVolume)
+  def stageFixedVolume(self, fixedVolume, fixedVolumeMask, tempDir):
+    """Write fixed volume (and mask) into the working directory once, to be used by all frame registrations.
+    Returns file paths of the fixed volume and the mask (None if there is no mask).
+    """
+    fixedDir = os.path.join(tempDir, 'fixed')
+    os.makedirs(fixedDir)
+    fixedVolumePath = os.path.join(fixedDir, 'fixed.mha')
+    self.writeVolumeToFile(fixedVolume, fixedVolumePath)
+    fixedVolumeMaskPath = None
+    if fixedVolumeMask:
+      fixedVolumeMaskPath = os.path.join(fixedDir, 'fixedMask.mha')
+      self.writeVolumeToFile(fixedVolumeMask, fixedVolumeMaskPath)
+    return fixedVolumePath, fixedVolumeMaskPath
 
+  def createRegistrationRun(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True,
+    startFrameIndex=None, endFrameIndex=None, fixedVolumeMask=None, registrationRegion=None):
+    """Create registration run for sequences in the scene. See registerVolumeSequence for description of the parameters.
+    """
+    def cleanup():
       # Move output sequences in the same browser node as the input volume sequence and rename their proxy nodes
       outputBrowserNode = self.findBrowserForSequence(inputVolSeq)
 
@@ -506,57 +1553,3437 @@ class SequenceRegistrationLogic(ScriptedLoadableModuleLogic):
           outputBrowserNode.AddSynchronizedSequenceNodeID(outputTransformSeq.GetID())
           outputBrowserNode.SetOverwriteProxyName(outputTransformSeq, True)
 
-class SequenceRegistrationTest(ScriptedLoadableModuleTest):
-  """
-  This is the test case for your scripted module.
-  Uses ScriptedLoadableModuleTest base class, available at:
-  https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
+    registrationRun = self.newRegistrationRun(inputVolSeq, outputVolSeq, outputTransformSeq,
+      fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform, startFrameIndex, endFrameIndex, fixedVolumeMask, registrationRegion)
+    registrationRun.cleanupCallbacks.append(cleanup)
+    return registrationRun
+
+  def newRegistrationRun(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True,
+    startFrameIndex=None, endFrameIndex=None, fixedVolumeMask=None, registrationRegion=None):
+    """Returns a groupwise registration run if groupwiseNumberOfIterations is set, otherwise registration to the fixed frame.
+    """
+    if self.groupwiseNumberOfIterations > 0:
+      return SequenceRegistrationGroupwiseRun(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex,
+        computeMovingToFixedTransform, startFrameIndex, endFrameIndex, fixedVolumeMask, registrationRegion, self.groupwiseNumberOfIterations)
+    return SequenceRegistrationRun(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex,
+      computeMovingToFixedTransform, startFrameIndex, endFrameIndex, fixedVolumeMask, registrationRegion)
+
+  def registerVolumeSequence(self, inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True,
+    startFrameIndex=None, endFrameIndex=None, fixedVolumeMask=None, registrationRegion=None):
+    """
+    fixedVolumeItemNumber: frames are registered to this frame. If groupwiseNumberOfIterations is set then frames are registered
+      to the average of all frames instead, and the fixed frame only defines the image grid.
+    computeMovingToFixedTransform: if True then moving->fixed else fixed->moving transforms are computed
+    fixedVolumeMask: optional volume node, registration only considers voxels where the mask is non-zero
+    registrationRegion: optional ROI or segmentation node, frames are cropped to this region (plus registrationRegionMargin)
+      for registration. A segmentation is also used as fixed volume mask if fixedVolumeMask is not specified.
+    Returns the completed registration run (e.g., for getting its report).
+    """
+    registrationRun = self.createRegistrationRun(inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex,
+      computeMovingToFixedTransform, startFrameIndex, endFrameIndex, fixedVolumeMask, registrationRegion)
+    self.runRegistration(registrationRun)
+    return registrationRun
+
+  def createRegistrationBatch(self, registrationParametersList):
+    """Create registration of multiple volume sequences. Each item of registrationParametersList is a dict
+    of createRegistrationRun arguments (inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex, etc.).
+    If checkpointDirectory or outputVolumeDirectory is set then files of each sequence are saved in a separate subfolder.
+    """
+    registrationBatch = SequenceRegistrationBatch(self)
+    for sequenceIndex, registrationParameters in enumerate(registrationParametersList):
+      registrationRun = self.createRegistrationRun(**registrationParameters)
+      if self.checkpointDirectory:
+        registrationRun.checkpointDirectory = os.path.join(self.checkpointDirectory, "sequence-{0:03d}".format(sequenceIndex))
+      if self.outputVolumeDirectory:
+        registrationRun.outputVolumeDirectory = os.path.join(self.outputVolumeDirectory, "sequence-{0:03d}".format(sequenceIndex))
+      registrationBatch.addRun(registrationRun)
+    return registrationBatch
+
+  def registerVolumeSequences(self, registrationParametersList):
+    """Register multiple volume sequences. Frames of all sequences share the same queue of registrations,
+    see createRegistrationBatch for description of the parameters.
+    """
+    self.runRegistration(self.createRegistrationBatch(registrationParametersList))
+
+  def createLazyResampler(self, inputVolSeq, outputTransformSeq, outputVolume=None, computeMovingToFixedTransform=True):
+    """Show motion-compensated frames of inputVolSeq in outputVolume by resampling the currently selected frame
+    using outputTransformSeq. Output volume is created if not specified.
+    Returns the resampler object. Call its stop() method when the output volume is not needed anymore.
+    """
+    browserNode = self.findBrowserForSequence(inputVolSeq)
+    if not browserNode:
+      raise ValueError("Input volume sequence is not shown in any sequence browser")
+    if not outputVolume:
+      outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", inputVolSeq.GetName()+" motion compensated")
+      outputVolume.CreateDefaultDisplayNodes()
+    return SequenceRegistrationLazyResampler(browserNode, inputVolSeq, outputTransformSeq, outputVolume, computeMovingToFixedTransform)
+
+  def createStreamedVolumeViewer(self, inputVolSeq, outputVolumeDirectory, outputVolume=None):
+    """Show motion-compensated frames that a registration run wrote into outputVolumeDirectory
+    in outputVolume, synchronized with the browser node of inputVolSeq. Output volume is created if not specified.
+    Returns the viewer object. Call its stop() method when the output volume is not needed anymore.
+    """
+    browserNode = self.findBrowserForSequence(inputVolSeq)
+    if not browserNode:
+      raise ValueError("Input volume sequence is not shown in any sequence browser")
+    if not outputVolume:
+      outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", inputVolSeq.GetName()+" motion compensated")
+      outputVolume.CreateDefaultDisplayNodes()
+    return SequenceRegistrationStreamedVolumeViewer(browserNode, SequenceRegistrationStreamedVolumeSequence(outputVolumeDirectory), outputVolume)
+
+  def getRegistrationPresetIndexByName(self, presetName):
+    presetNames = [preset.getName() for preset in self.getRegistrationPresets()]
+    if presetName not in presetNames:
+      raise ValueError("Registration preset '{0}' not found. Available presets: {1}".format(presetName, ", ".join(presetNames)))
+    return presetNames.index(presetName)
+
+  def readSequenceFromFile(self, filePath):
+    """Read a volume sequence file (.seq.nrrd) into a sequence node that is not added to the scene.
+    """
+    sequenceNode = slicer.vtkMRMLSequenceNode()
+    storageNode = slicer.vtkMRMLVolumeSequenceStorageNode()
+    storageNode.SetFileName(filePath)
+    if not storageNode.ReadData(sequenceNode):
+      raise ValueError("Failed to read volume sequence from "+filePath)
+    return sequenceNode
+
+  def writeSequenceToFile(self, sequenceNode, filePath):
+    """Write a sequence node to file. Volume sequences can be written to .seq.nrrd,
+    other sequences (such as transforms) are written to .seq.mrb file.
+    """
+    if filePath.lower().endswith(".nrrd") or filePath.lower().endswith(".nhdr"):
+      storageNode = slicer.vtkMRMLVolumeSequenceStorageNode()
+    else:
+      storageNode = slicer.vtkMRMLSequenceStorageNode()
+    storageNode.SetFileName(filePath)
+    if not storageNode.WriteData(sequenceNode):
+      raise ValueError("Failed to write sequence to "+filePath)
+
+  def registerVolumeSequenceFile(self, inputVolSeqFilePath, fixedVolumeItemNumber, presetName,
+    outputVolSeqFilePath = None, outputTransformSeqFilePath = None, computeMovingToFixedTransform = True,
+    startFrameIndex = None, endFrameIndex = None, reportFilePath = None):
+    """Register a volume sequence file without using the scene (no proxy or browser nodes are created).
+    Useful for batch processing (e.g., running Slicer with --no-main-window).
+    Output volume sequence is written to .seq.nrrd file, output transform sequence is written to .seq.mrb file.
+    The whole input sequence is loaded into memory, and the output sequences are kept in memory until they are written
+    at the end, therefore the sequences must fit into memory. For long sequences, set outputVolumeDirectory instead of
+    outputVolSeqFilePath to write each output frame as soon as it is computed (the input sequence is still loaded at once).
+    If reportFilePath is specified then per-frame timing and registration metric information is written into it (JSON).
+    """
+    if not outputVolSeqFilePath and not outputTransformSeqFilePath and not self.outputVolumeDirectory:
+      raise ValueError("At least one output (volume and/or transform sequence, or output volume folder) must be specified")
+    presetIndex = self.getRegistrationPresetIndexByName(presetName)
+    self.elastixLogic.addLog("Reading "+inputVolSeqFilePath)
+    inputVolSeq = self.readSequenceFromFile(inputVolSeqFilePath)
+    outputVolSeq = slicer.vtkMRMLSequenceNode() if outputVolSeqFilePath else None
+    outputTransformSeq = slicer.vtkMRMLSequenceNode() if outputTransformSeqFilePath else None
+    registrationRun = self.newRegistrationRun(inputVolSeq, outputVolSeq, outputTransformSeq, fixedVolumeItemNumber, presetIndex,
+      computeMovingToFixedTransform, startFrameIndex, endFrameIndex)
+    self.runRegistration(registrationRun)
+    if outputVolSeqFilePath:
+      self.elastixLogic.addLog("Writing "+outputVolSeqFilePath)
+      self.writeSequenceToFile(outputVolSeq, outputVolSeqFilePath)
+    if outputTransformSeqFilePath:
+      self.elastixLogic.addLog("Writing "+outputTransformSeqFilePath)
+      self.writeSequenceToFile(outputTransformSeq, outputTransformSeqFilePath)
+    if reportFilePath:
+      self.elastixLogic.addLog("Writing "+reportFilePath)
+      self.writeRegistrationReport(registrationRun.getReport(), reportFilePath)
+
+#
+# SequenceRegistrationRun
+#
+
+class SequenceRegistrationRun(object):
+  """Registration of frames of a volume sequence to a fixed frame.
+  Frames are registered in background processes: call start() then call poll() periodically
+  (for example from a timer) until it returns True. Sequence nodes do not have to be in the scene.
   """
 
-  def setUp(self):
-    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+  def __init__(self, logic, inputVolSeq, outputVolSeq, outputTransformSeq,
+    fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True, startFrameIndex=None, endFrameIndex=None, fixedVolumeMask=None,
+    registrationRegion=None, fixedVolume=None):
+    """fixedVolume: if specified then all frames are registered to this volume (such as a template)
+    and fixedVolumeItemNumber must be None.
     """
-    slicer.mrmlScene.Clear(0)
+    self.logic = logic
+    self.inputVolSeq = inputVolSeq
+    # Frames are read directly from the sequence data nodes. This avoids copying each frame into a proxy node
+    # (and the resulting scene updates) before writing it to file for elastix.
+    self.fixedVolume = fixedVolume if fixedVolume is not None else inputVolSeq.GetNthDataNode(fixedVolumeItemNumber)
+    self.outputVolSeq = outputVolSeq
+    self.outputTransformSeq = outputTransformSeq
+    self.fixedVolumeItemNumber = fixedVolumeItemNumber
+    self.presetIndex = presetIndex
+    self.computeMovingToFixedTransform = computeMovingToFixedTransform
+    numberOfDataNodes = inputVolSeq.GetNumberOfDataNodes()
+    self.startFrameIndex = startFrameIndex if startFrameIndex is not None else 0
+    self.endFrameIndex = endFrameIndex if endFrameIndex is not None else numberOfDataNodes-1
+    self.fixedVolumeMask = fixedVolumeMask
+    self.registrationRegion = registrationRegion
+    # IJK extent of the frames that is used for registration (None if frames are not cropped)
+    self.cropExtent = None
+    # VTK scalar type of all output volumes (set when the run is started)
+    self.outputScalarType = None
+    # Frames are registered using itk-elastix in background threads (instead of elastix executables)
+    self.inProcessRegistration = False
+    self.inProcessFixedImages = None
+    self.inProcessFixedVoxels = []
+    # Downsampled fixed volume voxels for motion screening (None if screening is disabled)
+    self.motionScreeningFixedVoxels = None
+    # Functions that are called (without arguments) when the run is completed or cancelled
+    self.cleanupCallbacks = []
+    # Function that is called (with this run as argument) each time a frame is completed
+    self.progressCallback = None
+    self.frameJobs = []
+    self.runningJobs = []
+    self.pendingJobs = []
+    self.numberOfStoredJobs = 0
+    self.tempDir = None
+    self.checkpointDirectory = logic.checkpointDirectory
+    self.checkpoint = None
+    # Motion-compensated frames are written into this folder (if set) as soon as they are computed
+    self.outputVolumeDirectory = logic.outputVolumeDirectory
+    self.streamedOutputVolumes = None
+    # If set then moving volume files are written into this folder, and reused if they are already there
+    self.stagedInputDirectory = None
+    # Keep transform parameter files of all frames after the run is completed (e.g., for initializing another run).
+    # The caller is responsible for removing tempDir then.
+    self.keepTransformParameters = False
+    # Compute displacement fields of all frames and keep them after the run is completed (e.g., for initializing another run).
+    # The caller is responsible for removing tempDir then.
+    self.keepDisplacementFields = False
+    # Transforms are smoothed over time after all frames are registered (if greater than 0)
+    # and output volumes are then computed from the smoothed transforms
+    self.temporalSmoothingSigma = logic.temporalSmoothingSigma
+    # Transforms that resample the moving frames into the fixed frame (the displacement fields computed by elastix).
+    # Same as outputTransformSeq if moving to fixed transforms are computed. Fixed to moving output transforms are
+    # the inverses of these, which would be slow and inaccurate to use for resampling, therefore the original transforms
+    # are kept in a separate sequence when they are needed: for temporal smoothing, and for resampling frames on demand
+    # after the run (if keepResamplingTransforms is True and output volumes are not computed).
+    self.resamplingTransformSeq = None
+    self.keepResamplingTransforms = True
+    self.checkpointManifest = None
+    self.temporalSmoothingTimings = None
+    # Temporal smoothing is performed in steps after all frames are registered, so that the application remains responsive:
+    # displacement fields are smoothed and inverted in background threads, and frames are resampled
+    # in the main thread for at most postProcessingTimeSliceSec in each poll() call
+    self.temporalSmoothingTask = None
+    self.temporalSmoothingInversionTasks = {}
+    self.temporalSmoothingPendingItemNumbers = None
+    self.numberOfPostProcessedFrames = 0
+    self.postProcessingTimeSliceSec = 0.1
+    self.startTime = None
+    self.completed = False
 
-  def runTest(self):
-    """Run as few or as many tests as needed here.
+  def start(self):
+    import time
+    elastixLogic = self.logic.elastixLogic
+    elastixLogic.logStandardOutput = self.logic.logStandardOutput
+    elastixLogic.logCallback = self.logic.logCallback
+    elastixLogic.abortRequested = False
+    self.startTime = time.time()
+    try:
+      self._setup()
+    except:
+      self.cancel()
+      raise
+
+  def _setup(self):
+    elastixLogic = self.logic.elastixLogic
+    preset = self.logic.getRegistrationPresets()[self.presetIndex]
+    parameterFilenames = self.logic.getParameterFilePaths(preset)
+    self._initializeCheckpoint(preset)
+
+    if self.computeMovingToFixedTransform and self.outputTransformSeq is not None:
+      self.resamplingTransformSeq = self.outputTransformSeq
+    elif self.temporalSmoothingSigma > 0 or (self.keepResamplingTransforms and self.outputTransformSeq is not None
+      and self.outputVolSeq is None and self.outputVolumeDirectory is None):
+      self.resamplingTransformSeq = slicer.vtkMRMLSequenceNode()
+
+    # Initialize output sequences
+    for seq in [self.outputVolSeq, self.outputTransformSeq, self.resamplingTransformSeq]:
+      if seq:
+        seq.RemoveAllDataNodes()
+        seq.SetIndexType(self.inputVolSeq.GetIndexType())
+        seq.SetIndexName(self.inputVolSeq.GetIndexName())
+        seq.SetIndexUnit(self.inputVolSeq.GetIndexUnit())
+
+    # Empty nodes that are inserted into the output sequences. Results are then loaded directly into the nodes
+    # that the output sequences own, because inserting a node that already contains data would copy all the data.
+    self.emptyOutputVolume = self.fixedVolume.CreateNodeInstance()
+    self.emptyOutputVolume.UnRegister(None)
+    self.emptyOutputTransform = slicer.vtkMRMLTransformNode()
+    # Output volumes that are copied from the input (instead of computed by elastix) and the first volume computed by elastix,
+    # which the geometry of copied volumes is matched to
+    self.copiedOutputVolumes = []
+    self.referenceOutputVolume = None
+    if self.outputVolumeDirectory:
+      self.streamedOutputVolumes = SequenceRegistrationStreamedVolumeSequence(self.outputVolumeDirectory)
+      self.streamedOutputVolumes.create(self.inputVolSeq.GetIndexName(), self.inputVolSeq.GetIndexUnit(), self.inputVolSeq.GetIndexType())
+
+    self.tempDir = elastixLogic.createTempDirectory()
+    elastixLogic.addLog("Sequence registration is started in working directory: "+self.tempDir)
+
+    self.movingVolIndices = list(range(self.startFrameIndex, self.endFrameIndex+1))
+    # Output volumes have the scalar type of the input frames (float if elastix cannot write that type), regardless of
+    # how they are computed (resampled by elastix, copied from the input, restored from the cache, or resampled using
+    # smoothed transforms)
+    self.outputScalarType = self.inputVolSeq.GetNthDataNode(self.startFrameIndex).GetImageData().GetScalarType()
+    if self.outputScalarType not in SequenceRegistrationFrameJob.resultImagePixelTypesOfVtkScalarTypes:
+      self.outputScalarType = vtk.VTK_FLOAT
+    registrationFixedVolume, registrationFixedVolumeMask = self._getRegistrationFixedVolumes()
+    fixedVolumePath, fixedVolumeMaskPath = self.logic.stageFixedVolume(registrationFixedVolume, registrationFixedVolumeMask, self.tempDir)
+    self.inProcessRegistration = self.logic.useInProcessRegistration()
+    if self.inProcessRegistration:
+      # Voxels of the fixed images are shared by all frame registrations
+      fixedImage, fixedVoxels = self.logic.createItkImage(registrationFixedVolume)
+      self.inProcessFixedImages = (fixedImage, None)
+      self.inProcessFixedVoxels = [fixedVoxels]
+      if registrationFixedVolumeMask:
+        fixedMaskImage, fixedMaskVoxels = self.logic.createItkImage(registrationFixedVolumeMask, "uint8")
+        self.inProcessFixedImages = (fixedImage, fixedMaskImage)
+        self.inProcessFixedVoxels.append(fixedMaskVoxels)
+      elastixLogic.addLog("Registering in-process, using itk-elastix")
+    if self.logic.motionScreeningThreshold > 0:
+      self.motionScreeningFixedVoxels = self.logic.getDownsampledVoxels(registrationFixedVolume)
+    self._createFrameJobs(fixedVolumePath, fixedVolumeMaskPath, parameterFilenames, registrationFixedVolumeMask)
+    self.pendingJobs = list(self.frameJobs)
+    if self.logic.initializeFromNeighborFrame and self.fixedVolumeItemNumber is not None:
+      self._setupNeighborFrameInitialization(parameterFilenames)
+    self.numberOfParallelRegistrations = self.logic.getNumberOfParallelRegistrations()
+    elastixLogic.addLog("Running {0} registration(s) in parallel".format(self.numberOfParallelRegistrations))
+
+  def _getRegistrationFixedVolumes(self):
+    """Returns fixed volume and mask that are used as registration inputs (cropped to the registration region).
     """
-    self.setUp()
-    self.test_SequenceRegistration()
+    if not self.registrationRegion:
+      return self.fixedVolume, self.fixedVolumeMask
+    self.cropExtent = self.logic.getCroppingExtent(self.fixedVolume, self.registrationRegion)
+    fixedDimensions = self.fixedVolume.GetImageData().GetDimensions()
+    self.logic.elastixLogic.addLog("Frames are cropped to {0}x{1}x{2} voxels (full size: {3}x{4}x{5})".format(
+      *([self.cropExtent[axis*2+1]-self.cropExtent[axis*2]+1 for axis in range(3)] + list(fixedDimensions))))
+    croppedFixedVolume = self.logic.cropVolume(self.fixedVolume, self.cropExtent)
+    if self.fixedVolumeMask:
+      croppedFixedVolumeMask = self.logic.cropVolume(self.fixedVolumeMask,
+        self.logic.getCroppingExtent(self.fixedVolumeMask, self.registrationRegion))
+    elif self.registrationRegion.IsA("vtkMRMLSegmentationNode"):
+      croppedFixedVolumeMask = self.logic.createMaskFromSegmentation(self.registrationRegion, croppedFixedVolume)
+    else:
+      # The cropped region is the ROI, no mask is needed
+      croppedFixedVolumeMask = None
+    return croppedFixedVolume, croppedFixedVolumeMask
 
-  def test_SequenceRegistration(self):
-    """ Ideally you should have several levels of tests.  At the lowest level
-    tests should exercise the functionality of the logic with different inputs
-    (both valid and invalid).  At higher levels your tests should emulate the
-    way the user would interact with your code and confirm that it still works
-    the way you intended.
-    One of the most important features of the tests is that it should alert other
-    developers when their changes will have an impact on the behavior of your
-    module.  For example, if a developer removes a feature that you depend on,
-    your test should break so they know that the feature is needed.
+  def _createFrameJobs(self, fixedVolumePath, fixedVolumeMaskPath, parameterFilenames, registrationFixedVolumeMask):
+    resultCache = self.logic.getResultCache()
+    if resultCache:
+      # Frame results depend on these inputs, in addition to the moving frame and parameter files
+      import hashlib
+      runHash = hashlib.sha256()
+      runHash.update(str([self.logic.elastixLogic.getElastixBinDir(), self.inProcessRegistration, self.computeMovingToFixedTransform,
+        self.cropExtent, self.logic.transformGridShrinkFactor, self.outputScalarType]).encode())
+      self.logic.updateHashWithVolume(runHash, self.fixedVolume)
+      if registrationFixedVolumeMask:
+        self.logic.updateHashWithVolume(runHash, registrationFixedVolumeMask)
+      runCacheKey = runHash.hexdigest()
+    for movingVolumeItemNumber in self.movingVolIndices:
+      job = SequenceRegistrationFrameJob(self.logic, movingVolumeItemNumber,
+        os.path.join(self.tempDir, "frame-{0:04d}".format(movingVolumeItemNumber)), fixedVolumePath, parameterFilenames,
+        computeVolume = self._isOutputVolumeComputedByFrameJobs(),
+        computeTransform = self.outputTransformSeq is not None or self.resamplingTransformSeq is not None,
+        isFixedFrame = (movingVolumeItemNumber == self.fixedVolumeItemNumber), fixedVolumeMaskPath = fixedVolumeMaskPath)
+      if resultCache:
+        job.setResultCache(resultCache, runCacheKey)
+      if self.checkpoint:
+        job.setCheckpoint(self.checkpoint, movingVolumeItemNumber in self.checkpointManifest["completedFrames"])
+      job.stagedInputDirectory = self.stagedInputDirectory
+      job.resultImageScalarType = self.outputScalarType
+      if self.keepDisplacementFields:
+        job.computeTransform = True
+        job.keepDisplacementField = True
+      # Fixed to moving transforms are inverted in the frame job (in a background thread), unless they are
+      # smoothed first
+      job.invertResultTransform = (self.outputTransformSeq is not None and not self.computeMovingToFixedTransform
+        and self.temporalSmoothingSigma <= 0)
+      if self.inProcessRegistration:
+        job.setInProcessRegistration(*self.inProcessFixedImages)
+      if self.cropExtent:
+        # Transforms are computed on cropped frames, but results are needed on the full frame
+        job.outputGeometry = (self.fixedVolume.GetImageData().GetDimensions(), self.fixedVolume.GetOrigin())
+      self.frameJobs.append(job)
+
+  def _initializeCheckpoint(self, preset):
+    """Prepare checkpoint folder. When resuming, the list of completed frames is read from the manifest file.
     """
+    import json
+    self.checkpoint = None
+    self.checkpointManifest = None
+    if not self.checkpointDirectory:
+      return
+    self.checkpoint = SequenceRegistrationResultCache(self.checkpointDirectory, None)
+    self.checkpointManifestPath = os.path.join(self.checkpointDirectory, "manifest.json")
+    settings = {
+      "inputVolumeSequence": self.inputVolSeq.GetName(),
+      "numberOfFrames": self.inputVolSeq.GetNumberOfDataNodes(),
+      "fixedFrameIndex": self.fixedVolumeItemNumber,
+      "preset": preset.getName(),
+      "computeMovingToFixedTransform": self.computeMovingToFixedTransform,
+      "initializeFromNeighborFrame": self.logic.initializeFromNeighborFrame,
+      "neighborInitializedMaximumNumberOfIterationsScale": (self.logic.neighborInitializedMaximumNumberOfIterationsScale
+        if self.logic.initializeFromNeighborFrame else None),
+      "registrationRegion": self.registrationRegion.GetName() if self.registrationRegion else None,
+      "motionScreeningThreshold": self.logic.motionScreeningThreshold,
+      "transformGridShrinkFactor": self.logic.transformGridShrinkFactor,
+      }
+    self.checkpointManifest = {"settings": settings, "completedFrames": []}
+    if self.logic.resumeFromCheckpoint and os.path.exists(self.checkpointManifestPath):
+      with open(self.checkpointManifestPath) as manifestFile:
+        manifest = json.load(manifestFile)
+      if manifest["settings"] != settings:
+        raise ValueError("Registration cannot be resumed from {0}: it was created with different settings ({1})".format(
+          self.checkpointDirectory, manifest["settings"]))
+      self.checkpointManifest["completedFrames"] = manifest["completedFrames"]
+      self.logic.elastixLogic.addLog("Resuming registration, {0} frame(s) are already completed".format(len(manifest["completedFrames"])))
+    elif not os.path.isdir(self.checkpointDirectory):
+      os.makedirs(self.checkpointDirectory)
+    self._writeCheckpointManifest()
 
-    self.delayDisplay("Starting the test")
-    slicer.app.setOverrideCursor(qt.Qt.WaitCursor)
-    #
-    # first, get some data
-    #
+  def _saveCheckpoint(self, job):
+    if not self.checkpoint:
+      return
+    if not job.isFixedFrame and not job.registrationSkipped and not job.restoredFromCheckpoint:
+      self.checkpoint.store(job.getCheckpointKey(), job.resultTransformDir, job.resultResampleDir)
+    if job.movingVolumeItemNumber not in self.checkpointManifest["completedFrames"]:
+      self.checkpointManifest["completedFrames"] = sorted(self.checkpointManifest["completedFrames"] + [job.movingVolumeItemNumber])
+    self._writeCheckpointManifest()
 
-    import SampleData
-    sampleDataLogic = SampleData.SampleDataLogic()
-    inputVolSeq = sampleDataLogic.downloadSample("CTCardioSeq")
+  def _writeCheckpointManifest(self):
+    import json
+    # Write into a temporary file and rename, to never leave an incomplete manifest behind
+    with open(self.checkpointManifestPath + ".tmp", 'w') as manifestFile:
+      json.dump(self.checkpointManifest, manifestFile, indent=2)
+    os.replace(self.checkpointManifestPath + ".tmp", self.checkpointManifestPath)
 
-    outputVolSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "OutVolSeq")
-    outputTransformSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "OutTransformSeq")
+  def _setupNeighborFrameInitialization(self, parameterFilenames):
+    """Register frames in order of distance from the fixed frame and initialize each registration
+    with the displacement field of the neighbor frame (that is closer to the fixed frame).
+    The displacement field includes all the transforms of the neighbor, therefore transforms are not chained
+    and the cost of evaluating the initial transform does not grow with the distance from the fixed frame.
+    """
+    if self.logic.neighborInitializedMaximumNumberOfIterationsScale != 1.0:
+      neighborInitializedParameterFilenames = self.logic.stageParameterFiles(parameterFilenames,
+        os.path.join(self.tempDir, 'parameters'), self.logic.neighborInitializedMaximumNumberOfIterationsScale)
+    else:
+      neighborInitializedParameterFilenames = parameterFilenames
+    jobsByItemNumber = {job.movingVolumeItemNumber: job for job in self.frameJobs}
+    for job in self.frameJobs:
+      if job.isFixedFrame:
+        continue
+      neighborItemNumber = job.movingVolumeItemNumber + (-1 if job.movingVolumeItemNumber > self.fixedVolumeItemNumber else 1)
+      neighborJob = jobsByItemNumber.get(neighborItemNumber)
+      if neighborJob is None or neighborJob.isFixedFrame:
+        continue
+      job.initialTransformJob = neighborJob
+      job.initializeFromDisplacementField = True
+      # Only used if the neighbor actually provides an initial transform (it may be skipped or restored without displacement field)
+      job.initializedParameterFilenames = neighborInitializedParameterFilenames
+      neighborJob.dependentJobs.append(job)
+      # Displacement field of the neighbor is needed even if transforms are not requested as output
+      neighborJob.computeTransform = True
+    self.pendingJobs.sort(key=lambda job: abs(job.movingVolumeItemNumber - self.fixedVolumeItemNumber))
 
-    for i in range(inputVolSeq.GetNumberOfDataNodes())[3:]:
-      inputVolSeq.RemoveDataNodeAtValue(str(i))
+  def _isOutputVolumeComputedByFrameJobs(self):
+    # If transforms are smoothed then output volumes are computed from the smoothed transforms instead
+    return (self.outputVolSeq is not None or self.streamedOutputVolumes is not None) and self.temporalSmoothingSigma <= 0
 
-    self.delayDisplay('Starting registration...')
+  def poll(self, maximumNumberOfRunningJobs=None):
+    """Start new frame registrations, store results of completed ones.
+    Returns True if all frames are completed. If an error occurs then the run is cancelled and an exception is raised.
+    maximumNumberOfRunningJobs: new registrations are only started if fewer registrations are running
+    (default: numberOfParallelRegistrations).
+    """
+    if self.completed:
+      return True
+    if maximumNumberOfRunningJobs is None:
+      maximumNumberOfRunningJobs = self.numberOfParallelRegistrations
+    try:
+      for job in list(self.pendingJobs):
+        if len(self.runningJobs) >= maximumNumberOfRunningJobs:
+          break
+        if not job.isReadyToStart():
+          continue
+        self.pendingJobs.remove(job)
+        self._startFrameJob(job)
+        self.runningJobs.append(job)
+      for job in list(self.runningJobs):
+        if job.poll():
+          self.runningJobs.remove(job)
+          self._saveCheckpoint(job)
+          if self.progressCallback:
+            self.progressCallback(self)
+      # Store results in the original order, even if a later frame is completed earlier
+      while self.numberOfStoredJobs < len(self.frameJobs) and self.frameJobs[self.numberOfStoredJobs].isCompleted():
+        self._completeFrameJob(self.frameJobs[self.numberOfStoredJobs])
+        self.numberOfStoredJobs += 1
+      if self.numberOfStoredJobs < len(self.frameJobs):
+        return False
+      if self.temporalSmoothingSigma > 0 and not self._pollTemporalSmoothing():
+        return False
+    except:
+      self.cancel()
+      raise
+    self.completed = True
+    self._cleanup()
+    return True
 
-    import Elastix
-    logic = SequenceRegistrationLogic()
-    logic.registerVolumeSequence(inputVolSeq, outputVolSeq, outputTransformSeq, 1, 0)
+  def _pollTemporalSmoothing(self):
+    """Advance smoothing of the transforms over time and computing output volumes from the smoothed transforms.
+    Returns True if completed.
+    """
+    import time
+    elastixLogic = self.logic.elastixLogic
+    executor = self.logic.getInProcessRegistrationExecutor()
+    if self.temporalSmoothingPendingItemNumbers is None:
+      if self.temporalSmoothingTask is None:
+        elastixLogic.addLog("Smoothing transforms over time...")
+        self.temporalSmoothingStartTime = time.time()
+        self.temporalSmoothingTransformNodes = [self.resamplingTransformSeq.GetDataNodeAtValue(self.inputVolSeq.GetNthIndexValue(itemNumber))
+          for itemNumber in self.movingVolIndices]
+        # Transform of the fixed frame remains identity
+        fixedTransformIndex = (self.movingVolIndices.index(self.fixedVolumeItemNumber)
+          if self.fixedVolumeItemNumber in self.movingVolIndices else None)
+        # Transforms are smoothed into new transform objects, the transform nodes are only updated (in the main thread)
+        # when all of them are computed, so cancelling smoothing leaves the transforms unchanged
+        self.temporalSmoothingTask = executor.submit(self.logic.smoothTransforms,
+          [transformNode.GetTransformFromParent() for transformNode in self.temporalSmoothingTransformNodes], self.temporalSmoothingSigma,
+          fixedTransformIndex)
+        return False
+      if not self.temporalSmoothingTask.done():
+        return False
+      smoothedTransforms = self.temporalSmoothingTask.result()
+      self.temporalSmoothingTask = None
+      self.logic.setSmoothedTransforms(self.temporalSmoothingTransformNodes, smoothedTransforms)
+      self.temporalSmoothingTimings = {"smoothing": time.time() - self.temporalSmoothingStartTime, "resample": 0.0}
+      if self.outputTransformSeq is not None and self.outputTransformSeq is not self.resamplingTransformSeq:
+        # Fixed to moving output transforms are the inverses of the smoothed transforms
+        for itemNumber, smoothedTransform in zip(self.movingVolIndices, smoothedTransforms):
+          if smoothedTransform.IsA("vtkOrientedGridTransform"):
+            self.temporalSmoothingInversionTasks[itemNumber] = executor.submit(self.logic.createInverseGridTransform, smoothedTransform)
+          else:
+            outputTransform = self.outputTransformSeq.GetDataNodeAtValue(self.inputVolSeq.GetNthIndexValue(itemNumber))
+            outputTransform.SetAndObserveTransformFromParent(smoothedTransform)
+            self.logic.invertTransform(outputTransform)
+      if self.outputVolSeq is not None or self.streamedOutputVolumes is not None:
+        elastixLogic.addLog("Resampling frames using smoothed transforms...")
+        self.temporalSmoothingPendingItemNumbers = list(self.movingVolIndices)
+      else:
+        self.temporalSmoothingPendingItemNumbers = []
 
-    slicer.app.restoreOverrideCursor()
-    self.delayDisplay('Test passed!')
+    startTime = time.time()
+    for itemNumber, inversionTask in list(self.temporalSmoothingInversionTasks.items()):
+      if not inversionTask.done():
+        continue
+      outputTransform = self.outputTransformSeq.GetDataNodeAtValue(self.inputVolSeq.GetNthIndexValue(itemNumber))
+      outputTransform.SetAndObserveTransformFromParent(inversionTask.result())
+      del self.temporalSmoothingInversionTasks[itemNumber]
+    while self.temporalSmoothingPendingItemNumbers and time.time() - startTime < self.postProcessingTimeSliceSec:
+      self._resampleSmoothedFrame(self.temporalSmoothingPendingItemNumbers.pop(0))
+    self.temporalSmoothingTimings["resample"] += time.time() - startTime
+    self.numberOfPostProcessedFrames = len(self.movingVolIndices) - max(len(self.temporalSmoothingPendingItemNumbers),
+      len(self.temporalSmoothingInversionTasks))
+    if self.progressCallback:
+      self.progressCallback(self)
+    return not self.temporalSmoothingPendingItemNumbers and not self.temporalSmoothingInversionTasks
+
+  def _resampleSmoothedFrame(self, movingVolumeItemNumber):
+    indexValue = self.inputVolSeq.GetNthIndexValue(movingVolumeItemNumber)
+    imageData, ijkToRas = SequenceRegistrationLazyResampler.resampleFrame(self.inputVolSeq.GetNthDataNode(movingVolumeItemNumber),
+      self.resamplingTransformSeq.GetDataNodeAtValue(indexValue))
+    if self.outputVolSeq:
+      outputVolume = self.outputVolSeq.SetDataNodeAtValue(self.emptyOutputVolume, indexValue)
+      outputVolume.SetName(slicer.mrmlScene.GetUniqueNameByString("Volume"))
+    else:
+      outputVolume = slicer.vtkMRMLScalarVolumeNode()
+    outputVolume.SetIJKToRASMatrix(ijkToRas)
+    outputVolume.SetAndObserveImageData(self._castToOutputScalarType(imageData))
+    if self.streamedOutputVolumes:
+      self.streamedOutputVolumes.addFrameFromVolume(indexValue, outputVolume)
+
+  def getPostProcessingProgress(self):
+    """Returns (number of processed frames, number of frames) of the temporal smoothing step, which runs
+    after all frames are registered. Returns None if this step is not in progress.
+    """
+    if self.completed or self.temporalSmoothingSigma <= 0 or not self.frameJobs or self.numberOfStoredJobs < len(self.frameJobs):
+      return None
+    return (self.numberOfPostProcessedFrames, len(self.movingVolIndices))
+
+  def cancel(self):
+    """Stop all running registration processes immediately and remove temporary data.
+    """
+    for job in self.runningJobs:
+      job.kill()
+    self.runningJobs = []
+    self.pendingJobs = []
+    # Background computations of temporal smoothing cannot be interrupted once started, their results are ignored
+    for task in [self.temporalSmoothingTask] + list(self.temporalSmoothingInversionTasks.values()):
+      if task is not None and not task.cancel():
+        self.logic.releaseInProcessRegistrationExecutor()
+    self.temporalSmoothingTask = None
+    self.temporalSmoothingInversionTasks = {}
+    self._cleanup()
+
+  def isCompleted(self):
+    return self.completed
+
+  def getNumberOfFrames(self):
+    return len(self.frameJobs)
+
+  def getNumberOfCompletedFrames(self):
+    return len([job for job in self.frameJobs if job.isCompleted()])
+
+  def getElapsedTime(self):
+    """Elapsed time since start, in seconds."""
+    import time
+    return time.time() - self.startTime
+
+  def getNumberOfRegisteredFrames(self):
+    """Number of completed frames, not including frames that are completed without computation (fixed and skipped frames)."""
+    return len([job for job in self.frameJobs if job.isCompleted() and not job.isFixedFrame and not job.registrationSkipped])
+
+  def getEstimatedRemainingTime(self):
+    """Estimated time until all frames are completed, in seconds. Returns None if no estimate is available yet."""
+    numberOfRegisteredFrames = self.getNumberOfRegisteredFrames()
+    if numberOfRegisteredFrames == 0:
+      return None
+    numberOfRemainingFrames = len([job for job in self.frameJobs if not job.isCompleted()])
+    return self.getElapsedTime() / numberOfRegisteredFrames * numberOfRemainingFrames
+
+  def getReport(self):
+    """Returns settings and per-frame information (time spent in each processing step, size of temporary files,
+    elastix optimization results) of the frames that are stored in the output sequences so far.
+    """
+    frames = []
+    for job in self.frameJobs[:self.numberOfStoredJobs]:
+      finalMetricValue = job.elastixResolutionLevels[-1]["finalMetricValue"] if job.elastixResolutionLevels else None
+      frames.append({
+        "itemNumber": job.movingVolumeItemNumber,
+        "indexValue": self.inputVolSeq.GetNthIndexValue(job.movingVolumeItemNumber),
+        "source": job.resultSource,
+        "timingsSec": job.timings,
+        "bytesWritten": job.numberOfBytesWritten,
+        "finalMetricValue": finalMetricValue,
+        "motionScreeningMetricValue": job.motionScreeningMetricValue,
+        "elastix": job.elastixResolutionLevels,
+        })
+    return {
+      "inputVolumeSequence": self.inputVolSeq.GetName(),
+      "fixedFrameIndex": self.fixedVolumeItemNumber,
+      "preset": self.logic.getRegistrationPresets()[self.presetIndex].getName(),
+      "numberOfParallelRegistrations": self.logic.getNumberOfParallelRegistrations(),
+      "numberOfThreadsPerRegistration": self.logic.numberOfThreadsPerRegistration,
+      "elapsedTimeSec": self.getElapsedTime() if self.startTime is not None else None,
+      "temporalSmoothingSigma": self.temporalSmoothingSigma,
+      "temporalSmoothingTimingsSec": self.temporalSmoothingTimings,
+      "frames": frames,
+      }
+
+  def _startFrameJob(self, job):
+    self.logic.elastixLogic.addLog("Registering item {0} of {1}".format(job.movingVolumeItemNumber-self.movingVolIndices[0]+1, len(self.movingVolIndices)))
+    if job.isFixedFrame:
+      job.start(self.fixedVolume)
+      return
+    movingVolume = self.inputVolSeq.GetNthDataNode(job.movingVolumeItemNumber)
+    registrationMovingVolume = self.logic.cropVolume(movingVolume, self.cropExtent) if self.cropExtent else None
+    if self.motionScreeningFixedVoxels is not None:
+      job.motionScreeningMetricValue = self.logic.computeMotionScreeningMetric(self.motionScreeningFixedVoxels,
+        self.logic.getDownsampledVoxels(registrationMovingVolume if registrationMovingVolume else movingVolume))
+      if job.motionScreeningMetricValue < self.logic.motionScreeningThreshold:
+        self.logic.elastixLogic.addLog("Item {0} is not registered, difference from the fixed frame is below threshold ({1:.3f})".format(
+          job.movingVolumeItemNumber, job.motionScreeningMetricValue))
+        job.skipRegistration()
+        return
+    job.start(movingVolume, registrationMovingVolume)
+
+  def _completeFrameJob(self, job):
+    import time
+    elastixLogic = self.logic.elastixLogic
+    inputVolSeq = self.inputVolSeq
+    outputVolSeq = self.outputVolSeq
+    outputTransformSeq = self.outputTransformSeq
+    movingVolumeItemNumber = job.movingVolumeItemNumber
+    indexValue = inputVolSeq.GetNthIndexValue(movingVolumeItemNumber)
+    elastixLogic.addLog("---------------------")
+    elastixLogic.addLog("Completed item {0} of {1}".format(movingVolumeItemNumber-self.movingVolIndices[0]+1, len(self.movingVolIndices)))
+    if not job.isFixedFrame and not job.registrationSkipped:
+      job.numberOfBytesWritten = self.logic.getDirectorySize(job.workingDir)
+      loadTime = 0.0
+      insertTime = 0.0
+      if outputVolSeq and job.computeVolume:
+        startTime = time.time()
+        outputVolume = outputVolSeq.SetDataNodeAtValue(self.emptyOutputVolume, indexValue)
+        insertTime += time.time() - startTime
+        startTime = time.time()
+        if job.resultImage is not None:
+          self.logic.updateVolumeFromItkImage(outputVolume, job.resultImage, job.resultImagePixelType)
+        else:
+          self.logic.readVolumeFromFile(outputVolume, job.getOutputVolumePath())
+        if outputVolume.GetImageData().GetScalarType() != self.outputScalarType:
+          # Only needed if the file has a different type than requested from transformix (e.g., signed and unsigned char)
+          outputVolume.SetAndObserveImageData(self._castToOutputScalarType(outputVolume.GetImageData()))
+        loadTime += time.time() - startTime
+        if self.referenceOutputVolume is None:
+          self.referenceOutputVolume = outputVolume
+          for copiedOutputVolume in self.copiedOutputVolumes:
+            self._matchCopiedOutputVolumeGeometry(copiedOutputVolume)
+      if self.streamedOutputVolumes and job.computeVolume:
+        # Voxels are moved into the output folder, so this must be done after the volume is read into outputVolSeq
+        startTime = time.time()
+        if job.resultImage is not None:
+          streamedOutputVolume = slicer.vtkMRMLScalarVolumeNode()
+          self.logic.updateVolumeFromItkImage(streamedOutputVolume, job.resultImage, job.resultImagePixelType)
+          self.streamedOutputVolumes.addFrameFromVolume(indexValue, streamedOutputVolume)
+        else:
+          self.streamedOutputVolumes.addFrameFromMetaImage(indexValue, job.getOutputVolumePath())
+        insertTime += time.time() - startTime
+      if outputTransformSeq or self.resamplingTransformSeq:
+        startTime = time.time()
+        resamplingTransform = job.resultTransform if job.resultTransform is not None else job.loadResultTransform()
+        loadTime += time.time() - startTime
+        startTime = time.time()
+        self._storeFrameTransform(indexValue, resamplingTransform, job.resultInverseTransform)
+        insertTime += time.time() - startTime
+      job.timings["load"] = loadTime
+      job.timings["insert"] = insertTime
+      job.releaseResults()
+    else:
+      if job.isFixedFrame:
+        elastixLogic.addLog("Same as fixed volume.")
+        inputFrameVolume = self.fixedVolume
+      else:
+        elastixLogic.addLog("Same as input volume.")
+        inputFrameVolume = inputVolSeq.GetNthDataNode(movingVolumeItemNumber)
+      if self._isOutputVolumeComputedByFrameJobs():
+        if outputVolSeq:
+          outputVolume = outputVolSeq.SetDataNodeAtValue(self.emptyOutputVolume, indexValue)
+          outputVolume.SetName(slicer.mrmlScene.GetUniqueNameByString("Volume"))
+        else:
+          outputVolume = slicer.vtkMRMLScalarVolumeNode()
+        ijkToRas = vtk.vtkMatrix4x4()
+        inputFrameVolume.GetIJKToRASMatrix(ijkToRas)
+        outputVolume.SetIJKToRASMatrix(ijkToRas)
+        # Converting the scalar type copies the voxels, so no additional copy is needed
+        inputImageData = inputFrameVolume.GetImageData()
+        if inputImageData.GetScalarType() == self.outputScalarType:
+          outputImageData = vtk.vtkImageData()
+          outputImageData.DeepCopy(inputImageData)
+        else:
+          outputImageData = self._castToOutputScalarType(inputImageData)
+        outputVolume.SetAndObserveImageData(outputImageData)
+        if outputVolSeq:
+          self.copiedOutputVolumes.append(outputVolume)
+          if self.referenceOutputVolume is not None:
+            self._matchCopiedOutputVolumeGeometry(outputVolume)
+        if self.streamedOutputVolumes:
+          self.streamedOutputVolumes.addFrameFromVolume(indexValue, outputVolume)
+
+      if outputTransformSeq or self.resamplingTransformSeq:
+        # Set identity as transform (vtkTransform is initialized to identity transform by default)
+        self._storeFrameTransform(indexValue, vtk.vtkTransform())
+    if elastixLogic.deleteTemporaryFiles:
+      self._removeTemporaryFiles(job)
+      initialTransformJob = job.getInitialTransformJob()
+      if initialTransformJob in self.frameJobs[:self.numberOfStoredJobs]:
+        # This job does not need the displacement field of its initial transform job anymore
+        self._removeTemporaryFiles(initialTransformJob)
+
+  def _castToOutputScalarType(self, imageData):
+    """Returns imageData converted to the output scalar type (imageData itself if it already has that type)."""
+    if imageData.GetScalarType() == self.outputScalarType:
+      return imageData
+    imageCast = vtk.vtkImageCast()
+    imageCast.SetInputData(imageData)
+    imageCast.SetOutputScalarType(self.outputScalarType)
+    imageCast.ClampOverflowOn()
+    imageCast.Update()
+    return imageCast.GetOutput()
+
+  def _removeTemporaryFiles(self, job):
+    # Displacement field of a frame is needed until all registrations that are initialized from it are completed
+    keepDisplacementField = job.keepDisplacementField or any(not dependentJob.isCompleted() for dependentJob in job.dependentJobs)
+    job.removeTemporaryFiles(keepTransformParameters=self.keepTransformParameters, keepDisplacementField=keepDisplacementField)
+
+  def _storeFrameTransform(self, indexValue, resamplingTransform, inverseTransform=None):
+    """Store the transform that resamples the moving frame into the fixed frame in the transform sequences.
+    inverseTransform: inverse of resamplingTransform, if it is already computed.
+    """
+    if self.resamplingTransformSeq is not None:
+      resamplingTransformNode = self.resamplingTransformSeq.SetDataNodeAtValue(self.emptyOutputTransform, indexValue)
+      resamplingTransformNode.SetAndObserveTransformFromParent(resamplingTransform)
+    if self.outputTransformSeq is None or self.outputTransformSeq is self.resamplingTransformSeq:
+      return
+    outputTransform = self.outputTransformSeq.SetDataNodeAtValue(self.emptyOutputTransform, indexValue)
+    if self.temporalSmoothingSigma > 0:
+      # Inverse is computed from the smoothed transform
+      return
+    if inverseTransform is not None:
+      outputTransform.SetAndObserveTransformFromParent(inverseTransform)
+    else:
+      outputTransform.SetAndObserveTransformFromParent(resamplingTransform)
+      self.logic.invertTransform(outputTransform)
+
+  def _matchCopiedOutputVolumeGeometry(self, copiedOutputVolume):
+    # Make origin and spacing match exactly the volumes computed by elastix (they may differ due to rounding in files)
+    copiedOutputVolume.SetOrigin(self.referenceOutputVolume.GetOrigin())
+    copiedOutputVolume.SetSpacing(self.referenceOutputVolume.GetSpacing())
+
+  def _cleanup(self):
+    self.inProcessFixedImages = None
+    self.inProcessFixedVoxels = []
+    if self.resamplingTransformSeq is not self.outputTransformSeq and (self.outputVolSeq or self.streamedOutputVolumes):
+      # Output volumes are computed, original transforms are not needed for resampling frames on demand
+      self.resamplingTransformSeq = None
+    # Temporary files
+    if (self.tempDir and self.logic.elastixLogic.deleteTemporaryFiles and not self.keepTransformParameters
+      and not self.keepDisplacementFields):
+      import shutil
+      shutil.rmtree(self.tempDir, ignore_errors=True)
+      self.tempDir = None
+    cleanupCallbacks = self.cleanupCallbacks
+    self.cleanupCallbacks = []
+    for cleanupCallback in cleanupCallbacks:
+      cleanupCallback()
+
+#
+# SequenceRegistrationGroupwiseRun
+#
+
+class SequenceRegistrationGroupwiseRun(object):
+  """Registration of frames of a volume sequence to a template, which is the average of the registered frames.
+  This removes the dependence of the results on the choice of the fixed frame.
+  The initial template is the average of the input frames. In each iteration, all frames are registered to the current template
+  (each registration is initialized with the displacement field computed in the previous iteration, which includes
+  the transforms of all earlier iterations, so transforms are not chained) and the template is updated
+  to the average of the registered frames. Outputs are computed in the last iteration. The fixed frame only defines
+  the image grid of the template, therefore all frames must have the same size.
+  It has the same interface as SequenceRegistrationRun: call start() then call poll() periodically until it returns True.
+  """
+
+  def __init__(self, logic, inputVolSeq, outputVolSeq, outputTransformSeq,
+    fixedVolumeItemNumber, presetIndex, computeMovingToFixedTransform = True, startFrameIndex=None, endFrameIndex=None, fixedVolumeMask=None,
+    registrationRegion=None, numberOfIterations=3):
+    self.logic = logic
+    self.inputVolSeq = inputVolSeq
+    self.outputVolSeq = outputVolSeq
+    self.outputTransformSeq = outputTransformSeq
+    self.fixedVolumeItemNumber = fixedVolumeItemNumber
+    self.presetIndex = presetIndex
+    self.computeMovingToFixedTransform = computeMovingToFixedTransform
+    self.startFrameIndex = startFrameIndex if startFrameIndex is not None else 0
+    self.endFrameIndex = endFrameIndex if endFrameIndex is not None else inputVolSeq.GetNumberOfDataNodes()-1
+    self.fixedVolumeMask = fixedVolumeMask
+    self.registrationRegion = registrationRegion
+    self.numberOfIterations = max(1, numberOfIterations)
+    # Functions that are called (without arguments) when the run is completed or cancelled
+    self.cleanupCallbacks = []
+    # Function that is called (with this run as argument) each time a frame is completed
+    self.progressCallback = None
+    self.checkpointDirectory = logic.checkpointDirectory
+    self.outputVolumeDirectory = logic.outputVolumeDirectory
+    # Average of the registered frames (volume node that is not added to the scene)
+    self.templateVolume = None
+    # Registration run of each iteration
+    self.iterationRuns = []
+    self.tempDir = None
+    self.startTime = None
+    self.completed = False
+
+  @property
+  def runningJobs(self):
+    return self.iterationRuns[-1].runningJobs if self.iterationRuns else []
+
+  @property
+  def resamplingTransformSeq(self):
+    return self.iterationRuns[-1].resamplingTransformSeq if self.iterationRuns else None
+
+  def start(self):
+    import time
+    self.startTime = time.time()
+    try:
+      self.tempDir = self.logic.elastixLogic.createTempDirectory()
+      os.makedirs(os.path.join(self.tempDir, 'input'))
+      fixedVolume = self.inputVolSeq.GetNthDataNode(self.fixedVolumeItemNumber)
+      self.templateVolume = slicer.vtkMRMLScalarVolumeNode()
+      self.templateVolume.SetName(self.inputVolSeq.GetName() + " template")
+      ijkToRas = vtk.vtkMatrix4x4()
+      fixedVolume.GetIJKToRASMatrix(ijkToRas)
+      self.templateVolume.SetIJKToRASMatrix(ijkToRas)
+      self._updateTemplate(self._getInputFrameVoxels())
+      self._startIteration()
+    except:
+      self.cancel()
+      raise
+
+  def _getInputFrameVoxels(self):
+    from vtk.util import numpy_support
+    for itemNumber in range(self.startFrameIndex, self.endFrameIndex+1):
+      yield numpy_support.vtk_to_numpy(self.inputVolSeq.GetNthDataNode(itemNumber).GetImageData().GetPointData().GetScalars())
+
+  def _getRegisteredFrameVoxels(self, registrationRun):
+    """Voxels of the frames that registrationRun has written into its output folder. Frames are memory-mapped."""
+    from vtk.util import numpy_support
+    streamedVolumes = SequenceRegistrationStreamedVolumeSequence(registrationRun.outputVolumeDirectory)
+    for frame in streamedVolumes.readIndex()["frames"]:
+      imageData, ijkToRas = streamedVolumes.readFrameImageData(frame)
+      yield numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+
+  def _updateTemplate(self, frameVoxels):
+    """Set template voxels to the average of the frames. Only one frame is read into memory at a time.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    dimensions = self.inputVolSeq.GetNthDataNode(self.fixedVolumeItemNumber).GetImageData().GetDimensions()
+    numberOfVoxels = dimensions[0] * dimensions[1] * dimensions[2]
+    voxelSum = np.zeros(numberOfVoxels)
+    numberOfFrames = 0
+    for voxels in frameVoxels:
+      if voxels.size != numberOfVoxels:
+        raise ValueError("Groupwise registration requires all frames to have the same size")
+      voxelSum += voxels.ravel()
+      numberOfFrames += 1
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(dimensions)
+    imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk((voxelSum / numberOfFrames).astype(np.float32), deep=True))
+    self.templateVolume.SetAndObserveImageData(imageData)
+
+  def _startIteration(self):
+    iterationIndex = len(self.iterationRuns)
+    isLastIteration = (iterationIndex == self.numberOfIterations-1)
+    self.logic.elastixLogic.addLog("Groupwise registration iteration {0} of {1}".format(iterationIndex+1, self.numberOfIterations))
+    registrationRun = SequenceRegistrationRun(self.logic, self.inputVolSeq,
+      self.outputVolSeq if isLastIteration else None, self.outputTransformSeq if isLastIteration else None,
+      None, self.presetIndex, self.computeMovingToFixedTransform, self.startFrameIndex, self.endFrameIndex, self.fixedVolumeMask,
+      self.registrationRegion, fixedVolume=self.templateVolume)
+    registrationRun.progressCallback = self._onIterationProgress
+    # Moving frames are written to file only once, for all iterations
+    registrationRun.stagedInputDirectory = os.path.join(self.tempDir, 'input')
+    if self.checkpointDirectory:
+      registrationRun.checkpointDirectory = os.path.join(self.checkpointDirectory, "iteration-{0}".format(iterationIndex))
+    if isLastIteration:
+      registrationRun.outputVolumeDirectory = self.outputVolumeDirectory
+    else:
+      # Registered frames are only needed for computing the next template
+      registrationRun.outputVolumeDirectory = os.path.join(self.tempDir, "iteration-{0}".format(iterationIndex))
+      # Displacement fields of this iteration are used as initial transforms in the next iteration
+      registrationRun.keepDisplacementFields = True
+      # Only the final transforms are smoothed
+      registrationRun.temporalSmoothingSigma = 0.0
+    registrationRun.start()
+    if self.iterationRuns:
+      previousJobs = {job.movingVolumeItemNumber: job for job in self.iterationRuns[-1].frameJobs}
+      for job in registrationRun.frameJobs:
+        job.initialTransformJob = previousJobs.get(job.movingVolumeItemNumber)
+        job.initializeFromDisplacementField = True
+      if len(self.iterationRuns) > 1:
+        # Results of earlier iterations are included in the displacement fields of the previous iteration
+        self._removeIterationTemporaryFiles(self.iterationRuns[-2])
+    self.iterationRuns.append(registrationRun)
+
+  def poll(self, maximumNumberOfRunningJobs=None):
+    """Start new frame registrations, store results of completed ones.
+    Returns True if all iterations are completed. If an error occurs then the run is cancelled and an exception is raised.
+    """
+    if self.completed:
+      return True
+    try:
+      registrationRun = self.iterationRuns[-1]
+      if not registrationRun.poll(maximumNumberOfRunningJobs):
+        return False
+      if len(self.iterationRuns) < self.numberOfIterations:
+        self._updateTemplate(self._getRegisteredFrameVoxels(registrationRun))
+        self._startIteration()
+        return False
+    except:
+      self.cancel()
+      raise
+    self.completed = True
+    self._cleanup()
+    return True
+
+  def cancel(self):
+    """Stop all running registration processes immediately and remove temporary data.
+    """
+    if self.iterationRuns:
+      self.iterationRuns[-1].cancel()
+    self._cleanup()
+
+  def isCompleted(self):
+    return self.completed
+
+  def getNumberOfFrames(self):
+    return (self.endFrameIndex - self.startFrameIndex + 1) * self.numberOfIterations
+
+  def getNumberOfCompletedFrames(self):
+    return sum(registrationRun.getNumberOfCompletedFrames() for registrationRun in self.iterationRuns)
+
+  def getNumberOfRegisteredFrames(self):
+    return sum(registrationRun.getNumberOfRegisteredFrames() for registrationRun in self.iterationRuns)
+
+  def getElapsedTime(self):
+    """Elapsed time since start, in seconds."""
+    import time
+    return time.time() - self.startTime
+
+  def getEstimatedRemainingTime(self):
+    """Estimated time until all iterations are completed, in seconds. Returns None if no estimate is available yet."""
+    numberOfRegisteredFrames = self.getNumberOfRegisteredFrames()
+    if numberOfRegisteredFrames == 0:
+      return None
+    numberOfRemainingFrames = self.getNumberOfFrames() - self.getNumberOfCompletedFrames()
+    return self.getElapsedTime() / numberOfRegisteredFrames * numberOfRemainingFrames
+
+  def getReport(self):
+    """Returns the report of the last iteration (see SequenceRegistrationRun.getReport) and the elapsed time of all iterations.
+    """
+    report = self.iterationRuns[-1].getReport() if self.iterationRuns else {}
+    report["numberOfGroupwiseIterations"] = self.numberOfIterations
+    report["elapsedTimeSec"] = self.getElapsedTime() if self.startTime is not None else None
+    return report
+
+  def getPostProcessingProgress(self):
+    """Returns (number of processed frames, number of frames) of temporal smoothing, None if it is not in progress."""
+    return self.iterationRuns[-1].getPostProcessingProgress() if self.iterationRuns else None
+
+  def _onIterationProgress(self, registrationRun):
+    if self.progressCallback:
+      self.progressCallback(self)
+
+  def _removeIterationTemporaryFiles(self, registrationRun):
+    if self.logic.elastixLogic.deleteTemporaryFiles and registrationRun.tempDir:
+      import shutil
+      shutil.rmtree(registrationRun.tempDir, ignore_errors=True)
+      registrationRun.tempDir = None
+
+  def _cleanup(self):
+    for registrationRun in self.iterationRuns:
+      self._removeIterationTemporaryFiles(registrationRun)
+    if self.logic.elastixLogic.deleteTemporaryFiles:
+      import shutil
+      if self.tempDir:
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+        self.tempDir = None
+    cleanupCallbacks = self.cleanupCallbacks
+    self.cleanupCallbacks = []
+    for cleanupCallback in cleanupCallbacks:
+      cleanupCallback()
+
+#
+# SequenceRegistrationBatch
+#
+
+class SequenceRegistrationBatch(object):
+  """Registration of multiple volume sequences. Frames of all sequences are registered using a shared queue:
+  registrations are started in the order of sequences while the total number of running registrations is below the limit,
+  so CPU cores are kept busy even when a sequence has only a few frames left.
+  Outputs of each sequence are finalized as soon as all its frames are completed.
+  It has the same interface as SequenceRegistrationRun: call start() then call poll() periodically until it returns True.
+  """
+
+  def __init__(self, logic):
+    self.logic = logic
+    self.registrationRuns = []
+    self.activeRuns = []
+    # List of (run, exception) of sequences that could not be registered
+    self.failedRuns = []
+    # Function that is called (with this batch as argument) each time a frame is completed
+    self.progressCallback = None
+    # Function that is called (with the run as argument) when all frames of a sequence are completed
+    self.runCompletedCallback = None
+    self.startTime = None
+    self.completed = False
+
+  def addRun(self, registrationRun):
+    self.registrationRuns.append(registrationRun)
+
+  def start(self):
+    import time
+    self.startTime = time.time()
+    self.numberOfParallelRegistrations = self.logic.getNumberOfParallelRegistrations()
+    for registrationRun in self.registrationRuns:
+      registrationRun.progressCallback = self._onRunProgress
+      try:
+        registrationRun.start()
+      except Exception as e:
+        self._onRunFailed(registrationRun, e)
+        continue
+      self.activeRuns.append(registrationRun)
+    self.logic.elastixLogic.addLog("Registering {0} sequence(s), running {1} registration(s) in parallel".format(
+      len(self.registrationRuns), self.numberOfParallelRegistrations))
+
+  def poll(self):
+    """Start new frame registrations, store results of completed ones.
+    Returns True if all sequences are completed. If registration of any of the sequences failed then an exception
+    is raised after all the other sequences are completed.
+    """
+    if self.completed:
+      return True
+    numberOfRunningJobs = sum(len(registrationRun.runningJobs) for registrationRun in self.activeRuns)
+    for registrationRun in list(self.activeRuns):
+      numberOfRunningJobsOfRun = len(registrationRun.runningJobs)
+      numberOfAvailableSlots = max(0, self.numberOfParallelRegistrations - numberOfRunningJobs)
+      try:
+        runCompleted = registrationRun.poll(numberOfRunningJobsOfRun + numberOfAvailableSlots)
+      except Exception as e:
+        # The run is already cancelled, other sequences are still processed
+        self.activeRuns.remove(registrationRun)
+        self._onRunFailed(registrationRun, e)
+        numberOfRunningJobs -= numberOfRunningJobsOfRun
+        continue
+      numberOfRunningJobs += len(registrationRun.runningJobs) - numberOfRunningJobsOfRun
+      if runCompleted:
+        self.activeRuns.remove(registrationRun)
+        self.logic.elastixLogic.addLog("Registration of {0} is completed".format(registrationRun.inputVolSeq.GetName()))
+        if self.runCompletedCallback:
+          self.runCompletedCallback(registrationRun)
+    if self.activeRuns:
+      return False
+    self.completed = True
+    if self.failedRuns:
+      raise ValueError("Registration of {0} of {1} sequence(s) failed: {2}".format(len(self.failedRuns), len(self.registrationRuns),
+        ", ".join(registrationRun.inputVolSeq.GetName() for registrationRun, e in self.failedRuns)))
+    return True
+
+  def cancel(self):
+    """Stop all running registration processes immediately and remove temporary data.
+    """
+    for registrationRun in self.activeRuns:
+      registrationRun.cancel()
+    self.activeRuns = []
+
+  def isCompleted(self):
+    return self.completed
+
+  def getNumberOfFrames(self):
+    return sum(registrationRun.getNumberOfFrames() for registrationRun in self.registrationRuns)
+
+  def getNumberOfCompletedFrames(self):
+    return sum(registrationRun.getNumberOfCompletedFrames() for registrationRun in self.registrationRuns)
+
+  def getElapsedTime(self):
+    """Elapsed time since start, in seconds."""
+    import time
+    return time.time() - self.startTime
+
+  def getEstimatedRemainingTime(self):
+    """Estimated time until all frames are completed, in seconds. Returns None if no estimate is available yet."""
+    numberOfRegisteredFrames = sum(registrationRun.getNumberOfRegisteredFrames() for registrationRun in self.registrationRuns)
+    if numberOfRegisteredFrames == 0:
+      return None
+    numberOfRemainingFrames = sum(registrationRun.getNumberOfFrames() - registrationRun.getNumberOfCompletedFrames()
+      for registrationRun in self.activeRuns)
+    return self.getElapsedTime() / numberOfRegisteredFrames * numberOfRemainingFrames
+
+  def getPostProcessingProgress(self):
+    """Returns (number of processed frames, number of frames) of temporal smoothing of the sequences whose frames
+    are all registered, None if none of them is in this step.
+    """
+    progresses = [registrationRun.getPostProcessingProgress() for registrationRun in self.activeRuns]
+    progresses = [progress for progress in progresses if progress is not None]
+    if not progresses:
+      return None
+    return (sum(progress[0] for progress in progresses), sum(progress[1] for progress in progresses))
+
+  def _onRunProgress(self, registrationRun):
+    if self.progressCallback:
+      self.progressCallback(self)
+
+  def _onRunFailed(self, registrationRun, e):
+    self.logic.elastixLogic.addLog("Registration of {0} failed: {1}".format(registrationRun.inputVolSeq.GetName(), str(e)))
+    self.failedRuns.append((registrationRun, e))
+
+#
+# SequenceRegistrationLazyResampler
+#
+
+class SequenceRegistrationLazyResampler(object):
+  """Shows motion-compensated frames without storing a resampled volume sequence.
+  When the selected item of the browser node changes, the corresponding input frame is resampled
+  using the transform of the same item in the transform sequence and the result is shown in outputVolume.
+  The most recently resampled frames are kept in memory so that browsing back and forth is fast.
+  """
+
+  def __init__(self, browserNode, inputVolSeq, transformSeq, outputVolume, computeMovingToFixedTransform=True, numberOfCachedFrames=5):
+    """computeMovingToFixedTransform: must be the same value that was used for computing transformSeq.
+    """
+    import collections
+    self.browserNode = browserNode
+    self.inputVolSeq = inputVolSeq
+    self.transformSeq = transformSeq
+    self.outputVolume = outputVolume
+    self.computeMovingToFixedTransform = computeMovingToFixedTransform
+    self.numberOfCachedFrames = numberOfCachedFrames
+    self.cachedFrames = collections.OrderedDict()
+    self.currentIndexValue = None
+    self.browserNodeObserverTag = self.browserNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onBrowserNodeModified)
+    self.update()
+
+  def stop(self):
+    """Remove observers and release cached frames."""
+    if self.browserNodeObserverTag is not None:
+      self.browserNode.RemoveObserver(self.browserNodeObserverTag)
+      self.browserNodeObserverTag = None
+    self.cachedFrames.clear()
+
+  def onBrowserNodeModified(self, caller=None, event=None):
+    self.update()
+
+  def update(self):
+    selectedItemNumber = self.browserNode.GetSelectedItemNumber()
+    masterSequenceNode = self.browserNode.GetMasterSequenceNode()
+    if selectedItemNumber < 0 or not masterSequenceNode:
+      return
+    indexValue = masterSequenceNode.GetNthIndexValue(selectedItemNumber)
+    if indexValue == self.currentIndexValue:
+      return
+    resampledFrame = self.getResampledFrame(indexValue)
+    if resampledFrame is None:
+      return
+    imageData, ijkToRas = resampledFrame
+    self.outputVolume.SetIJKToRASMatrix(ijkToRas)
+    self.outputVolume.SetAndObserveImageData(imageData)
+    self.currentIndexValue = indexValue
+
+  def getResampledFrame(self, indexValue):
+    """Returns resampled image data and IJK to RAS matrix of the frame at indexValue.
+    Returns None if the frame or its transform is not available.
+    """
+    if indexValue in self.cachedFrames:
+      self.cachedFrames.move_to_end(indexValue)
+      return self.cachedFrames[indexValue]
+    inputVolume = self.inputVolSeq.GetDataNodeAtValue(indexValue)
+    transformNode = self.transformSeq.GetDataNodeAtValue(indexValue)
+    if not inputVolume or not transformNode:
+      return None
+    resampledFrame = SequenceRegistrationLazyResampler.resampleFrame(inputVolume, transformNode, self.computeMovingToFixedTransform)
+    self.cachedFrames[indexValue] = resampledFrame
+    while len(self.cachedFrames) > self.numberOfCachedFrames:
+      self.cachedFrames.popitem(last=False)
+    return resampledFrame
+
+  @staticmethod
+  def resampleFrame(inputVolume, transformNode, computeMovingToFixedTransform=True):
+    """Returns image data and IJK to RAS matrix of inputVolume resampled using the transform in transformNode.
+    computeMovingToFixedTransform: must be the same value that was used for computing the transform.
+    """
+    resampledVolume = slicer.vtkMRMLScalarVolumeNode()
+    ijkToRas = vtk.vtkMatrix4x4()
+    inputVolume.GetIJKToRASMatrix(ijkToRas)
+    resampledVolume.SetIJKToRASMatrix(ijkToRas)
+    imageData = vtk.vtkImageData()
+    # Input is not modified by resampling, so a shallow copy is sufficient
+    imageData.ShallowCopy(inputVolume.GetImageData())
+    resampledVolume.SetAndObserveImageData(imageData)
+    # Same as hardening the moving to fixed transform on the input frame
+    if computeMovingToFixedTransform:
+      resampledVolume.ApplyTransform(transformNode.GetTransformToParent())
+    else:
+      resampledVolume.ApplyTransform(transformNode.GetTransformFromParent())
+    resampledVolume.GetIJKToRASMatrix(ijkToRas)
+    return (resampledVolume.GetImageData(), ijkToRas)
+
+#
+# SequenceRegistrationStreamedVolumeSequence
+#
+
+class SequenceRegistrationStreamedVolumeSequence(object):
+  """Volume sequence that is stored on disk instead of in memory. Each frame is written as soon as it is available,
+  into a NRRD file with detached header (frame-NNNN.nhdr and frame-NNNN.raw), which can also be loaded into Slicer directly.
+  index.json lists the frames with their index values. Voxels are not compressed, therefore frames can be read
+  using memory mapping: only those parts of a file are loaded into memory that are actually accessed.
+  """
+
+  # NRRD type names of numpy scalar types
+  nrrdScalarTypes = {
+    "int8": "int8", "uint8": "uint8", "int16": "int16", "uint16": "uint16", "int32": "int32", "uint32": "uint32",
+    "int64": "int64", "uint64": "uint64", "float32": "float", "float64": "double",
+    }
+
+  # numpy scalar types of MetaImage element types
+  metaImageScalarTypes = {
+    "MET_CHAR": "int8", "MET_UCHAR": "uint8", "MET_SHORT": "int16", "MET_USHORT": "uint16", "MET_INT": "int32", "MET_UINT": "uint32",
+    "MET_LONG_LONG": "int64", "MET_ULONG_LONG": "uint64", "MET_FLOAT": "float32", "MET_DOUBLE": "float64",
+    }
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.indexFilePath = os.path.join(directory, "index.json")
+    self.index = None
+
+  def create(self, indexName, indexUnit, indexType):
+    """Start writing a new sequence. Frames that were previously written into the folder are removed.
+    """
+    if os.path.isdir(self.directory):
+      for fileName in os.listdir(self.directory):
+        if fileName == "index.json" or fileName.startswith("frame-"):
+          os.remove(os.path.join(self.directory, fileName))
+    else:
+      os.makedirs(self.directory)
+    self.index = {"indexName": indexName, "indexUnit": indexUnit, "indexType": indexType, "frames": []}
+    self._writeIndex()
+
+  def readIndex(self):
+    """Read list of frames from the index file. Frames may be added by another object while the sequence is read.
+    """
+    import json
+    with open(self.indexFilePath) as indexFile:
+      self.index = json.load(indexFile)
+    return self.index
+
+  def getFrame(self, indexValue):
+    """Returns description of the frame at indexValue (file names, dimensions, scalar type, IJK to RAS matrix)
+    or None if the frame is not available.
+    """
+    for frame in self.index["frames"]:
+      if frame["indexValue"] == indexValue:
+        return frame
+    return None
+
+  def addFrameFromVolume(self, indexValue, volumeNode):
+    """Write voxels of a volume node as the frame at indexValue.
+    """
+    from vtk.util import numpy_support
+    imageData = volumeNode.GetImageData()
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    voxels = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+    frame = self._createFrame(indexValue, imageData.GetDimensions(), imageData.GetNumberOfScalarComponents(), voxels.dtype,
+      [ijkToRas.GetElement(row, column) for row in range(4) for column in range(4)])
+    voxels.tofile(os.path.join(self.directory, frame["dataFile"]))
+    self._addFrame(frame)
+
+  def addFrameFromMetaImage(self, indexValue, headerFilePath):
+    """Use a MetaImage file (such as a volume computed by elastix) as the frame at indexValue.
+    Uncompressed voxel data is moved into the sequence folder (without copying, if it is on the same file system),
+    therefore the voxels do not have to be loaded into memory.
+    """
+    import numpy as np
+    import shutil
+    header = self.readMetaImageHeader(headerFilePath)
+    if (header.get("CompressedData", "False") == "True" or header["ElementDataFile"] == "LOCAL"
+      or header["ElementType"] not in self.metaImageScalarTypes or int(header["NDims"]) != 3):
+      # Voxel data cannot be used as is, read it into memory and write it again
+      volumeNode = slicer.vtkMRMLScalarVolumeNode()
+      storageNode = slicer.vtkMRMLVolumeArchetypeStorageNode()
+      storageNode.SetFileName(headerFilePath)
+      if not storageNode.ReadData(volumeNode):
+        raise ValueError("Failed to read volume from "+headerFilePath)
+      self.addFrameFromVolume(indexValue, volumeNode)
+      return
+    dtype = np.dtype(self.metaImageScalarTypes[header["ElementType"]]).newbyteorder(
+      ">" if header.get("ElementByteOrderMSB", "False") == "True" else "<")
+    spacing = [float(value) for value in header.get("ElementSpacing", "1 1 1").split()]
+    origin = [float(value) for value in header.get("Offset", "0 0 0").split()]
+    directions = [float(value) for value in header.get("TransformMatrix", "1 0 0 0 1 0 0 0 1").split()]
+    # MetaImage geometry is in LPS, each consecutive 3 values of TransformMatrix is the direction of an axis
+    lpsToRas = [-1, -1, 1]
+    ijkToRas = [0.0] * 12 + [0.0, 0.0, 0.0, 1.0]
+    for row in range(3):
+      for column in range(3):
+        ijkToRas[row*4+column] = lpsToRas[row] * directions[column*3+row] * spacing[column]
+      ijkToRas[row*4+3] = lpsToRas[row] * origin[row]
+    frame = self._createFrame(indexValue, [int(value) for value in header["DimSize"].split()],
+      int(header.get("ElementNumberOfChannels", "1")), dtype, ijkToRas)
+    shutil.move(os.path.join(os.path.dirname(headerFilePath), header["ElementDataFile"]), os.path.join(self.directory, frame["dataFile"]))
+    self._addFrame(frame)
+
+  def readFrameImageData(self, frame):
+    """Returns image data and IJK to RAS matrix of a frame. Voxels are memory-mapped, they are only read from file when accessed.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    # Copy-on-write mapping: the file is not modified even if the image data is changed
+    voxels = np.memmap(os.path.join(self.directory, frame["dataFile"]), dtype=np.dtype(frame["scalarType"]), mode='c')
+    if not voxels.dtype.isnative:
+      # VTK only supports native byte order, swapping bytes reads all voxels into memory
+      voxels = voxels.astype(voxels.dtype.newbyteorder("="))
+    numberOfComponents = frame["numberOfComponents"]
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(frame["dimensions"])
+    # The VTK array keeps a reference to the numpy array, so the mapping remains valid while the image data is in use
+    scalars = numpy_support.numpy_to_vtk(voxels.reshape(-1, numberOfComponents) if numberOfComponents > 1 else voxels, deep=False)
+    imageData.GetPointData().SetScalars(scalars)
+    ijkToRas = vtk.vtkMatrix4x4()
+    ijkToRas.DeepCopy(frame["ijkToRas"])
+    return imageData, ijkToRas
+
+  def readMetaImageHeader(self, headerFilePath):
+    """Returns fields of a MetaImage header (.mhd) file as a dict of strings."""
+    header = {}
+    with open(headerFilePath) as headerFile:
+      for line in headerFile:
+        if "=" not in line:
+          continue
+        key, value = line.split("=", 1)
+        header[key.strip()] = value.strip()
+    return header
+
+  def _createFrame(self, indexValue, dimensions, numberOfComponents, dtype, ijkToRas):
+    frameName = "frame-{0:04d}".format(len(self.index["frames"]))
+    return {
+      "indexValue": indexValue,
+      "headerFile": frameName + ".nhdr",
+      "dataFile": frameName + ".raw",
+      "dimensions": list(dimensions),
+      "numberOfComponents": numberOfComponents,
+      "scalarType": dtype.str,
+      "ijkToRas": ijkToRas,
+      }
+
+  def _addFrame(self, frame):
+    self._writeNrrdHeader(frame)
+    self.index["frames"].append(frame)
+    self._writeIndex()
+
+  def _writeNrrdHeader(self, frame):
+    import numpy as np
+    dtype = np.dtype(frame["scalarType"])
+    ijkToRas = frame["ijkToRas"]
+    def formatLpsVector(rasVector):
+      return "({0:.17g},{1:.17g},{2:.17g})".format(-rasVector[0], -rasVector[1], rasVector[2])
+    sizes = [str(size) for size in frame["dimensions"]]
+    kinds = ["domain"] * 3
+    spaceDirections = [formatLpsVector([ijkToRas[row*4+column] for row in range(3)]) for column in range(3)]
+    if frame["numberOfComponents"] > 1:
+      sizes.insert(0, str(frame["numberOfComponents"]))
+      kinds.insert(0, "vector")
+      spaceDirections.insert(0, "none")
+    lines = [
+      "NRRD0004",
+      "type: " + self.nrrdScalarTypes[dtype.name],
+      "dimension: {0}".format(len(sizes)),
+      "space: left-posterior-superior",
+      "sizes: " + " ".join(sizes),
+      "space directions: " + " ".join(spaceDirections),
+      "kinds: " + " ".join(kinds),
+      "endian: " + ("big" if dtype.str[0] == ">" else "little"),
+      "encoding: raw",
+      "space origin: " + formatLpsVector([ijkToRas[row*4+3] for row in range(3)]),
+      "data file: " + frame["dataFile"],
+      ]
+    with open(os.path.join(self.directory, frame["headerFile"]), 'w') as headerFile:
+      headerFile.write("\n".join(lines) + "\n")
+
+  def _writeIndex(self):
+    import json
+    # Write into a temporary file and rename, so that readers never see an incomplete index
+    with open(self.indexFilePath + ".tmp", 'w') as indexFile:
+      json.dump(self.index, indexFile, indent=2)
+    os.replace(self.indexFilePath + ".tmp", self.indexFilePath)
+
+#
+# SequenceRegistrationStreamedVolumeViewer
+#
+
+class SequenceRegistrationStreamedVolumeViewer(object):
+  """Shows frames of a volume sequence that is stored on disk (see SequenceRegistrationStreamedVolumeSequence).
+  When the selected item of the browser node changes, the frame with the same index value is shown in outputVolume.
+  Voxels are memory-mapped, so memory usage does not depend on the number of frames. Frames that are written
+  while the viewer is active (e.g., registration is still in progress) are shown when they become available.
+  """
+
+  def __init__(self, browserNode, streamedVolumeSequence, outputVolume):
+    self.browserNode = browserNode
+    self.streamedVolumeSequence = streamedVolumeSequence
+    self.outputVolume = outputVolume
+    self.currentIndexValue = None
+    self.streamedVolumeSequence.readIndex()
+    self.browserNodeObserverTag = self.browserNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onBrowserNodeModified)
+    self.update()
+
+  def stop(self):
+    """Remove observers."""
+    if self.browserNodeObserverTag is not None:
+      self.browserNode.RemoveObserver(self.browserNodeObserverTag)
+      self.browserNodeObserverTag = None
+
+  def onBrowserNodeModified(self, caller=None, event=None):
+    self.update()
+
+  def update(self):
+    selectedItemNumber = self.browserNode.GetSelectedItemNumber()
+    masterSequenceNode = self.browserNode.GetMasterSequenceNode()
+    if selectedItemNumber < 0 or not masterSequenceNode:
+      return
+    indexValue = masterSequenceNode.GetNthIndexValue(selectedItemNumber)
+    if indexValue == self.currentIndexValue:
+      return
+    frame = self.streamedVolumeSequence.getFrame(indexValue)
+    if frame is None:
+      # The frame may have been written since the index was read
+      self.streamedVolumeSequence.readIndex()
+      frame = self.streamedVolumeSequence.getFrame(indexValue)
+      if frame is None:
+        return
+    imageData, ijkToRas = self.streamedVolumeSequence.readFrameImageData(frame)
+    self.outputVolume.SetIJKToRASMatrix(ijkToRas)
+    self.outputVolume.SetAndObserveImageData(imageData)
+    self.currentIndexValue = indexValue
+
+#
+# SequenceRegistrationBrowserIndex
+#
+
+class SequenceRegistrationBrowserIndex(object):
+  """Finds the sequence browser node of a sequence node without checking all browser nodes in the scene.
+  The index is kept up to date by observing nodes added to and removed from the scene, and changes of browser nodes
+  (e.g., when a sequence is added to a browser). Browser nodes are also modified each time the selected item changes
+  (in every frame during playback), therefore the sequences of a browser are only read again if their number
+  or the master sequence changes.
+  """
+
+  def __init__(self, scene):
+    self.scene = scene
+    # List of IDs of the browser nodes (in the order of adding them) that synchronize each sequence node (by ID)
+    self.browserIdsBySequenceId = {}
+    # IDs of sequence nodes that each browser node (by ID) synchronizes
+    self.sequenceIdsByBrowserId = {}
+    # Master sequence node ID and number of synchronized sequences of each browser node (by ID) when it was last indexed
+    self.sequencesStateByBrowserId = {}
+    self.browserNodeObserverTags = {}
+    self.sceneObserverTags = [
+      scene.AddObserver(slicer.vtkMRMLScene.NodeAddedEvent, self.onNodeAdded),
+      scene.AddObserver(slicer.vtkMRMLScene.NodeRemovedEvent, self.onNodeRemoved),
+      # References between nodes are only updated at the end of scene loading
+      scene.AddObserver(slicer.vtkMRMLScene.EndImportEvent, self.onSceneImported),
+      ]
+    for browserNode in slicer.util.getNodesByClass("vtkMRMLSequenceBrowserNode", scene):
+      self.addBrowserNode(browserNode)
+
+  # Index that is shared by all logic instances, so that scene observers are only added once
+  sharedIndex = None
+
+  @classmethod
+  def getSharedIndex(cls, scene):
+    if cls.sharedIndex is None or cls.sharedIndex.scene is not scene:
+      cls.releaseSharedIndex()
+      cls.sharedIndex = cls(scene)
+    return cls.sharedIndex
+
+  @classmethod
+  def releaseSharedIndex(cls):
+    if cls.sharedIndex is not None:
+      cls.sharedIndex.stop()
+      cls.sharedIndex = None
+
+  def stop(self):
+    """Remove all observers."""
+    for tag in self.sceneObserverTags:
+      self.scene.RemoveObserver(tag)
+    self.sceneObserverTags = []
+    for browserNodeId in list(self.browserNodeObserverTags):
+      self.removeBrowserNode(browserNodeId)
+
+  def getBrowserForSequence(self, sequenceNode):
+    """Returns the first browser node that synchronizes sequenceNode, None if there is no such browser."""
+    if not sequenceNode or not sequenceNode.GetID():
+      return None
+    browserNodeIds = self.browserIdsBySequenceId.get(sequenceNode.GetID())
+    if not browserNodeIds:
+      return None
+    return self.scene.GetNodeByID(browserNodeIds[0])
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAdded(self, caller, event, node):
+    if node.IsA("vtkMRMLSequenceBrowserNode"):
+      self.addBrowserNode(node)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, event, node):
+    if node.IsA("vtkMRMLSequenceBrowserNode"):
+      self.removeBrowserNode(node.GetID())
+
+  def onSceneImported(self, caller, event):
+    for browserNode, tag in list(self.browserNodeObserverTags.values()):
+      self.updateBrowserNode(browserNode)
+
+  def onBrowserNodeModified(self, browserNode, event):
+    if self._getSequencesState(browserNode) != self.sequencesStateByBrowserId.get(browserNode.GetID()):
+      self.updateBrowserNode(browserNode)
+
+  def addBrowserNode(self, browserNode):
+    if browserNode.GetID() in self.browserNodeObserverTags:
+      return
+    self.browserNodeObserverTags[browserNode.GetID()] = (browserNode,
+      browserNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onBrowserNodeModified))
+    self.updateBrowserNode(browserNode)
+
+  def removeBrowserNode(self, browserNodeId):
+    browserNode, tag = self.browserNodeObserverTags.pop(browserNodeId, (None, None))
+    if browserNode:
+      browserNode.RemoveObserver(tag)
+    self.sequencesStateByBrowserId.pop(browserNodeId, None)
+    self._setSequenceIds(browserNodeId, [])
+
+  def updateBrowserNode(self, browserNode):
+    """Update the list of sequences of browserNode (only the index of this browser is updated)."""
+    self.sequencesStateByBrowserId[browserNode.GetID()] = self._getSequencesState(browserNode)
+    sequenceNodes = vtk.vtkCollection()
+    browserNode.GetSynchronizedSequenceNodes(sequenceNodes, True)
+    self._setSequenceIds(browserNode.GetID(),
+      [sequenceNodes.GetItemAsObject(index).GetID() for index in range(sequenceNodes.GetNumberOfItems())])
+
+  def _getSequencesState(self, browserNode):
+    masterSequenceNode = browserNode.GetMasterSequenceNode()
+    return (masterSequenceNode.GetID() if masterSequenceNode else None, browserNode.GetNumberOfSynchronizedSequenceNodes(True))
+
+  def _setSequenceIds(self, browserNodeId, sequenceNodeIds):
+    previousSequenceNodeIds = self.sequenceIdsByBrowserId.get(browserNodeId, [])
+    if previousSequenceNodeIds == sequenceNodeIds:
+      return
+    for sequenceNodeId in previousSequenceNodeIds:
+      browserNodeIds = self.browserIdsBySequenceId[sequenceNodeId]
+      browserNodeIds.remove(browserNodeId)
+      if not browserNodeIds:
+        del self.browserIdsBySequenceId[sequenceNodeId]
+    for sequenceNodeId in sequenceNodeIds:
+      self.browserIdsBySequenceId.setdefault(sequenceNodeId, []).append(browserNodeId)
+    if sequenceNodeIds:
+      self.sequenceIdsByBrowserId[browserNodeId] = sequenceNodeIds
+    else:
+      self.sequenceIdsByBrowserId.pop(browserNodeId, None)
+
+#
+# SequenceRegistrationResultCache
+#
+
+class SequenceRegistrationResultCache(object):
+  """Persistent storage of frame registration results (elastix transform parameters, and optionally
+  the resampled volume and displacement field) identified by a hash of all registration inputs.
+  Least recently used entries are removed when the cache size exceeds the limit.
+  The same storage is used for saving checkpoints of a registration run, with frame names as keys
+  and without size limit.
+  """
+
+  def __init__(self, cacheDirectory, maximumSizeBytes, cacheResampledVolumes=True):
+    """If maximumSizeBytes is None then entries are never removed."""
+    self.cacheDirectory = cacheDirectory
+    self.maximumSizeBytes = maximumSizeBytes
+    self.cacheResampledVolumes = cacheResampledVolumes
+    # Total size of the entries. The folder is only scanned the first time it is needed and when entries are removed,
+    # otherwise it is updated with the size of the stored entries.
+    self.totalSizeBytes = None
+
+  def restore(self, cacheKey, resultTransformDir, resultResampleDir, initialTransformParametersPath=None):
+    """Copy cached results into the result directories. Returns False if there is no cache entry for the key.
+    initialTransformParametersPath is written into the restored transform parameter files,
+    as they may reference an initial transform file.
+    """
+    import shutil
+    entryDir = os.path.join(self.cacheDirectory, cacheKey)
+    entryTransformDir = os.path.join(entryDir, 'result-transform')
+    if not os.path.isdir(entryTransformDir):
+      return False
+    try:
+      self._copyTransformParameterFiles(entryTransformDir, resultTransformDir, initialTransformParametersPath)
+      entryResampleDir = os.path.join(entryDir, 'result-resample')
+      if os.path.isdir(entryResampleDir):
+        for filename in os.listdir(entryResampleDir):
+          shutil.copy(os.path.join(entryResampleDir, filename), resultResampleDir)
+      # Mark as recently used
+      os.utime(entryDir, None)
+    except (IOError, OSError):
+      # entry may have been removed by another process
+      return False
+    return True
+
+  def store(self, cacheKey, resultTransformDir, resultResampleDir):
+    """Add results to the cache. Existing entry with the same key is replaced.
+    """
+    import shutil
+    if not os.path.isdir(self.cacheDirectory):
+      os.makedirs(self.cacheDirectory)
+    entryDir = os.path.join(self.cacheDirectory, cacheKey)
+    # Write into a temporary folder and rename, so that incomplete entries are never used
+    tempEntryDir = entryDir + ".incomplete"
+    shutil.rmtree(tempEntryDir, ignore_errors=True)
+    entryTransformDir = os.path.join(tempEntryDir, 'result-transform')
+    os.makedirs(entryTransformDir)
+    self._copyTransformParameterFiles(resultTransformDir, entryTransformDir, None)
+    if self.cacheResampledVolumes:
+      entryResampleDir = os.path.join(tempEntryDir, 'result-resample')
+      os.makedirs(entryResampleDir)
+      for filename in os.listdir(resultResampleDir):
+        if filename.startswith('result.') or filename.startswith('deformationField.'):
+          shutil.copy(os.path.join(resultResampleDir, filename), entryResampleDir)
+    entrySize = self._getDirectorySize(tempEntryDir)
+    replacedEntrySize = self._getDirectorySize(entryDir) if os.path.isdir(entryDir) else 0
+    shutil.rmtree(entryDir, ignore_errors=True)
+    os.rename(tempEntryDir, entryDir)
+    if self.maximumSizeBytes is None:
+      return
+    if self.totalSizeBytes is None:
+      self.totalSizeBytes = sum(entrySize for lastUsedTime, entrySize, entryDir in self._getEntries())
+    else:
+      self.totalSizeBytes += entrySize - replacedEntrySize
+    if self.totalSizeBytes > self.maximumSizeBytes:
+      self.removeLeastRecentlyUsedEntries()
+
+  def removeLeastRecentlyUsedEntries(self):
+    """Remove least recently used entries until the cache size is below the limit.
+    Entries are scanned again, as other processes may have added or removed entries.
+    """
+    import shutil
+    entries = self._getEntries()
+    totalSize = sum(entrySize for lastUsedTime, entrySize, entryDir in entries)
+    for lastUsedTime, entrySize, entryDir in sorted(entries):
+      if totalSize <= self.maximumSizeBytes:
+        break
+      shutil.rmtree(entryDir, ignore_errors=True)
+      totalSize -= entrySize
+    self.totalSizeBytes = totalSize
+
+  def _getEntries(self):
+    """Returns list of (last used time, size in bytes, folder) of all cache entries."""
+    entries = []
+    for entryName in os.listdir(self.cacheDirectory):
+      entryDir = os.path.join(self.cacheDirectory, entryName)
+      if not os.path.isdir(entryDir):
+        continue
+      entries.append((os.path.getmtime(entryDir), self._getDirectorySize(entryDir), entryDir))
+    return entries
+
+  def _getDirectorySize(self, path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+      size += sum(os.path.getsize(os.path.join(root, filename)) for filename in files)
+    return size
+
+  def _copyTransformParameterFiles(self, sourceDir, targetDir, initialTransformParametersPath):
+    """Copy TransformParameters.N.txt files and update references between them to the target folder.
+    The first file refers to initialTransformParametersPath (or no initial transform if None).
+    """
+    import re
+    parameterFileIndex = 0
+    while os.path.exists(os.path.join(sourceDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex))):
+      with open(os.path.join(sourceDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex))) as parameterFile:
+        parameters = parameterFile.read()
+      if parameterFileIndex > 0:
+        initialTransform = os.path.join(targetDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex-1))
+      else:
+        initialTransform = initialTransformParametersPath if initialTransformParametersPath else "NoInitialTransform"
+      parameters = re.sub(r'\(InitialTransformParametersFileName\s+"[^"]*"\)',
+        lambda match: '(InitialTransformParametersFileName "{0}")'.format(initialTransform.replace('\\', '/')), parameters)
+      with open(os.path.join(targetDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex)), 'w') as parameterFile:
+        parameterFile.write(parameters)
+      parameterFileIndex += 1
+
+#
+# SequenceRegistrationFrameJob
+#
+
+class SequenceRegistrationFrameJob(object):
+  """Registers one moving frame to the fixed frame by running elastix and transformix
+  in background processes (or in background threads, if in-process registration is enabled).
+  Use poll() to advance the job and check if it is completed.
+  """
+
+  # numpy types of elastix ResultImagePixelType values
+  resultImagePixelTypes = {
+    "char": "int8", "unsigned char": "uint8", "short": "int16", "unsigned short": "uint16",
+    "int": "int32", "unsigned int": "uint32", "float": "float32", "double": "float64",
+    }
+
+  # elastix ResultImagePixelType values of VTK scalar types
+  resultImagePixelTypesOfVtkScalarTypes = {
+    vtk.VTK_CHAR: "char", vtk.VTK_SIGNED_CHAR: "char", vtk.VTK_UNSIGNED_CHAR: "unsigned char",
+    vtk.VTK_SHORT: "short", vtk.VTK_UNSIGNED_SHORT: "unsigned short", vtk.VTK_INT: "int", vtk.VTK_UNSIGNED_INT: "unsigned int",
+    vtk.VTK_FLOAT: "float", vtk.VTK_DOUBLE: "double",
+    }
+
+  def __init__(self, logic, movingVolumeItemNumber, workingDir, fixedVolumePath, parameterFilenames,
+    computeVolume = True, computeTransform = True, isFixedFrame = False, fixedVolumeMaskPath = None):
+    """fixedVolumePath and fixedVolumeMaskPath refer to files that are written once per sequence
+    and shared by all frame jobs.
+    """
+    self.logic = logic
+    self.movingVolumeItemNumber = movingVolumeItemNumber
+    self.workingDir = workingDir
+    self.fixedVolumePath = fixedVolumePath
+    self.fixedVolumeMaskPath = fixedVolumeMaskPath
+    self.parameterFilenames = parameterFilenames
+    self.computeVolume = computeVolume
+    self.computeTransform = computeTransform
+    self.isFixedFrame = isFixedFrame
+    # Set if the frame is so similar to the fixed frame that identity transform is used instead of registration
+    self.registrationSkipped = False
+    self.motionScreeningMetricValue = None
+    # If set then the registration is initialized with the result of this job
+    self.initialTransformJob = None
+    # Initialize with the displacement field of initialTransformJob instead of its transform parameters
+    # (avoids chaining the transforms of all the initial transform jobs)
+    self.initializeFromDisplacementField = False
+    # If set then these parameter files are used instead of parameterFilenames when the registration is initialized
+    # (e.g., with fewer iterations, as the registration starts from a transform that is close to the result)
+    self.initializedParameterFilenames = None
+    # Jobs that are initialized from the result of this job
+    self.dependentJobs = []
+    # Keep the displacement field in the working directory (e.g., for initializing registrations of another run)
+    self.keepDisplacementField = False
+    self.resultCache = None
+    self.cacheKey = None
+    self.checkpoint = None
+    self.restoreFromCheckpoint = False
+    self.restoredFromCheckpoint = False
+    # Size (IJK) and origin (RAS) of the image grid that transformix computes the results on.
+    # If None then the geometry of the (registered) fixed volume is used.
+    self.outputGeometry = None
+    self.pendingTransformixArguments = []
+    # If set then input files are written into this folder (shared by all registrations of the frame)
+    # and reused if they are already there
+    self.stagedInputDirectory = None
+    # In-process registration inputs (ITK images and numpy arrays that hold their voxels)
+    # and results (ITK resampled image and displacement field)
+    self.inProcess = False
+    self.fixedImage = None
+    self.fixedMaskImage = None
+    self.movingImage = None
+    self.inputVoxels = []
+    self.inProcessTask = None
+    # Set when the job is killed. In-process computations that are already running check it and do not write results.
+    self.cancelled = False
+    self.resultImage = None
+    self.resultImagePixelType = None
+    # VTK scalar type of the resampled moving volume. If None then the pixel type of the parameter files is used.
+    self.resultImageScalarType = None
+    self.resultDisplacementField = None
+    # If set then the inverse of the computed transform is computed in a background thread before the job is completed.
+    # resultTransform is the transform that resamples the moving frame into the fixed frame, resultInverseTransform is its inverse.
+    self.invertResultTransform = False
+    self.resultTransform = None
+    self.resultInverseTransform = None
+    self.process = None
+    self.processName = None
+    self.processStartTime = None
+    self.completed = False
+    # Information for the registration report: where the result comes from ("fixed", "skipped", "computed", "cache", or "checkpoint"),
+    # time spent in each processing step (in seconds), size of files written into the working directory,
+    # and optimization results of each elastix resolution level
+    self.resultSource = None
+    self.timings = {}
+    self.numberOfBytesWritten = 0
+    self.elastixResolutionLevels = []
+    self.inputDir = os.path.join(self.workingDir, 'input')
+    self.resultTransformDir = os.path.join(self.workingDir, 'result-transform')
+    self.resultResampleDir = os.path.join(self.workingDir, 'result-resample')
+
+  def start(self, movingVolumeNode, registrationMovingVolumeNode=None):
+    """Write moving volume and start elastix. The node is not used after this method returns,
+    therefore the caller may modify it right away.
+    registrationMovingVolumeNode: if specified then this volume is registered (e.g., cropped moving volume)
+    and movingVolumeNode is only used for resampling.
+    """
+    import time
+    if self.isFixedFrame:
+      # Nothing to compute for the fixed frame
+      self.resultSource = "fixed"
+      self.completed = True
+      return
+    for directory in [self.inputDir, self.resultTransformDir, self.resultResampleDir]:
+      os.makedirs(directory)
+    self.movingVolumePath = self._getInputVolumePath('moving')
+
+    initialTransformParametersPath = self._initializeRegistration()
+    restored = False
+    self.resultSource = "computed"
+    startTime = time.time()
+    if self.resultCache:
+      self.cacheKey = self._computeCacheKey(movingVolumeNode)
+    if self.restoreFromCheckpoint:
+      restored = self.checkpoint.restore(self.getCheckpointKey(), self.resultTransformDir, self.resultResampleDir, initialTransformParametersPath)
+      if restored:
+        self.restoredFromCheckpoint = True
+        self.resultSource = "checkpoint"
+        self.logic.elastixLogic.addLog("Registration result of item {0} is restored from checkpoint".format(self.movingVolumeItemNumber))
+    if not restored and self.resultCache:
+      restored = self.resultCache.restore(self.cacheKey, self.resultTransformDir, self.resultResampleDir, initialTransformParametersPath)
+      if restored:
+        self.resultSource = "cache"
+        self.logic.elastixLogic.addLog("Registration result of item {0} is found in cache".format(self.movingVolumeItemNumber))
+    if self.resultCache or self.restoreFromCheckpoint:
+      self.timings["restore"] = time.time() - startTime
+    if restored and self._hasRequiredOutputs():
+      if not self._startTransformInversion():
+        self.completed = True
+      return
+
+    startTime = time.time()
+    if self.inProcess:
+      # Voxels are passed to elastix in memory
+      self.movingImage = self._createInputImage(movingVolumeNode)
+      registrationMovingImage = self.movingImage
+      if registrationMovingVolumeNode is not None and not restored:
+        registrationMovingImage = self._createInputImage(registrationMovingVolumeNode)
+      self.timings["write"] = time.time() - startTime
+      if restored:
+        self._startTransformix()
+      else:
+        self._startInProcessTask('elastix', self._runInProcessElastix, registrationMovingImage, initialTransformParametersPath)
+      return
+    if (registrationMovingVolumeNode is None or self.computeVolume) and not self._isInputVolumeStaged(self.movingVolumePath):
+      self.logic.writeVolumeToFile(movingVolumeNode, self.movingVolumePath)
+    registrationMovingVolumePath = self.movingVolumePath
+    if registrationMovingVolumeNode is not None and not restored:
+      registrationMovingVolumePath = self._getInputVolumePath('movingRegion')
+      if not self._isInputVolumeStaged(registrationMovingVolumePath):
+        self.logic.writeVolumeToFile(registrationMovingVolumeNode, registrationMovingVolumePath)
+    self.timings["write"] = time.time() - startTime
+    if restored:
+      # Transform is available, only resampling is needed
+      self._startTransformix()
+      return
+
+    inputParamsElastix = ['-f', self.fixedVolumePath, '-m', registrationMovingVolumePath, '-out', self.resultTransformDir]
+    if self.fixedVolumeMaskPath:
+      inputParamsElastix += ['-fMask', self.fixedVolumeMaskPath]
+    if initialTransformParametersPath:
+      inputParamsElastix += ['-t0', initialTransformParametersPath]
+    for parameterFilename in self.parameterFilenames:
+      inputParamsElastix += ['-p', parameterFilename]
+    if self.logic.numberOfThreadsPerRegistration > 0:
+      inputParamsElastix += ['-threads', str(self.logic.numberOfThreadsPerRegistration)]
+    self._startProcess('elastix', self.logic.elastixLogic.elastixFilename, inputParamsElastix)
+
+  def _initializeRegistration(self):
+    """Returns path of the transform parameter file that the registration is initialized with (None if not initialized)
+    and selects the parameter files of the registration accordingly.
+    """
+    initialTransformParametersPath = self._getInitialTransformParametersPath()
+    if initialTransformParametersPath and self.initializedParameterFilenames:
+      self.parameterFilenames = self.initializedParameterFilenames
+    return initialTransformParametersPath
+
+  def _getInitialTransformParametersPath(self):
+    """Returns path of the transform parameter file that the registration is initialized with (None if not initialized)."""
+    initialTransformJob = self.getInitialTransformJob()
+    if initialTransformJob is None:
+      return None
+    if not self.initializeFromDisplacementField:
+      return initialTransformJob.getResultTransformParametersPath()
+    if not os.path.exists(initialTransformJob.getOutputTransformPath()):
+      # No displacement field is available (e.g., result of the initial transform job is restored without it)
+      return None
+    initialTransformParametersPath = os.path.join(self.resultTransformDir, 'InitialTransformParameters.txt')
+    self.logic.writeDisplacementFieldTransformParameters(initialTransformJob.getOutputTransformPath(), initialTransformParametersPath)
+    return initialTransformParametersPath
+
+  def _getInputVolumePath(self, name):
+    if self.stagedInputDirectory:
+      return os.path.join(self.stagedInputDirectory, "frame-{0:04d}-{1}.mha".format(self.movingVolumeItemNumber, name))
+    return os.path.join(self.inputDir, name + '.mha')
+
+  def _isInputVolumeStaged(self, path):
+    """Returns True if the input file is already written by an earlier registration of the same frame."""
+    return self.stagedInputDirectory is not None and os.path.exists(path)
+
+  def _startProcess(self, processName, executableFilename, cmdLineArguments):
+    import time
+    self.processName = processName
+    self.processStartTime = time.time()
+    self.processLogFilePath = os.path.join(self.workingDir, processName+'-output.txt')
+    self.process = self.logic.startElastixProcess(executableFilename, cmdLineArguments, self.processLogFilePath)
+
+  def _startInProcessTask(self, processName, function, *args):
+    import time
+    self.processName = processName
+    self.processStartTime = time.time()
+    self.inProcessTask = self.logic.getInProcessRegistrationExecutor().submit(function, *args)
+
+  def _createInputImage(self, volumeNode):
+    itkImage, voxels = self.logic.createItkImage(volumeNode)
+    self.inputVoxels.append(voxels)
+    return itkImage
+
+  def setInProcessRegistration(self, fixedImage, fixedMaskImage):
+    """Register using itk-elastix in a background thread instead of elastix executable.
+    Voxels of fixedImage and fixedMaskImage are shared by all frame jobs, but each job uses its own image objects:
+    updating an ITK pipeline modifies its input images (e.g., their requested region), therefore an image object
+    must not be used by registrations that run in different threads at the same time.
+    """
+    self.inProcess = True
+    self.fixedImage = self.logic.createItkImageView(fixedImage)
+    self.fixedMaskImage = self.logic.createItkImageView(fixedMaskImage) if fixedMaskImage is not None else None
+
+  def _runInProcessElastix(self, registrationMovingImage, initialTransformParametersPath):
+    """Runs in a background thread. Computed transform is written into the same files as elastix executable would write,
+    as they are needed for initializing registration of other frames, result cache, and checkpoints.
+    """
+    import itk
+    parameterObject = itk.ParameterObject.New()
+    for parameterFilename in self.parameterFilenames:
+      parameterObject.AddParameterFile(parameterFilename)
+    elastixFilter = itk.ElastixRegistrationMethod.New(self.fixedImage, registrationMovingImage)
+    elastixFilter.SetParameterObject(parameterObject)
+    if self.fixedMaskImage is not None:
+      elastixFilter.SetFixedMask(self.fixedMaskImage)
+    if initialTransformParametersPath:
+      elastixFilter.SetInitialTransformParameterFileName(initialTransformParametersPath)
+    if self.logic.numberOfThreadsPerRegistration > 0:
+      elastixFilter.SetNumberOfThreads(self.logic.numberOfThreadsPerRegistration)
+    elastixFilter.SetOutputDirectory(self.resultTransformDir)
+    elastixFilter.SetLogToConsole(False)
+    elastixFilter.SetLogToFile(True)
+    elastixFilter.Update()
+    if self.cancelled:
+      # Working directory may have been removed already
+      return
+    resultParameterObject = elastixFilter.GetTransformParameterObject()
+    for parameterFileIndex in range(resultParameterObject.GetNumberOfParameterMaps()):
+      if parameterFileIndex > 0:
+        initialTransform = os.path.join(self.resultTransformDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex-1))
+      else:
+        initialTransform = initialTransformParametersPath if initialTransformParametersPath else "NoInitialTransform"
+      parameterMap = resultParameterObject.GetParameterMap(parameterFileIndex)
+      parameterMap["InitialTransformParametersFileName"] = (initialTransform.replace('\\', '/'),)
+      resultParameterObject.WriteParameterFile(parameterMap,
+        os.path.join(self.resultTransformDir, 'TransformParameters.{0}.txt'.format(parameterFileIndex)))
+
+  def _runInProcessTransformix(self, deformationTransformParametersPath):
+    """Runs in a background thread. Results are kept in memory.
+    """
+    import itk
+    transformParametersPath = self.getResultTransformParametersPath()
+    if deformationTransformParametersPath:
+      transformixRuns = [(transformParametersPath, self.computeVolume, False), (deformationTransformParametersPath, False, True)]
+    else:
+      transformixRuns = [(transformParametersPath, self.computeVolume, self.computeTransform)]
+    for transformParametersPath, computeVolume, computeTransform in transformixRuns:
+      if not computeVolume and not computeTransform:
+        continue
+      transformixFilter = itk.TransformixFilter.New(self.movingImage)
+      transformixFilter.SetTransformParameterObject(self.logic.readTransformParameterObject(transformParametersPath))
+      transformixFilter.SetComputeDeformationField(computeTransform)
+      transformixFilter.SetLogToConsole(False)
+      transformixFilter.Update()
+      if computeVolume:
+        self.resultImage = transformixFilter.GetOutput()
+      if computeTransform:
+        self.resultDisplacementField = transformixFilter.GetOutputDeformationField()
+    if ((self.dependentJobs or self.keepDisplacementField) and self.resultDisplacementField is not None
+      and not self.cancelled):
+      # Registration of other frames is initialized from this displacement field
+      itk.imwrite(self.resultDisplacementField, self.getOutputTransformPath())
+
+  def _startTransformix(self):
+    # Outputs are going to be different from the ones in the checkpoint
+    self.restoredFromCheckpoint = False
+    if self.computeVolume and self.resultImageScalarType is not None:
+      self.logic.setTransformParametersResultPixelType(self.getResultTransformParametersPath(),
+        self.resultImagePixelTypesOfVtkScalarTypes.get(self.resultImageScalarType, "float"))
+    if self.inProcess:
+      import re
+      with open(self.getResultTransformParametersPath()) as parameterFile:
+        match = re.search(r'\(ResultImagePixelType\s+"([^"]*)"\)', parameterFile.read())
+      self.resultImagePixelType = self.resultImagePixelTypes.get(match.group(1) if match else "float", "float32")
+      deformationTransformParametersPath = None
+      if self.computeTransform and self.logic.transformGridShrinkFactor > 1:
+        deformationTransformParametersPath = os.path.join(self.resultTransformDir, 'TransformParameters.deformation.txt')
+        self.logic.writeShrunkTransformParameters(self.getResultTransformParametersPath(), deformationTransformParametersPath,
+          self.logic.transformGridShrinkFactor)
+      self._startInProcessTask('transformix', self._runInProcessTransformix, deformationTransformParametersPath)
+      return
+    threadsParams = ['-threads', str(self.logic.numberOfThreadsPerRegistration)] if self.logic.numberOfThreadsPerRegistration > 0 else []
+    shrinkFactor = self.logic.transformGridShrinkFactor
+    if self.computeTransform and shrinkFactor > 1:
+      # Displacement field is computed on a coarser grid than the volume, therefore a separate transformix run is needed
+      deformationTransformParametersPath = os.path.join(self.resultTransformDir, 'TransformParameters.deformation.txt')
+      self.logic.writeShrunkTransformParameters(self.getResultTransformParametersPath(), deformationTransformParametersPath, shrinkFactor)
+      self.pendingTransformixArguments = [['-out', self.resultResampleDir, '-tp', deformationTransformParametersPath, '-def', 'all'] + threadsParams]
+      if self.computeVolume:
+        self.pendingTransformixArguments.insert(0,
+          ['-out', self.resultResampleDir, '-tp', self.getResultTransformParametersPath(), '-in', self.movingVolumePath] + threadsParams)
+    else:
+      inputParamsTransformix = ['-out', self.resultResampleDir, '-tp', self.getResultTransformParametersPath()]
+      if self.computeVolume:
+        inputParamsTransformix += ['-in', self.movingVolumePath]
+      if self.computeTransform:
+        inputParamsTransformix += ['-def', 'all']
+      self.pendingTransformixArguments = [inputParamsTransformix + threadsParams]
+    self._startNextTransformix()
+
+  def _startNextTransformix(self):
+    inputParamsTransformix = self.pendingTransformixArguments.pop(0)
+    processName = 'transformix' if '-in' in inputParamsTransformix or not '-def' in inputParamsTransformix else 'transformix-deformation'
+    self._startProcess(processName, self.logic.elastixLogic.transformixFilename, inputParamsTransformix)
+
+  def poll(self):
+    """Check process status and start the next processing step if the current one is completed.
+    Returns True if the job is completed.
+    """
+    if self.completed:
+      return True
+    if self.inProcessTask is not None:
+      if not self.inProcessTask.done():
+        # still running
+        return False
+      error = self.inProcessTask.exception()
+      if error is None and self.processName == 'invert':
+        self.resultInverseTransform = self.inProcessTask.result()
+      self.inProcessTask = None
+      self._addStageTime()
+      if error is not None:
+        raise ValueError("Registration of item {0} failed ({1}: {2})".format(self.movingVolumeItemNumber, self.processName, error))
+    else:
+      returnCode = self.process.poll()
+      if returnCode is None:
+        # still running
+        return False
+      self.process = None
+      self._addStageTime()
+      if self.logic.elastixLogic.logStandardOutput:
+        with open(self.processLogFilePath) as processLogFile:
+          for line in processLogFile:
+            self.logic.elastixLogic.addLog(line.rstrip())
+      if returnCode != 0:
+        raise ValueError("Registration of item {0} failed ({1} returned {2}). Details: {3}".format(
+          self.movingVolumeItemNumber, self.processName, returnCode, self.processLogFilePath))
+    if self.processName == 'elastix':
+      elastixLogFilePath = os.path.join(self.resultTransformDir, 'elastix.log')
+      if not os.path.exists(elastixLogFilePath) and not self.inProcess:
+        elastixLogFilePath = self.processLogFilePath
+      self.elastixResolutionLevels = self.logic.parseElastixLog(elastixLogFilePath) if os.path.exists(elastixLogFilePath) else []
+      if self.outputGeometry:
+        size, origin = self.outputGeometry
+        for parameterFileIndex in range(len(self.parameterFilenames)):
+          self.logic.setTransformParametersOutputGeometry(os.path.join(self.resultTransformDir,
+            'TransformParameters.{0}.txt'.format(parameterFileIndex)), size, origin)
+      self._startTransformix()
+      return False
+    if self.pendingTransformixArguments:
+      self._startNextTransformix()
+      return False
+    if self.processName != 'invert':
+      if self.resultCache:
+        # Results of in-process registration are kept in memory, only the transform is stored
+        self.resultCache.store(self.cacheKey, self.resultTransformDir, self.resultResampleDir)
+      self.movingImage = None
+      self.inputVoxels = []
+      if self._startTransformInversion():
+        return False
+    self.completed = True
+    return True
+
+  def _startTransformInversion(self):
+    """Start computing the inverse of the result transform in a background thread, if it is needed.
+    Returns True if the computation is started.
+    """
+    if not self.invertResultTransform:
+      return False
+    self.resultTransform = self.loadResultTransform()
+    if not self.resultTransform.IsA("vtkOrientedGridTransform"):
+      return False
+    self._startInProcessTask('invert', self.logic.createInverseGridTransform, self.resultTransform)
+    return True
+
+  def loadResultTransform(self):
+    """Returns the computed transform that resamples the moving frame into the fixed frame."""
+    if self.resultDisplacementField is not None:
+      transform = self.logic.createGridTransformFromItkDisplacementField(self.resultDisplacementField)
+    else:
+      transformNode = slicer.vtkMRMLTransformNode()
+      self.logic.readTransformFromFile(transformNode, self.getOutputTransformPath())
+      transform = transformNode.GetTransformFromParent()
+    if self.logic.transformGridShrinkFactor > 1 and transform.IsA("vtkOrientedGridTransform"):
+      # Linear interpolation of a coarse grid would not be smooth
+      transform.SetInterpolationModeToCubic()
+    return transform
+
+  def _addStageTime(self):
+    import time
+    # Includes the delay until the completion is noticed, which is at most one polling period
+    stage = 'transformix' if self.processName.startswith('transformix') else self.processName
+    self.timings[stage] = self.timings.get(stage, 0.0) + time.time() - self.processStartTime
+
+  def isCompleted(self):
+    return self.completed
+
+  def setResultCache(self, resultCache, runCacheKey):
+    """Enable reusing of results from resultCache. runCacheKey identifies the inputs that are shared by all frames.
+    """
+    self.resultCache = resultCache
+    self.runCacheKey = runCacheKey
+
+  def setCheckpoint(self, checkpoint, restoreFromCheckpoint):
+    """Results are restored from checkpoint (if restoreFromCheckpoint is True) instead of computing them.
+    """
+    self.checkpoint = checkpoint
+    self.restoreFromCheckpoint = restoreFromCheckpoint
+
+  def getCheckpointKey(self):
+    return "frame-{0:04d}".format(self.movingVolumeItemNumber)
+
+  def _computeCacheKey(self, movingVolumeNode):
+    import hashlib
+    frameHash = hashlib.sha256()
+    frameHash.update(self.runCacheKey.encode())
+    for parameterFilename in self.parameterFilenames:
+      with open(parameterFilename, 'rb') as parameterFile:
+        frameHash.update(parameterFile.read())
+    initialTransformJob = self.getInitialTransformJob()
+    if initialTransformJob:
+      frameHash.update(initialTransformJob.cacheKey.encode())
+    self.logic.updateHashWithVolume(frameHash, movingVolumeNode)
+    return frameHash.hexdigest()
+
+  def _hasRequiredOutputs(self):
+    if self.computeVolume and not os.path.exists(self.getOutputVolumePath()):
+      return False
+    if self.computeTransform and not os.path.exists(self.getOutputTransformPath()):
+      return False
+    return True
+
+  def skipRegistration(self):
+    """Complete the job without registration, identity transform is used for this frame."""
+    self.registrationSkipped = True
+    self.resultSource = "skipped"
+    self.completed = True
+
+  def getInitialTransformJob(self):
+    """Returns the job whose result is used for initializing this registration, None if there is no initial transform."""
+    if self.initialTransformJob is None or self.initialTransformJob.registrationSkipped:
+      return None
+    return self.initialTransformJob
+
+  def isReadyToStart(self):
+    return self.initialTransformJob is None or self.initialTransformJob.isCompleted()
+
+  def kill(self):
+    if self.process is not None:
+      self.process.kill()
+      self.process.wait()
+      self.process = None
+    if self.inProcessTask is not None:
+      # In-process computation cannot be interrupted once it is started. It is left to complete in the background
+      # without writing results, and a new thread pool is used for the next computations so that they do not wait for it.
+      self.cancelled = True
+      if not self.inProcessTask.cancel():
+        self.logic.releaseInProcessRegistrationExecutor()
+      self.inProcessTask = None
+
+  def releaseResults(self):
+    """Release results of in-process registration, after they are stored in the output sequences."""
+    self.resultImage = None
+    self.resultDisplacementField = None
+    self.resultTransform = None
+    self.resultInverseTransform = None
+
+  def removeTemporaryFiles(self, keepTransformParameters=False, keepDisplacementField=False):
+    import shutil
+    if not keepTransformParameters and not keepDisplacementField:
+      shutil.rmtree(self.workingDir, ignore_errors=True)
+      return
+    shutil.rmtree(self.inputDir, ignore_errors=True)
+    if not keepTransformParameters:
+      shutil.rmtree(self.resultTransformDir, ignore_errors=True)
+    if not keepDisplacementField:
+      shutil.rmtree(self.resultResampleDir, ignore_errors=True)
+    elif os.path.isdir(self.resultResampleDir):
+      for filename in os.listdir(self.resultResampleDir):
+        if not filename.startswith('deformationField.'):
+          os.remove(os.path.join(self.resultResampleDir, filename))
+
+  def getResultTransformParametersPath(self):
+    """Elastix transform parameter file of the computed transform. It includes the initial transform."""
+    return os.path.join(self.resultTransformDir, 'TransformParameters.{0}.txt'.format(len(self.parameterFilenames)-1))
+
+  def getOutputVolumePath(self):
+    return os.path.join(self.resultResampleDir, 'result.mhd')
+
+  def getOutputTransformPath(self):
+    return os.path.join(self.resultResampleDir, 'deformationField.mhd')
+
+class SequenceRegistrationTest(ScriptedLoadableModuleTest):
+  """
+  This is the test case for your scripted module.
+  Uses ScriptedLoadableModuleTest base class, available at:
+  https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
+  """
+
+  def setUp(self):
+    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+    """
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+    """
+    self.setUp()
+    self.test_SequenceRegistration()
+    self.setUp()
+    self.test_ResultCache()
+    self.setUp()
+    self.test_CheckpointResume()
+    self.setUp()
+    self.test_CommandLineInterface()
+    self.setUp()
+    self.test_GroupwiseRegistration()
+    self.setUp()
+    self.test_RegistrationRegion()
+    self.setUp()
+    self.test_MotionScreening()
+    self.setUp()
+    self.test_ShrunkTransformParameters()
+    self.setUp()
+    self.test_RegistrationBatch()
+    self.setUp()
+    self.test_OutputScalarType()
+    self.setUp()
+    self.test_FixedVolumeStaging()
+    self.setUp()
+    self.test_ParseElastixLog()
+    self.setUp()
+    self.test_NeighborFrameInitialization()
+    self.setUp()
+    self.test_StreamedVolumeSequence()
+    self.setUp()
+    self.test_SmoothArrayOverTime()
+    self.setUp()
+    self.test_SmoothTransforms()
+    self.setUp()
+    self.test_InverseGridTransform()
+    self.setUp()
+    self.test_BrowserIndex()
+
+  def createSyntheticVolumeSequence(self, numberOfFrames=3, size=(16, 12, 8)):
+    """Create a small volume sequence (not added to the scene) of a box that moves along the I axis.
+    """
+    import numpy as np
+    sequenceNode = slicer.vtkMRMLSequenceNode()
+    sequenceNode.SetName("SyntheticVolSeq")
+    sequenceNode.SetIndexName("time")
+    sequenceNode.SetIndexUnit("s")
+    sequenceNode.SetIndexType(slicer.vtkMRMLSequenceNode.NumericIndex)
+    for frameIndex in range(numberOfFrames):
+      voxels = np.zeros(size[::-1], dtype=np.int16)  # KJI
+      voxels[2:6, 3:9, 2+frameIndex:8+frameIndex] = 100 + frameIndex
+      volumeNode = slicer.vtkMRMLScalarVolumeNode()
+      volumeNode.SetSpacing(2.0, 1.5, 3.0)
+      volumeNode.SetOrigin(-10.0, 5.0, 20.0)
+      slicer.util.updateVolumeFromArray(volumeNode, voxels)
+      sequenceNode.SetDataNodeAtValue(volumeNode, str(frameIndex))
+    return sequenceNode
+
+  def test_SequenceRegistration(self):
+    """ Ideally you should have several levels of tests.  At the lowest level
+    tests should exercise the functionality of the logic with different inputs
+    (both valid and invalid).  At higher levels your tests should emulate the
+    way the user would interact with your code and confirm that it still works
+    the way you intended.
+    One of the most important features of the tests is that it should alert other
+    developers when their changes will have an impact on the behavior of your
+    module.  For example, if a developer removes a feature that you depend on,
+    your test should break so they know that the feature is needed.
+    """
+
+    self.delayDisplay("Starting the test")
+    slicer.app.setOverrideCursor(qt.Qt.WaitCursor)
+    #
+    # first, get some data
+    #
+
+    import SampleData
+    sampleDataLogic = SampleData.SampleDataLogic()
+    inputVolSeq = sampleDataLogic.downloadSample("CTCardioSeq")
+
+    outputVolSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "OutVolSeq")
+    outputTransformSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "OutTransformSeq")
+
+    for i in range(inputVolSeq.GetNumberOfDataNodes())[3:]:
+      inputVolSeq.RemoveDataNodeAtValue(str(i))
+
+    self.delayDisplay('Starting registration...')
+
+    import Elastix
+    logic = SequenceRegistrationLogic()
+    logic.registerVolumeSequence(inputVolSeq, outputVolSeq, outputTransformSeq, 1, 0)
+
+    slicer.app.restoreOverrideCursor()
+    self.delayDisplay('Test passed!')
+
+  def test_ResultCache(self):
+    """Store and restore frame results in the result cache, without running registration.
+    """
+    import re
+    import time
+    import shutil
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    def getInitialTransform(parameterFilePath):
+      with open(parameterFilePath) as parameterFile:
+        return re.search(r'\(InitialTransformParametersFileName\s+"([^"]*)"\)', parameterFile.read()).group(1)
+
+    tempDir = tempfile.mkdtemp()
+    try:
+      # Results of a registration with two parameter files, the second one refers to the first one
+      resultTransformDir = os.path.join(tempDir, "result-transform")
+      resultResampleDir = os.path.join(tempDir, "result-resample")
+      os.makedirs(resultTransformDir)
+      os.makedirs(resultResampleDir)
+      for parameterFileIndex in range(2):
+        initialTransform = (os.path.join(resultTransformDir, "TransformParameters.0.txt").replace('\\', '/')
+          if parameterFileIndex > 0 else "NoInitialTransform")
+        with open(os.path.join(resultTransformDir, "TransformParameters.{0}.txt".format(parameterFileIndex)), 'w') as parameterFile:
+          parameterFile.write('(Transform "BSplineTransform")\n(InitialTransformParametersFileName "{0}")\n'.format(initialTransform))
+      resultVoxels = bytes(range(256)) * 16
+      with open(os.path.join(resultResampleDir, "result.mha"), 'wb') as resultFile:
+        resultFile.write(resultVoxels)
+      # Temporary files of elastix are not stored
+      with open(os.path.join(resultResampleDir, "transformix.log"), 'w') as logFile:
+        logFile.write("log")
+
+      cacheDir = os.path.join(tempDir, "cache")
+      cache = SequenceRegistrationResultCache(cacheDir, None)
+      cache.store("frame-a", resultTransformDir, resultResampleDir)
+      self.assertEqual(sorted(os.listdir(os.path.join(cacheDir, "frame-a", "result-resample"))), ["result.mha"])
+
+      # Restore, with an initial transform that is not the same as the one in the cached files
+      restoredTransformDir = os.path.join(tempDir, "restored-transform")
+      restoredResampleDir = os.path.join(tempDir, "restored-resample")
+      os.makedirs(restoredTransformDir)
+      os.makedirs(restoredResampleDir)
+      initialTransformParametersPath = os.path.join(tempDir, "InitialTransformParameters.txt")
+      self.assertFalse(cache.restore("frame-missing", restoredTransformDir, restoredResampleDir))
+      self.assertTrue(cache.restore("frame-a", restoredTransformDir, restoredResampleDir, initialTransformParametersPath))
+      with open(os.path.join(restoredResampleDir, "result.mha"), 'rb') as resultFile:
+        self.assertEqual(resultFile.read(), resultVoxels)
+      self.assertEqual(getInitialTransform(os.path.join(restoredTransformDir, "TransformParameters.0.txt")),
+        initialTransformParametersPath.replace('\\', '/'))
+      self.assertEqual(getInitialTransform(os.path.join(restoredTransformDir, "TransformParameters.1.txt")),
+        os.path.join(restoredTransformDir, "TransformParameters.0.txt").replace('\\', '/'))
+
+      # Limit the cache size to two entries: storing a third one removes the least recently used entry
+      entrySize = 0
+      for root, dirs, files in os.walk(os.path.join(cacheDir, "frame-a")):
+        entrySize += sum(os.path.getsize(os.path.join(root, filename)) for filename in files)
+      cache.maximumSizeBytes = entrySize * 5 // 2
+      cache.store("frame-b", resultTransformDir, resultResampleDir)
+      now = time.time()
+      os.utime(os.path.join(cacheDir, "frame-a"), (now - 100, now - 100))
+      os.utime(os.path.join(cacheDir, "frame-b"), (now - 200, now - 200))
+      # Restoring an entry marks it as recently used
+      self.assertTrue(cache.restore("frame-b", restoredTransformDir, restoredResampleDir))
+      cache.store("frame-c", resultTransformDir, resultResampleDir)
+      self.assertEqual(cache.totalSizeBytes, 2 * entrySize)
+      self.assertFalse(os.path.exists(os.path.join(cacheDir, "frame-a")))
+      self.assertTrue(os.path.isdir(os.path.join(cacheDir, "frame-b")))
+      self.assertTrue(os.path.isdir(os.path.join(cacheDir, "frame-c")))
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_CheckpointResume(self):
+    """Resume from the checkpoint manifest, and refuse to resume if registration settings are changed.
+    """
+    import json
+    import shutil
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    inputVolSeq = self.createSyntheticVolumeSequence()
+    logic = SequenceRegistrationLogic()
+    preset = logic.getRegistrationPresets()[0]
+
+    def initializeCheckpoint():
+      registrationRun = SequenceRegistrationRun(logic, inputVolSeq, None, slicer.vtkMRMLSequenceNode(), 1, 0)
+      registrationRun._initializeCheckpoint(preset)
+      return registrationRun
+
+    def getCompletedFramesInManifestFile():
+      with open(os.path.join(checkpointDir, "manifest.json")) as manifestFile:
+        return json.load(manifestFile)["completedFrames"]
+
+    checkpointDir = os.path.join(tempfile.mkdtemp(), "checkpoint")
+    try:
+      logic.checkpointDirectory = checkpointDir
+      registrationRun = initializeCheckpoint()
+      self.assertEqual(getCompletedFramesInManifestFile(), [])
+      # Interrupted run: two frames are completed
+      registrationRun.checkpointManifest["completedFrames"] = [0, 2]
+      registrationRun._writeCheckpointManifest()
+
+      logic.resumeFromCheckpoint = True
+      registrationRun = initializeCheckpoint()
+      self.assertEqual(registrationRun.checkpointManifest["completedFrames"], [0, 2])
+
+      # Results in the checkpoint are not valid for different settings
+      logic.motionScreeningThreshold = 0.05
+      with self.assertRaises(ValueError):
+        initializeCheckpoint()
+      self.assertEqual(getCompletedFramesInManifestFile(), [0, 2])
+      logic.motionScreeningThreshold = 0.0
+
+      # Without resuming, all frames are registered again
+      logic.resumeFromCheckpoint = False
+      registrationRun = initializeCheckpoint()
+      self.assertEqual(registrationRun.checkpointManifest["completedFrames"], [])
+      self.assertEqual(getCompletedFramesInManifestFile(), [])
+    finally:
+      shutil.rmtree(os.path.dirname(checkpointDir), ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_CommandLineInterface(self):
+    """Set up the logic from command-line arguments and register a volume sequence file. The motion screening threshold
+    is set so high that all frames are skipped, therefore the file-based processing is tested without running elastix.
+    """
+    import json
+    import shutil
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    args = createArgumentParser().parse_args(["--input", "input.seq.nrrd", "--preset", "Generic (all)", "--fixed-frame", "1",
+      "--output-transforms", "transforms.seq.mrb", "--fixed-to-moving", "--parallel-registrations", "3", "--threads-per-registration", "2",
+      "--initialize-from-neighbor-frame", "--neighbor-initialized-iterations-scale", "0.25", "--transform-resolution-factor", "2",
+      "--motion-threshold", "0.1", "--temporal-smoothing", "1.5", "--cache-dir", "cache", "--backend", "itk"])
+    self.assertEqual(args.fixed_frame, 1)
+    self.assertTrue(args.fixed_to_moving)
+    self.assertIsNone(args.output_volumes)
+    self.assertIsNone(args.start_frame)
+    logic = createLogicFromArguments(args)
+    self.assertEqual(logic.numberOfParallelRegistrations, 3)
+    self.assertEqual(logic.numberOfThreadsPerRegistration, 2)
+    self.assertTrue(logic.initializeFromNeighborFrame)
+    self.assertEqual(logic.neighborInitializedMaximumNumberOfIterationsScale, 0.25)
+    self.assertEqual(logic.transformGridShrinkFactor, 2)
+    self.assertEqual(logic.motionScreeningThreshold, 0.1)
+    self.assertEqual(logic.temporalSmoothingSigma, 1.5)
+    self.assertTrue(logic.useResultCache)
+    self.assertEqual(logic.resultCacheDirectory, "cache")
+    self.assertEqual(logic.registrationBackend, "itk")
+    self.assertTrue(logic.elastixLogic.deleteTemporaryFiles)
+    # Required arguments
+    with self.assertRaises(SystemExit):
+      createArgumentParser().parse_args(["--input", "input.seq.nrrd", "--fixed-frame", "1"])
+
+    logic = SequenceRegistrationLogic()
+    inputVolSeq = self.createSyntheticVolumeSequence()
+    tempDir = tempfile.mkdtemp()
+    try:
+      inputFilePath = os.path.join(tempDir, "input.seq.nrrd")
+      logic.writeSequenceToFile(inputVolSeq, inputFilePath)
+      outputVolumesFilePath = os.path.join(tempDir, "output.seq.nrrd")
+      outputTransformsFilePath = os.path.join(tempDir, "output.seq.mrb")
+      reportFilePath = os.path.join(tempDir, "report.json")
+      main(["--input", inputFilePath, "--preset", logic.getRegistrationPresets()[0].getName(), "--fixed-frame", "1",
+        "--output-volumes", outputVolumesFilePath, "--output-transforms", outputTransformsFilePath, "--report", reportFilePath,
+        "--motion-threshold", "1000"])
+
+      outputVolSeq = logic.readSequenceFromFile(outputVolumesFilePath)
+      self.assertEqual(outputVolSeq.GetNumberOfDataNodes(), inputVolSeq.GetNumberOfDataNodes())
+      outputTransformSeq = slicer.vtkMRMLSequenceNode()
+      storageNode = slicer.vtkMRMLSequenceStorageNode()
+      storageNode.SetFileName(outputTransformsFilePath)
+      self.assertTrue(storageNode.ReadData(outputTransformSeq))
+      self.assertEqual(outputTransformSeq.GetNumberOfDataNodes(), inputVolSeq.GetNumberOfDataNodes())
+      with open(reportFilePath) as reportFile:
+        report = json.load(reportFile)
+      self.assertEqual([frame["source"] for frame in report["frames"]], ["skipped", "fixed", "skipped"])
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_GroupwiseRegistration(self):
+    """Groupwise registration of a sequence of identical frames: the template remains the same as the frames
+    and all transforms are identity. Each iteration is initialized with the displacement fields of the previous one.
+    """
+    import numpy as np
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    logic.groupwiseNumberOfIterations = 2
+    # Smooth blob, so that the registration is well defined
+    k, j, i = np.meshgrid(np.arange(24), np.arange(32), np.arange(32), indexing='ij')
+    voxels = (1000 * np.exp(-((i-15)**2 + (j-17)**2 + (k-11)**2) / (2.0 * 5.0**2))).astype(np.int16)
+    inputVolSeq = slicer.vtkMRMLSequenceNode()
+    inputVolSeq.SetName("IdenticalFramesVolSeq")
+    for frameIndex in range(3):
+      volumeNode = slicer.vtkMRMLScalarVolumeNode()
+      volumeNode.SetSpacing(2.0, 1.5, 3.0)
+      volumeNode.SetOrigin(-10.0, 5.0, 20.0)
+      slicer.util.updateVolumeFromArray(volumeNode, voxels)
+      inputVolSeq.SetDataNodeAtValue(volumeNode, str(frameIndex))
+    outputVolSeq = slicer.vtkMRMLSequenceNode()
+    outputTransformSeq = slicer.vtkMRMLSequenceNode()
+
+    registrationRun = logic.newRegistrationRun(inputVolSeq, outputVolSeq, outputTransformSeq, 1, 0)
+    self.assertIsInstance(registrationRun, SequenceRegistrationGroupwiseRun)
+    logic.runRegistration(registrationRun)
+
+    firstIterationJobs, lastIterationJobs = [iterationRun.frameJobs for iterationRun in registrationRun.iterationRuns]
+    for firstIterationJob, lastIterationJob in zip(firstIterationJobs, lastIterationJobs):
+      # Initialized with the displacement field of the previous iteration, instead of chaining the transforms
+      self.assertIs(lastIterationJob.initialTransformJob, firstIterationJob)
+      self.assertTrue(lastIterationJob.initializeFromDisplacementField)
+      self.assertTrue(firstIterationJob.computeTransform)
+    self.assertIsNone(registrationRun.tempDir)
+
+    np.testing.assert_allclose(slicer.util.arrayFromVolume(registrationRun.templateVolume), voxels, atol=2.0)
+    self.assertEqual(outputVolSeq.GetNumberOfDataNodes(), 3)
+    self.assertEqual(outputTransformSeq.GetNumberOfDataNodes(), 3)
+    samplePoints = [[-10.0 + 2.0*15, 5.0 + 1.5*17, 20.0 + 3.0*11], [0.0, 20.0, 40.0], [30.0, 40.0, 70.0]]
+    for itemNumber in range(3):
+      np.testing.assert_allclose(slicer.util.arrayFromVolume(outputVolSeq.GetNthDataNode(itemNumber)), voxels, atol=2.0)
+      transform = outputTransformSeq.GetNthDataNode(itemNumber).GetTransformFromParent()
+      for point in samplePoints:
+        np.testing.assert_allclose(transform.TransformPoint(point), point, atol=0.5)
+
+    self.delayDisplay('Test passed!')
+
+  def test_RegistrationRegion(self):
+    """Frames are cropped to the registration region plus margin, and results are computed on the grid
+    of the uncropped fixed frame.
+    """
+    import re
+    import shutil
+    import tempfile
+    import numpy as np
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    logic.registrationRegionMargin = 2.0
+    # Voxel (i, j, k) is at RAS position (-10-2*i, 5-1.5*j, 20+3*k)
+    voxels = np.arange(10*16*20, dtype=np.int16).reshape(10, 16, 20)  # KJI
+    fixedVolume = slicer.vtkMRMLScalarVolumeNode()
+    fixedVolume.SetSpacing(2.0, 1.5, 3.0)
+    fixedVolume.SetOrigin(-10.0, 5.0, 20.0)
+    fixedVolume.SetIJKToRASDirections(-1.0, 0.0, 0.0, 0.0, -1.0, 0.0, 0.0, 0.0, 1.0)
+    slicer.util.updateVolumeFromArray(fixedVolume, voxels)
+    # ROI: R = -24..-16, A = -4..2, S = 29..35
+    if hasattr(slicer, "vtkMRMLMarkupsROINode"):
+      roiNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsROINode")
+      roiNode.SetCenter([-20.0, -1.0, 32.0])
+      roiNode.SetSize([8.0, 6.0, 6.0])
+    else:
+      roiNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLAnnotationROINode")
+      roiNode.SetXYZ([-20.0, -1.0, 32.0])
+      roiNode.SetRadiusXYZ([4.0, 3.0, 3.0])
+
+    # With margin: R = -26..-14 (I = 2..8), A = -6..4 (J = 0.67..7.33), S = 27..37 (K = 2.33..5.67)
+    extent = logic.getCroppingExtent(fixedVolume, roiNode)
+    self.assertEqual(extent, [2, 8, 0, 8, 2, 6])
+    # Extent is limited to the volume
+    logic.registrationRegionMargin = 20.0
+    self.assertEqual(logic.getCroppingExtent(fixedVolume, roiNode), [0, 17, 0, 15, 0, 9])
+    logic.registrationRegionMargin = 2.0
+
+    croppedVolume = logic.cropVolume(fixedVolume, extent)
+    self.assertEqual(croppedVolume.GetImageData().GetDimensions(), (7, 9, 5))
+    self.assertEqual(croppedVolume.GetImageData().GetExtent()[::2], (0, 0, 0))
+    np.testing.assert_array_equal(slicer.util.arrayFromVolume(croppedVolume), voxels[2:7, 0:9, 2:9])
+    np.testing.assert_allclose(croppedVolume.GetSpacing(), fixedVolume.GetSpacing())
+    fixedIjkToRas = vtk.vtkMatrix4x4()
+    fixedVolume.GetIJKToRASMatrix(fixedIjkToRas)
+    croppedIjkToRas = vtk.vtkMatrix4x4()
+    croppedVolume.GetIJKToRASMatrix(croppedIjkToRas)
+    for row in range(3):
+      for column in range(3):
+        self.assertAlmostEqual(croppedIjkToRas.GetElement(row, column), fixedIjkToRas.GetElement(row, column))
+    # Voxels are at the same physical position
+    np.testing.assert_allclose(croppedIjkToRas.MultiplyPoint([0, 0, 0, 1]), fixedIjkToRas.MultiplyPoint([2, 0, 2, 1]))
+    np.testing.assert_allclose(croppedIjkToRas.MultiplyPoint([6, 8, 4, 1]), fixedIjkToRas.MultiplyPoint([8, 8, 6, 1]))
+
+    # Transform parameters computed on the cropped frames are changed to compute results on the uncropped fixed frame grid
+    # (same as the outputGeometry of frame jobs)
+    tempDir = tempfile.mkdtemp()
+    try:
+      transformParametersFilePath = os.path.join(tempDir, "TransformParameters.0.txt")
+      croppedOrigin = croppedVolume.GetOrigin()
+      with open(transformParametersFilePath, 'w') as parameterFile:
+        parameterFile.write('(Transform "BSplineTransform")\n(Size 7 9 5)\n(Index 0 0 0)\n(Spacing 2 1.5 3)\n')
+        parameterFile.write('(Origin {0} {1} {2})\n'.format(-croppedOrigin[0], -croppedOrigin[1], croppedOrigin[2]))
+        parameterFile.write('(Direction 1 0 0 0 1 0 0 0 1)\n(ResultImagePixelType "short")\n')
+      logic.setTransformParametersOutputGeometry(transformParametersFilePath,
+        fixedVolume.GetImageData().GetDimensions(), fixedVolume.GetOrigin())
+      with open(transformParametersFilePath) as parameterFile:
+        parameters = parameterFile.read()
+      def getValues(name):
+        return [float(value) for value in re.search(r'\(' + name + r'\s([^)]*)\)', parameters).group(1).split()]
+      self.assertEqual(getValues("Size"), [20, 16, 10])
+      self.assertEqual(getValues("Index"), [0, 0, 0])
+      self.assertEqual(getValues("Spacing"), [2.0, 1.5, 3.0])
+      self.assertEqual(getValues("Direction"), [1, 0, 0, 0, 1, 0, 0, 0, 1])
+      # First and last voxels of the output grid (LPS) are at the first and last voxels of the fixed frame (RAS)
+      originLps = np.array(getValues("Origin"))
+      lastVoxelLps = originLps + np.array(getValues("Spacing")) * (np.array(getValues("Size")) - 1)
+      lpsToRas = np.array([-1.0, -1.0, 1.0])
+      np.testing.assert_allclose(originLps * lpsToRas, fixedIjkToRas.MultiplyPoint([0, 0, 0, 1])[:3])
+      np.testing.assert_allclose(lastVoxelLps * lpsToRas, fixedIjkToRas.MultiplyPoint([19, 15, 9, 1])[:3])
+      self.assertIn('(ResultImagePixelType "short")', parameters)
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_MotionScreening(self):
+    """Frames that differ from the fixed frame less than the motion screening threshold are not registered.
+    Registration of the next frame is then not initialized from the skipped frame.
+    """
+    import numpy as np
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+
+    # Metric is the RMS difference relative to the standard deviation of the fixed voxels
+    fixedVoxels = np.array([0.0, 2.0] * 8)  # standard deviation: 1
+    self.assertEqual(logic.computeMotionScreeningMetric(fixedVoxels, fixedVoxels.copy()), 0.0)
+    self.assertAlmostEqual(logic.computeMotionScreeningMetric(fixedVoxels, fixedVoxels + 0.5), 0.5)
+    self.assertAlmostEqual(logic.computeMotionScreeningMetric(fixedVoxels, fixedVoxels[::-1]), 2.0)
+    self.assertEqual(logic.computeMotionScreeningMetric(fixedVoxels, fixedVoxels[:8]), float('inf'))
+    self.assertEqual(logic.computeMotionScreeningMetric(np.ones(16), np.ones(16)), 0.0)
+    self.assertEqual(logic.computeMotionScreeningMetric(np.ones(16), np.zeros(16)), float('inf'))
+
+    # Downsampling averages blocks of voxels
+    volumeNode = slicer.vtkMRMLScalarVolumeNode()
+    voxels = np.zeros((8, 8, 8), dtype=np.int16)
+    voxels[:4, :4, :4] = 80
+    voxels[4:, 4:, 4:] = 8
+    slicer.util.updateVolumeFromArray(volumeNode, voxels)
+    logic.motionScreeningShrinkFactor = 4
+    downsampledVoxels = logic.getDownsampledVoxels(volumeNode)
+    self.assertEqual(downsampledVoxels.shape, (8,))
+    np.testing.assert_allclose(sorted(downsampledVoxels), [0.0] * 6 + [8.0, 80.0])
+
+    # The box moves farther from its position in the fixed frame in each frame
+    logic.motionScreeningShrinkFactor = 1
+    logic.initializeFromNeighborFrame = True
+    logic.neighborInitializedMaximumNumberOfIterationsScale = 1.0
+    inputVolSeq = self.createSyntheticVolumeSequence(numberOfFrames=4)
+    registrationRun = SequenceRegistrationRun(logic, inputVolSeq, None, None, 0, 0)
+    registrationRun.tempDir = slicer.app.temporaryPath
+    registrationRun.movingVolIndices = [0, 1, 2, 3]
+    registrationRun.motionScreeningFixedVoxels = logic.getDownsampledVoxels(registrationRun.fixedVolume)
+    registrationRun._createFrameJobs("fixed.mha", None, ["Parameters.txt"], None)
+    registrationRun.pendingJobs = list(registrationRun.frameJobs)
+    registrationRun._setupNeighborFrameInitialization(["Parameters.txt"])
+    metricValues = [logic.computeMotionScreeningMetric(registrationRun.motionScreeningFixedVoxels,
+      logic.getDownsampledVoxels(inputVolSeq.GetNthDataNode(itemNumber))) for itemNumber in range(4)]
+    self.assertEqual(metricValues[0], 0.0)
+    self.assertTrue(metricValues[1] < metricValues[2] < metricValues[3])
+    logic.motionScreeningThreshold = 0.5 * (metricValues[1] + metricValues[2])
+
+    startedItemNumbers = []
+    for job in registrationRun.frameJobs:
+      # Record registrations instead of running elastix
+      job.start = lambda movingVolumeNode, registrationMovingVolumeNode=None, job=job: startedItemNumbers.append(job.movingVolumeItemNumber)
+      registrationRun._startFrameJob(job)
+    fixedJob, job1, job2, job3 = registrationRun.frameJobs
+    self.assertEqual(startedItemNumbers, [0, 2, 3])
+    self.assertTrue(job1.registrationSkipped)
+    self.assertEqual(job1.resultSource, "skipped")
+    self.assertAlmostEqual(job1.motionScreeningMetricValue, metricValues[1])
+    self.assertFalse(job2.registrationSkipped)
+    self.assertFalse(job3.registrationSkipped)
+    # Frame next to the skipped frame is not initialized, the next one is initialized from its neighbor
+    self.assertIsNone(job2.getInitialTransformJob())
+    self.assertIs(job3.getInitialTransformJob(), job2)
+
+    self.delayDisplay('Test passed!')
+
+  def test_ShrunkTransformParameters(self):
+    """Displacement fields computed on a coarser grid cover the same physical region as the full resolution grid.
+    """
+    import re
+    import shutil
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    tempDir = tempfile.mkdtemp()
+    try:
+      transformParametersFilePath = os.path.join(tempDir, "TransformParameters.0.txt")
+      shrunkTransformParametersFilePath = os.path.join(tempDir, "TransformParameters.deformation.txt")
+      size = [64, 33, 1]
+      spacing = [0.8, 1.25, 3.0]
+      with open(transformParametersFilePath, 'w') as parameterFile:
+        parameterFile.write('(Transform "BSplineTransform")\n(Size {0} {1} {2})\n(Index 0 0 0)\n'.format(*size))
+        parameterFile.write('(Spacing {0} {1} {2})\n(Origin -12.5 30 7)\n(Direction 1 0 0 0 1 0 0 0 1)\n'.format(*spacing))
+      for shrinkFactor in [1, 2, 3, 4, 7]:
+        logic.writeShrunkTransformParameters(transformParametersFilePath, shrunkTransformParametersFilePath, shrinkFactor)
+        with open(shrunkTransformParametersFilePath) as parameterFile:
+          parameters = parameterFile.read()
+        shrunkSize = [int(value) for value in re.search(r'\(Size\s([^)]*)\)', parameters).group(1).split()]
+        shrunkSpacing = [float(value) for value in re.search(r'\(Spacing\s([^)]*)\)', parameters).group(1).split()]
+        self.assertIn("(Origin -12.5 30 7)", parameters)
+        self.assertIn("(Index 0 0 0)", parameters)
+        self.assertIn('(Transform "BSplineTransform")', parameters)
+        for axis in range(3):
+          self.assertAlmostEqual(shrunkSpacing[axis], spacing[axis] * shrinkFactor)
+          if size[axis] == 1:
+            self.assertEqual(shrunkSize[axis], 1)
+            continue
+          # Grids start at the same origin. The coarse grid covers the whole extent of the original grid,
+          # and extends beyond it by less than one coarse grid spacing.
+          originalExtent = (size[axis] - 1) * spacing[axis]
+          shrunkExtent = (shrunkSize[axis] - 1) * shrunkSpacing[axis]
+          self.assertGreaterEqual(shrunkExtent, originalExtent - 1e-6)
+          self.assertLess(shrunkExtent, originalExtent + shrunkSpacing[axis])
+        if shrinkFactor == 1:
+          self.assertEqual(shrunkSize, size)
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_RegistrationBatch(self):
+    """Registrations of multiple sequences share the parallel registration slots, and a failed sequence
+    does not prevent the registration of the other sequences.
+    """
+    self.delayDisplay("Starting the test")
+
+    class RegistrationRunStub(object):
+      """Registers numberOfFrames frames, each registration is completed in the next poll. Fails in poll number failAtPoll."""
+      def __init__(self, name, numberOfFrames, failAtStart=False, failAtPoll=None):
+        self.inputVolSeq = slicer.vtkMRMLSequenceNode()
+        self.inputVolSeq.SetName(name)
+        self.numberOfFrames = numberOfFrames
+        self.failAtStart = failAtStart
+        self.failAtPoll = failAtPoll
+        self.runningJobs = []
+        self.numberOfStartedFrames = 0
+        self.numberOfCompletedFrames = 0
+        self.numberOfPolls = 0
+        self.cancelled = False
+        self.progressCallback = None
+      def start(self):
+        if self.failAtStart:
+          raise ValueError("Failed to start")
+      def poll(self, maximumNumberOfRunningJobs):
+        self.numberOfPolls += 1
+        self.numberOfCompletedFrames += len(self.runningJobs)
+        self.runningJobs = []
+        if self.numberOfPolls == self.failAtPoll:
+          self.cancelled = True
+          raise ValueError("Registration failed")
+        while self.numberOfStartedFrames < self.numberOfFrames and len(self.runningJobs) < maximumNumberOfRunningJobs:
+          self.runningJobs.append(self.numberOfStartedFrames)
+          self.numberOfStartedFrames += 1
+        return self.numberOfCompletedFrames == self.numberOfFrames
+      def getNumberOfFrames(self):
+        return self.numberOfFrames
+      def getNumberOfCompletedFrames(self):
+        return self.numberOfCompletedFrames
+
+    logic = SequenceRegistrationLogic()
+    logic.numberOfParallelRegistrations = 3
+    registrationBatch = SequenceRegistrationBatch(logic)
+    runA = RegistrationRunStub("A", 5)
+    runB = RegistrationRunStub("B", 4, failAtPoll=2)
+    runC = RegistrationRunStub("C", 2, failAtStart=True)
+    runD = RegistrationRunStub("D", 2)
+    for registrationRun in [runA, runB, runC, runD]:
+      registrationBatch.addRun(registrationRun)
+    completedRuns = []
+    registrationBatch.runCompletedCallback = completedRuns.append
+    registrationBatch.start()
+    self.assertEqual(registrationBatch.activeRuns, [runA, runB, runD])
+    self.assertEqual([registrationRun for registrationRun, e in registrationBatch.failedRuns], [runC])
+
+    # The first sequence gets all the slots
+    self.assertFalse(registrationBatch.poll())
+    self.assertEqual([len(registrationRun.runningJobs) for registrationRun in [runA, runB, runD]], [3, 0, 0])
+
+    # Sequence B fails, slots that the first sequence does not need anymore are used by the next sequence
+    self.assertFalse(registrationBatch.poll())
+    self.assertEqual(registrationBatch.activeRuns, [runA, runD])
+    self.assertEqual([len(runA.runningJobs), len(runD.runningJobs)], [2, 1])
+
+    numberOfPolls = 2
+    with self.assertRaises(ValueError) as context:
+      while not registrationBatch.poll():
+        numberOfPolls += 1
+        self.assertLess(numberOfPolls, 100)
+        # Slots that the first sequence does not need are used by the other sequences, but the limit is never exceeded
+        self.assertLessEqual(sum(len(registrationRun.runningJobs) for registrationRun in registrationBatch.activeRuns), 3)
+    self.assertIn("2 of 4", str(context.exception))
+    self.assertTrue(registrationBatch.isCompleted())
+
+    # Other sequences are completed
+    self.assertTrue(runB.cancelled)
+    self.assertEqual([registrationRun for registrationRun, e in registrationBatch.failedRuns], [runC, runB])
+    self.assertEqual(completedRuns, [runA, runD])
+    self.assertEqual(runA.numberOfCompletedFrames, 5)
+    self.assertEqual(runD.numberOfCompletedFrames, 2)
+    self.assertEqual(registrationBatch.activeRuns, [])
+
+    self.delayDisplay('Test passed!')
+
+  def test_OutputScalarType(self):
+    """All output volumes have the scalar type of the input frames, and transformix is requested to compute that type.
+    """
+    import shutil
+    import tempfile
+    import numpy as np
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    tempDir = tempfile.mkdtemp()
+    try:
+      transformParametersFilePath = os.path.join(tempDir, "TransformParameters.0.txt")
+      with open(transformParametersFilePath, 'w') as parameterFile:
+        parameterFile.write('(Transform "BSplineTransform")\n(ResultImagePixelType "short")\n(ResultImageFormat "mha")\n')
+      logic.setTransformParametersResultPixelType(transformParametersFilePath, "float")
+      with open(transformParametersFilePath) as parameterFile:
+        parameters = parameterFile.read()
+      self.assertIn('(ResultImagePixelType "float")', parameters)
+      self.assertNotIn('"short"', parameters)
+      self.assertIn('(ResultImageFormat "mha")', parameters)
+      # Added if it is not in the file
+      with open(transformParametersFilePath, 'w') as parameterFile:
+        parameterFile.write('(Transform "BSplineTransform")\n')
+      logic.setTransformParametersResultPixelType(transformParametersFilePath, "unsigned char")
+      with open(transformParametersFilePath) as parameterFile:
+        self.assertIn('(ResultImagePixelType "unsigned char")', parameterFile.read())
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    # Float input sequence. Frames are not registered (motion screening threshold is high), so output volumes
+    # are copied from the input frames, which were previously converted to short.
+    inputVolSeq = self.createSyntheticVolumeSequence()
+    for itemNumber in range(inputVolSeq.GetNumberOfDataNodes()):
+      volumeNode = inputVolSeq.GetNthDataNode(itemNumber)
+      slicer.util.updateVolumeFromArray(volumeNode, slicer.util.arrayFromVolume(volumeNode).astype(np.float32) + 0.25)
+    logic.motionScreeningThreshold = 1000.0
+    outputVolSeq = slicer.vtkMRMLSequenceNode()
+    registrationRun = logic.newRegistrationRun(inputVolSeq, outputVolSeq, None, 1, 0)
+    logic.runRegistration(registrationRun)
+    self.assertEqual(registrationRun.outputScalarType, vtk.VTK_FLOAT)
+    self.assertEqual(outputVolSeq.GetNumberOfDataNodes(), inputVolSeq.GetNumberOfDataNodes())
+    for itemNumber in range(outputVolSeq.GetNumberOfDataNodes()):
+      self.assertEqual(outputVolSeq.GetNthDataNode(itemNumber).GetImageData().GetScalarType(), vtk.VTK_FLOAT)
+      np.testing.assert_array_equal(slicer.util.arrayFromVolume(outputVolSeq.GetNthDataNode(itemNumber)),
+        slicer.util.arrayFromVolume(inputVolSeq.GetNthDataNode(itemNumber)))
+    # Frame jobs request the same type from transformix
+    for job in registrationRun.frameJobs:
+      self.assertEqual(job.resultImagePixelTypesOfVtkScalarTypes[job.resultImageScalarType], "float")
+
+    self.delayDisplay('Test passed!')
+
+  def test_FixedVolumeStaging(self):
+    """The fixed frame is written to file only once per run, and all frame registrations use that file.
+    """
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    writtenFilePaths = []
+    def writeVolumeToFile(volumeNode, filePath):
+      writtenFilePaths.append(filePath)
+      SequenceRegistrationLogic.writeVolumeToFile(logic, volumeNode, filePath)
+    logic.writeVolumeToFile = writeVolumeToFile
+    # Record elastix command lines instead of running elastix
+    elastixArguments = []
+    def startElastixProcess(executableFilename, cmdLineArguments, logFilePath):
+      elastixArguments.append(cmdLineArguments)
+      return None
+    logic.startElastixProcess = startElastixProcess
+
+    inputVolSeq = self.createSyntheticVolumeSequence(numberOfFrames=4)
+    registrationRun = SequenceRegistrationRun(logic, inputVolSeq, slicer.vtkMRMLSequenceNode(), None, 1, 0)
+    try:
+      registrationRun.start()
+      fixedVolumePaths = [filePath for filePath in writtenFilePaths if os.path.basename(filePath) == 'fixed.mha']
+      self.assertEqual(len(fixedVolumePaths), 1)
+      self.assertTrue(os.path.exists(fixedVolumePaths[0]))
+      for job in registrationRun.frameJobs:
+        self.assertEqual(job.fixedVolumePath, fixedVolumePaths[0])
+        registrationRun._startFrameJob(job)
+
+      # Fixed frame is not written again, only the moving frames are written
+      self.assertEqual(len([filePath for filePath in writtenFilePaths if os.path.basename(filePath) == 'fixed.mha']), 1)
+      self.assertEqual(len(writtenFilePaths), 1 + 3)
+      self.assertEqual(len(elastixArguments), 3)
+      for cmdLineArguments in elastixArguments:
+        self.assertEqual(cmdLineArguments[cmdLineArguments.index('-f') + 1], fixedVolumePaths[0])
+    finally:
+      registrationRun.cancel()
+
+    self.delayDisplay('Test passed!')
+
+  def test_ParseElastixLog(self):
+    """Get optimization results from an elastix log of a registration with two parameter files.
+    """
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    # Excerpt of an elastix 5 log (rigid registration with two resolutions, then B-spline with one)
+    elastixLog = "\n".join([
+      "elastix is started at Mon Mar  2 10:12:31 2026.",
+      "Running elastix with parameter file 0: \"/tmp/Elastix/Parameters_Rigid.txt\".",
+      "Current time: Mon Mar  2 10:12:31 2026.",
+      "Resolution: 0",
+      "  Computing the fixed image extrema took 0.002 s.",
+      "1:ItNr\t2:Metric\t3a:Time\t3b:StepSize\t4:||Gradient||\tTime[ms]",
+      "0\t-0.612034\t0.000000\t0.159157\t0.091537\t6.8",
+      "1\t-0.625517\t1.000000\t0.158934\t0.087121\t2.1",
+      "2\t-0.631204\t2.000000\t0.158712\t0.080954\t2.0",
+      "Time spent in resolution 0 (ITK initialization and iterating): 0.042 s.",
+      "Stopping condition: Maximum number of iterations has been reached.",
+      "Resolution: 1",
+      "1:ItNr\t2:Metric\t3a:Time\t3b:StepSize\t4:||Gradient||\tTime[ms]",
+      "0\t-0.702311\t0.000000\t0.159157\t0.051233\t9.5",
+      "1\t-0.705840\t1.000000\t0.158934\t0.049020\t3.3",
+      "Time spent in resolution 1 (ITK initialization and iterating): 0.031 s.",
+      "Stopping condition: Maximum number of iterations has been reached.",
+      "Running elastix with parameter file 1: \"/tmp/Elastix/Parameters_BSpline.txt\".",
+      "Resolution: 0",
+      "1:ItNr\t2:Metric\t3a:Time\t3b:StepSize\t4:||Gradient||\tTime[ms]",
+      "0\t-0.710025\t0.000000\t2.118810\t0.031877\t12.4",
+      "Time spent in resolution 0 (ITK initialization and iterating): 0.125 s.",
+      "Stopping condition: Minimum step size has been reached.",
+      "Total time elapsed: 0.3 s.",
+      ])
+
+    with tempfile.NamedTemporaryFile('w', suffix=".log", delete=False) as logFile:
+      logFile.write(elastixLog)
+    try:
+      levels = SequenceRegistrationLogic().parseElastixLog(logFile.name)
+    finally:
+      os.remove(logFile.name)
+
+    self.assertEqual(levels, [
+      {"parameterFileIndex": 0, "resolution": 0, "numberOfIterations": 3, "finalMetricValue": -0.631204, "timeSec": 0.042,
+        "stoppingCondition": "Maximum number of iterations has been reached"},
+      {"parameterFileIndex": 0, "resolution": 1, "numberOfIterations": 2, "finalMetricValue": -0.70584, "timeSec": 0.031,
+        "stoppingCondition": "Maximum number of iterations has been reached"},
+      {"parameterFileIndex": 1, "resolution": 0, "numberOfIterations": 1, "finalMetricValue": -0.710025, "timeSec": 0.125,
+        "stoppingCondition": "Minimum step size has been reached"},
+      ])
+
+    self.delayDisplay('Test passed!')
+
+  def test_StreamedVolumeSequence(self):
+    """Write frames of a volume sequence into a folder and read them back using memory mapping.
+    """
+    import shutil
+    import tempfile
+    import numpy as np
+    from vtk.util import numpy_support
+
+    self.delayDisplay("Starting the test")
+
+    inputVolSeq = self.createSyntheticVolumeSequence()
+    sequenceDir = tempfile.mkdtemp()
+    try:
+      streamedVolumes = SequenceRegistrationStreamedVolumeSequence(sequenceDir)
+      streamedVolumes.create(inputVolSeq.GetIndexName(), inputVolSeq.GetIndexUnit(), inputVolSeq.GetIndexType())
+      for itemNumber in range(inputVolSeq.GetNumberOfDataNodes()):
+        streamedVolumes.addFrameFromVolume(inputVolSeq.GetNthIndexValue(itemNumber), inputVolSeq.GetNthDataNode(itemNumber))
+
+      # Read the sequence the same way as a viewer that is not the writer of the sequence
+      readVolumes = SequenceRegistrationStreamedVolumeSequence(sequenceDir)
+      index = readVolumes.readIndex()
+      self.assertEqual(index["indexName"], "time")
+      self.assertEqual(len(index["frames"]), inputVolSeq.GetNumberOfDataNodes())
+      self.assertIsNone(readVolumes.getFrame("100"))
+      for itemNumber in range(inputVolSeq.GetNumberOfDataNodes()):
+        inputVolume = inputVolSeq.GetNthDataNode(itemNumber)
+        inputVoxels = numpy_support.vtk_to_numpy(inputVolume.GetImageData().GetPointData().GetScalars())
+        inputIjkToRas = vtk.vtkMatrix4x4()
+        inputVolume.GetIJKToRASMatrix(inputIjkToRas)
+
+        frame = readVolumes.getFrame(inputVolSeq.GetNthIndexValue(itemNumber))
+        imageData, ijkToRas = readVolumes.readFrameImageData(frame)
+        self.assertEqual(imageData.GetDimensions(), inputVolume.GetImageData().GetDimensions())
+        for row in range(4):
+          for column in range(4):
+            self.assertAlmostEqual(ijkToRas.GetElement(row, column), inputIjkToRas.GetElement(row, column))
+        scalars = imageData.GetPointData().GetScalars()
+        voxels = numpy_support.vtk_to_numpy(scalars)
+        np.testing.assert_array_equal(voxels, inputVoxels)
+
+        # Voxels are not loaded into memory but mapped from the data file
+        mappedVoxels = scalars._numpy_reference
+        while mappedVoxels is not None and not isinstance(mappedVoxels, np.memmap):
+          mappedVoxels = mappedVoxels.base
+        self.assertIsNotNone(mappedVoxels)
+        # Changing the image data does not change the file
+        voxels[:] = 0
+        imageData, ijkToRas = readVolumes.readFrameImageData(frame)
+        np.testing.assert_array_equal(numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()), inputVoxels)
+
+      # Frames can be loaded into Slicer directly
+      loadedVolume = slicer.util.loadVolume(os.path.join(sequenceDir, readVolumes.getFrame("1")["headerFile"]))
+      np.testing.assert_array_equal(slicer.util.arrayFromVolume(loadedVolume), slicer.util.arrayFromVolume(inputVolSeq.GetNthDataNode(1)))
+      inputVolume = inputVolSeq.GetNthDataNode(1)
+      for loadedValue, inputValue in zip(loadedVolume.GetSpacing() + loadedVolume.GetOrigin(), inputVolume.GetSpacing() + inputVolume.GetOrigin()):
+        self.assertAlmostEqual(loadedValue, inputValue)
+    finally:
+      shutil.rmtree(sequenceDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_NeighborFrameInitialization(self):
+    """Registrations that are initialized from the neighbor frame use fewer iterations, but only if the neighbor
+    actually provides an initial transform: frames next to a skipped frame are registered with all the iterations.
+    """
+    import shutil
+    import tempfile
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    logic.neighborInitializedMaximumNumberOfIterationsScale = 0.5
+    inputVolSeq = self.createSyntheticVolumeSequence(numberOfFrames=4)
+    tempDir = tempfile.mkdtemp()
+    try:
+      parameterFilename = os.path.join(tempDir, "Parameters.txt")
+      with open(parameterFilename, 'w') as parameterFile:
+        parameterFile.write('(Transform "BSplineTransform")\n(MaximumNumberOfIterations 200 100)\n')
+      parameterFilenames = [parameterFilename]
+
+      run = SequenceRegistrationRun(logic, inputVolSeq, None, None, 0, 0)
+      run.tempDir = tempDir
+      run.movingVolIndices = [0, 1, 2, 3]
+      run._createFrameJobs(os.path.join(tempDir, "fixed.mha"), None, parameterFilenames, None)
+      run.pendingJobs = list(run.frameJobs)
+      run._setupNeighborFrameInitialization(parameterFilenames)
+      fixedJob, job1, job2, job3 = run.frameJobs
+      self.assertIsNone(job1.initialTransformJob)
+      self.assertIs(job2.initialTransformJob, job1)
+      self.assertIs(job3.initialTransformJob, job2)
+      self.assertEqual([job.movingVolumeItemNumber for job in run.pendingJobs], [0, 1, 2, 3])
+      # Parameter files are only selected when the registration is started
+      for job in run.frameJobs:
+        self.assertEqual(job.parameterFilenames, parameterFilenames)
+
+      # Neighbor frame is skipped by motion screening: no initial transform, all iterations are used
+      job1.skipRegistration()
+      self.assertTrue(job2.isReadyToStart())
+      os.makedirs(job2.resultTransformDir)
+      self.assertIsNone(job2._initializeRegistration())
+      self.assertEqual(job2.parameterFilenames, parameterFilenames)
+
+      # Neighbor result is available without displacement field (e.g., restored from cache): all iterations are used
+      job2.completed = True
+      os.makedirs(job3.resultTransformDir)
+      self.assertIsNone(job3._initializeRegistration())
+      self.assertEqual(job3.parameterFilenames, parameterFilenames)
+
+      # Neighbor displacement field is available: registration is initialized with it and uses fewer iterations
+      os.makedirs(job2.resultResampleDir)
+      with open(job2.getOutputTransformPath(), 'w') as displacementFieldFile:
+        displacementFieldFile.write("")
+      initialTransformParametersPath = job3._initializeRegistration()
+      self.assertIsNotNone(initialTransformParametersPath)
+      with open(initialTransformParametersPath) as initialTransformParametersFile:
+        self.assertIn(job2.getOutputTransformPath().replace('\\', '/'), initialTransformParametersFile.read())
+      self.assertEqual(job3.parameterFilenames, job3.initializedParameterFilenames)
+      with open(job3.parameterFilenames[0]) as parameterFile:
+        self.assertIn("(MaximumNumberOfIterations 100 50)", parameterFile.read())
+    finally:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_SmoothArrayOverTime(self):
+    """Temporal smoothing gives the same result with scipy and with the numpy implementation that is used without scipy.
+    """
+    import sys
+    import numpy as np
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    # Displacement field of 7 frames (frame, voxel, component)
+    displacements = np.random.RandomState(0).uniform(-5.0, 5.0, (7, 20, 3)).astype(np.float32)
+
+    def smoothWithoutScipy(array, sigma):
+      # Importing a module fails if it is set to None in sys.modules
+      savedModule = sys.modules.get("scipy.ndimage")
+      sys.modules["scipy.ndimage"] = None
+      try:
+        return logic.smoothArrayOverTime(array, sigma)
+      finally:
+        if savedModule is not None:
+          sys.modules["scipy.ndimage"] = savedModule
+        else:
+          del sys.modules["scipy.ndimage"]
+
+    # Kernel radius is larger than the number of frames for the largest sigma
+    for sigma in [0.5, 1.5, 4.0]:
+      # Gaussian weighted average of frames, frames beyond the first and last are the same as the first and last
+      radius = int(3.0 * sigma + 0.5)
+      weights = np.exp(-0.5 * (np.arange(-radius, radius+1) / sigma)**2)
+      weights /= weights.sum()
+      expected = np.zeros(displacements.shape)
+      for frameIndex in range(len(displacements)):
+        for offset, weight in zip(range(-radius, radius+1), weights):
+          expected[frameIndex] += weight * displacements[min(max(frameIndex+offset, 0), len(displacements)-1)]
+
+      smoothed = smoothWithoutScipy(displacements, sigma)
+      self.assertEqual(smoothed.dtype, displacements.dtype)
+      np.testing.assert_allclose(smoothed, expected, rtol=1e-5, atol=1e-5)
+      try:
+        import scipy.ndimage
+      except ImportError:
+        continue
+      np.testing.assert_allclose(logic.smoothArrayOverTime(displacements, sigma), smoothed, rtol=1e-5, atol=1e-5)
+
+    self.delayDisplay('Test passed!')
+
+  def test_SmoothTransforms(self):
+    """Temporal smoothing of displacement fields creates new transforms, the input transforms and the identity transform
+    of the fixed frame are not changed.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    dimensions = [5, 4, 3]
+    randomState = np.random.RandomState(0)
+    transforms = []
+    displacementArrays = []
+    fixedTransformIndex = 2
+    for transformIndex in range(5):
+      if transformIndex == fixedTransformIndex:
+        transforms.append(vtk.vtkTransform())
+        displacementArrays.append(np.zeros((dimensions[0] * dimensions[1] * dimensions[2], 3)))
+        continue
+      displacements = randomState.uniform(-5.0, 5.0, (dimensions[0] * dimensions[1] * dimensions[2], 3))
+      displacementGrid = vtk.vtkImageData()
+      displacementGrid.SetOrigin(-10.0, 5.0, 20.0)
+      displacementGrid.SetSpacing(2.0, 1.5, 3.0)
+      displacementGrid.SetDimensions(dimensions)
+      displacementGrid.GetPointData().SetScalars(numpy_support.numpy_to_vtk(displacements, deep=True, array_type=vtk.VTK_DOUBLE))
+      gridTransform = slicer.vtkOrientedGridTransform()
+      gridTransform.SetDisplacementGridData(displacementGrid)
+      transforms.append(gridTransform)
+      displacementArrays.append(displacements)
+
+    sigma = 1.0
+    smoothedTransforms = logic.smoothTransforms(transforms, sigma, fixedTransformIndex)
+    expected = logic.smoothArrayOverTime(np.stack(displacementArrays), sigma)
+    self.assertEqual(len(smoothedTransforms), len(transforms))
+    for transformIndex, (transform, smoothedTransform) in enumerate(zip(transforms, smoothedTransforms)):
+      if transformIndex == fixedTransformIndex:
+        self.assertIs(smoothedTransform, transform)
+        np.testing.assert_allclose(transform.TransformPoint(1.0, 2.0, 3.0), [1.0, 2.0, 3.0])
+        continue
+      self.assertIsNot(smoothedTransform, transform)
+      # Input is not modified
+      np.testing.assert_array_equal(numpy_support.vtk_to_numpy(transform.GetDisplacementGrid().GetPointData().GetScalars()),
+        displacementArrays[transformIndex])
+      smoothedGrid = smoothedTransform.GetDisplacementGrid()
+      np.testing.assert_allclose(smoothedGrid.GetOrigin(), transform.GetDisplacementGrid().GetOrigin())
+      np.testing.assert_allclose(smoothedGrid.GetSpacing(), transform.GetDisplacementGrid().GetSpacing())
+      np.testing.assert_allclose(numpy_support.vtk_to_numpy(smoothedGrid.GetPointData().GetScalars()), expected[transformIndex],
+        rtol=1e-5, atol=1e-5)
+
+    # Transform nodes are updated with the new transforms
+    transformNodes = []
+    for transform in transforms:
+      transformNode = slicer.vtkMRMLTransformNode()
+      transformNode.SetAndObserveTransformFromParent(transform)
+      transformNodes.append(transformNode)
+    logic.setSmoothedTransforms(transformNodes, smoothedTransforms)
+    for transformNode, smoothedTransform in zip(transformNodes, smoothedTransforms):
+      self.assertIs(transformNode.GetTransformFromParent(), smoothedTransform)
+
+    self.delayDisplay('Test passed!')
+
+  def test_InverseGridTransform(self):
+    """Applying a displacement field transform and then its inverse (computed by createInverseGridTransform)
+    maps points back to their original position.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+
+    self.delayDisplay("Starting the test")
+
+    logic = SequenceRegistrationLogic()
+    dimensions = [20, 16, 12]
+    spacing = np.array([2.0, 1.5, 3.0])
+    origin = np.array([-10.0, 5.0, 20.0])
+    # Oblique grid
+    gridDirectionMatrix = vtk.vtkMatrix4x4()
+    rotation = vtk.vtkTransform()
+    rotation.RotateZ(30.0)
+    rotation.RotateX(10.0)
+    gridDirectionMatrix.DeepCopy(rotation.GetMatrix())
+    directions = np.array([[gridDirectionMatrix.GetElement(row, column) for column in range(3)] for row in range(3)])
+
+    # Smooth displacement field (its gradient is much smaller than 1, therefore it is invertible)
+    k, j, i = np.meshgrid(np.arange(dimensions[2]), np.arange(dimensions[1]), np.arange(dimensions[0]), indexing='ij')
+    gridPoints = (np.stack([i.ravel(), j.ravel(), k.ravel()], axis=1) * spacing).dot(directions.T) + origin
+    extent = np.array(dimensions) * spacing
+    phase = 2 * np.pi * (np.stack([i.ravel(), j.ravel(), k.ravel()], axis=1) * spacing) / extent
+    displacements = np.stack([1.0 * np.sin(phase[:, 1]), 0.75 * np.sin(phase[:, 2]), 0.5 * np.sin(phase[:, 0])], axis=1)
+    displacementGrid = vtk.vtkImageData()
+    displacementGrid.SetOrigin(origin)
+    displacementGrid.SetSpacing(spacing)
+    displacementGrid.SetDimensions(dimensions)
+    displacementGrid.GetPointData().SetScalars(numpy_support.numpy_to_vtk(displacements, deep=True, array_type=vtk.VTK_FLOAT))
+    gridTransform = slicer.vtkOrientedGridTransform()
+    gridTransform.SetGridDirectionMatrix(gridDirectionMatrix)
+    gridTransform.SetDisplacementGridData(displacementGrid)
+
+    inverseGridTransform = logic.createInverseGridTransform(gridTransform)
+    self.assertTrue(inverseGridTransform.IsA("vtkOrientedGridTransform"))
+    self.assertEqual(inverseGridTransform.GetDisplacementGrid().GetDimensions(), tuple(dimensions))
+    # Forward transform is not modified
+    np.testing.assert_allclose(gridTransform.TransformPoint(gridPoints[100]), gridPoints[100] + displacements[100], atol=1e-4)
+
+    # Points inside the grid, away from the boundary (where displaced points may be outside of the grid)
+    margin = 3
+    interior = ((i >= margin) & (i < dimensions[0]-margin) & (j >= margin) & (j < dimensions[1]-margin)
+      & (k >= margin) & (k < dimensions[2]-margin)).ravel()
+    samplePoints = gridPoints[interior]
+    samplePoints = 0.5 * (samplePoints[:-1] + samplePoints[1:])  # between grid points, too
+    for point in samplePoints:
+      np.testing.assert_allclose(inverseGridTransform.TransformPoint(gridTransform.TransformPoint(point)), point, atol=0.1)
+      np.testing.assert_allclose(gridTransform.TransformPoint(inverseGridTransform.TransformPoint(point)), point, atol=0.1)
+
+    self.delayDisplay('Test passed!')
+
+  def test_BrowserIndex(self):
+    """Find the browser node of sequences. The index is not rebuilt when only the selected item of the browser changes.
+    """
+    self.delayDisplay("Starting the test")
+
+    inputVolSeq = self.createSyntheticVolumeSequence()
+    slicer.mrmlScene.AddNode(inputVolSeq)
+    outputTransformSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+    logic = SequenceRegistrationLogic()
+    browserIndex = SequenceRegistrationBrowserIndex.getSharedIndex(slicer.mrmlScene)
+    browserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode")
+    browserNode.SetAndObserveMasterSequenceNodeID(inputVolSeq.GetID())
+    self.assertEqual(logic.findBrowserForSequence(inputVolSeq), browserNode)
+    self.assertIsNone(logic.findBrowserForSequence(outputTransformSeq))
+
+    numberOfUpdates = [0]
+    def updateBrowserNode(browserNode):
+      numberOfUpdates[0] += 1
+      SequenceRegistrationBrowserIndex.updateBrowserNode(browserIndex, browserNode)
+    browserIndex.updateBrowserNode = updateBrowserNode
+    try:
+      # Same as playback
+      for itemNumber in range(inputVolSeq.GetNumberOfDataNodes()):
+        browserNode.SetSelectedItemNumber(itemNumber)
+      self.assertEqual(numberOfUpdates[0], 0)
+      self.assertEqual(logic.findBrowserForSequence(inputVolSeq), browserNode)
+
+      browserNode.AddSynchronizedSequenceNodeID(outputTransformSeq.GetID())
+      self.assertGreater(numberOfUpdates[0], 0)
+      self.assertEqual(logic.findBrowserForSequence(outputTransformSeq), browserNode)
+
+      slicer.mrmlScene.RemoveNode(browserNode)
+      self.assertIsNone(logic.findBrowserForSequence(inputVolSeq))
+      self.assertIsNone(logic.findBrowserForSequence(outputTransformSeq))
+    finally:
+      del browserIndex.updateBrowserNode
+      logic.cleanup()
+
+    self.delayDisplay('Test passed!')
+
+#
+# Command-line interface
+#
+
+def main(argv):
+  """Register a volume sequence file without using the module GUI. Example:
+
+    Slicer --no-main-window --python-script SequenceRegistration.py --input input.seq.nrrd --preset "Generic (all)"
+      --fixed-frame 7 --output-volumes output.seq.nrrd --output-transforms output.seq.mrb
+  """
+  args = createArgumentParser().parse_args(argv)
+  logic = createLogicFromArguments(args)
+  logic.registerVolumeSequenceFile(args.input, args.fixed_frame, args.preset,
+    args.output_volumes, args.output_transforms, not args.fixed_to_moving,
+    args.start_frame, args.end_frame, args.report)
+
+def createArgumentParser():
+  """Returns the parser of the command-line arguments of main()."""
+  import argparse
+  parser = argparse.ArgumentParser(description="Register all frames of a volume sequence to a fixed frame.")
+  parser.add_argument("--input", required=True, help="Input volume sequence file (.seq.nrrd), it is loaded into memory at once")
+  parser.add_argument("--preset", required=True, help="Name of the registration preset")
+  parser.add_argument("--fixed-frame", type=int, required=True, help="Index of the fixed frame")
+  parser.add_argument("--start-frame", type=int, default=None, help="Index of the first frame to register")
+  parser.add_argument("--end-frame", type=int, default=None, help="Index of the last frame to register")
+  parser.add_argument("--output-volumes", default=None, help="Output motion-compensated volume sequence file (.seq.nrrd)")
+  parser.add_argument("--output-transforms", default=None, help="Output transform sequence file (.seq.mrb)")
+  parser.add_argument("--output-volumes-dir", default=None,
+    help="Write each motion-compensated frame into this folder as soon as it is computed (frame-NNNN.nhdr files and index.json)")
+  parser.add_argument("--fixed-to-moving", action="store_true", help="Compute fixed to moving frame transforms (default: moving to fixed)")
+  parser.add_argument("--parallel-registrations", type=int, default=0, help="Number of frames registered at the same time (0 = automatic)")
+  parser.add_argument("--threads-per-registration", type=int, default=4, help="Number of threads used by each elastix process (0 = all cores)")
+  parser.add_argument("--initialize-from-neighbor-frame", action="store_true", help="Initialize each registration with the result of the neighbor frame")
+  parser.add_argument("--neighbor-initialized-iterations-scale", type=float, default=0.5,
+    help="Scale of maximum number of iterations for registrations initialized from the neighbor frame")
+  parser.add_argument("--transform-resolution-factor", type=int, default=1,
+    help="Compute displacement fields on a grid this many times coarser than the fixed frame (1 = full resolution)")
+  parser.add_argument("--motion-threshold", type=float, default=0.0,
+    help="Do not register frames that differ from the fixed frame less than this (relative RMS intensity difference, 0 = register all)")
+  parser.add_argument("--groupwise-iterations", type=int, default=0,
+    help="Register frames to the average of all frames, refined in this many iterations (0 = register to the fixed frame)")
+  parser.add_argument("--temporal-smoothing", type=float, default=0.0,
+    help="Smooth transforms over time with a Gaussian of this standard deviation (in frames) after registration (0 = no smoothing)")
+  parser.add_argument("--cache-dir", default=None, help="Reuse registration results stored in this folder and store new results there")
+  parser.add_argument("--cache-size", type=int, default=20000, help="Maximum size of the result cache in MB")
+  parser.add_argument("--checkpoint-dir", default=None, help="Save results of each frame into this folder as soon as it is completed")
+  parser.add_argument("--resume", action="store_true", help="Only register frames that are not found in the checkpoint folder")
+  parser.add_argument("--report", default=None, help="Write time spent in each processing step and registration metric of each frame into this file (.json)")
+  parser.add_argument("--backend", choices=["executable", "itk"], default="executable",
+    help="Run elastix executables or register in-process using itk-elastix Python package (executables are used if it is not installed)")
+  parser.add_argument("--keep-temporary-files", action="store_true", help="Do not delete temporary files after registration")
+  parser.add_argument("--verbose", action="store_true", help="Print detailed elastix output")
+  return parser
+
+def createLogicFromArguments(args):
+  """Returns a logic that is set up according to the parsed command-line arguments."""
+  def printLog(text):
+    import sys
+    print(text)
+    sys.stdout.flush()
+
+  logic = SequenceRegistrationLogic()
+  logic.logCallback = printLog
+  logic.logStandardOutput = args.verbose
+  logic.numberOfParallelRegistrations = args.parallel_registrations
+  logic.numberOfThreadsPerRegistration = args.threads_per_registration
+  logic.initializeFromNeighborFrame = args.initialize_from_neighbor_frame
+  logic.neighborInitializedMaximumNumberOfIterationsScale = args.neighbor_initialized_iterations_scale
+  logic.motionScreeningThreshold = args.motion_threshold
+  logic.groupwiseNumberOfIterations = args.groupwise_iterations
+  logic.temporalSmoothingSigma = args.temporal_smoothing
+  logic.transformGridShrinkFactor = args.transform_resolution_factor
+  logic.useResultCache = args.cache_dir is not None
+  logic.resultCacheDirectory = args.cache_dir
+  logic.resultCacheMaximumSizeMB = args.cache_size
+  logic.checkpointDirectory = args.checkpoint_dir
+  logic.resumeFromCheckpoint = args.resume
+  logic.outputVolumeDirectory = args.output_volumes_dir
+  logic.registrationBackend = args.backend
+  logic.elastixLogic.deleteTemporaryFiles = not args.keep_temporary_files
+  return logic
+
+if __name__ == "__main__":
+  import sys
+  try:
+    main(sys.argv[1:])
+  except Exception as e:
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+  sys.exit(0)
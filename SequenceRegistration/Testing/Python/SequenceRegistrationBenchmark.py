@@ -0,0 +1,331 @@
+"""Performance benchmark of SequenceRegistrationLogic.
+
+Generates synthetic 4D volume sequences with known, analytic deformation, registers them
+with various execution modes and writes timing, memory, disk usage, and registration error
+into a JSON file. Does not require network access.
+
+Usage:
+
+  Slicer --no-main-window --python-script SequenceRegistrationBenchmark.py --output benchmark.json
+
+Run with --help to see all options.
+"""
+
+import os
+import sys
+import time
+import json
+import math
+import shutil
+import platform
+import tempfile
+
+import numpy as np
+import vtk, slicer
+from vtk.util import numpy_support
+
+# Logic settings of each execution mode. Settings that are not listed keep their default value.
+EXECUTION_MODES = {
+  "sequential": {"numberOfParallelRegistrations": 1, "numberOfThreadsPerRegistration": 0},
+  "parallel": {},
+  "neighbor-initialized": {"initializeFromNeighborFrame": True},
+  "transform-only": {},
+  "cache-warm": {"useResultCache": True},
+  # Requires itk-elastix Python package, elastix executables are used if it is not installed (see inProcessRegistration in the results)
+  "in-process": {"registrationBackend": "itk"},
+  # Output volumes are written into a folder as soon as they are computed, instead of being kept in memory
+  "streamed": {},
+  "groupwise": {"groupwiseNumberOfIterations": 2},
+  }
+
+def createSyntheticVolumeSequence(size, numberOfFrames, fixedFrameIndex, spacing=2.0, maximumDisplacement=4.0):
+  """Create a volume sequence of a blob phantom, deformed by a smooth analytic displacement field.
+  Content of frame t at position x is the phantom at x - u(x, t), where u is 0 for the fixed frame.
+  Returns the sequence node (not added to the scene) and the displacement function u(points, frameIndex),
+  which takes and returns an Nx3 array of RAS coordinates.
+  """
+  size = np.array(size)  # IJK
+  extent = size * spacing
+  rng = np.random.RandomState(0)
+  numberOfBlobs = 12
+  blobCenters = rng.uniform(0.2, 0.8, (numberOfBlobs, 3)) * extent
+  blobRadii = rng.uniform(0.05, 0.12, numberOfBlobs) * extent.min()
+  blobIntensities = rng.uniform(200, 1000, numberOfBlobs)
+
+  def phantom(points):
+    values = np.zeros(len(points))
+    for center, radius, intensity in zip(blobCenters, blobRadii, blobIntensities):
+      values += intensity * np.exp(-np.sum((points - center) ** 2, axis=1) / (2 * radius ** 2))
+    return values
+
+  def displacement(points, frameIndex):
+    # Periodic motion, smooth in space, zero at the fixed frame
+    amplitude = maximumDisplacement * math.sin(2 * math.pi * (frameIndex - fixedFrameIndex) / numberOfFrames)
+    normalized = points / extent
+    u = np.zeros_like(points)
+    u[:, 0] = amplitude * np.sin(math.pi * normalized[:, 1]) * np.sin(math.pi * normalized[:, 2])
+    u[:, 1] = 0.5 * amplitude * np.sin(math.pi * normalized[:, 0]) * np.sin(math.pi * normalized[:, 2])
+    u[:, 2] = 0.25 * amplitude * np.sin(math.pi * normalized[:, 0]) * np.sin(math.pi * normalized[:, 1])
+    return u
+
+  # RAS coordinates of voxels, in the same order as voxels are stored in vtkImageData (i fastest)
+  k, j, i = np.meshgrid(np.arange(size[2]), np.arange(size[1]), np.arange(size[0]), indexing='ij')
+  voxelPoints = np.stack([i.ravel(), j.ravel(), k.ravel()], axis=1) * spacing
+
+  sequenceNode = slicer.vtkMRMLSequenceNode()
+  sequenceNode.SetIndexName("time")
+  sequenceNode.SetIndexUnit("s")
+  sequenceNode.SetIndexType(slicer.vtkMRMLSequenceNode.NumericIndex)
+  for frameIndex in range(numberOfFrames):
+    # Approximate inverse mapping (x - u(x)), accurate enough for small, smooth displacements
+    values = phantom(voxelPoints - displacement(voxelPoints, frameIndex)).astype(np.int16)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(*size)
+    imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(values, deep=True, array_type=vtk.VTK_SHORT))
+    volumeNode = slicer.vtkMRMLScalarVolumeNode()
+    volumeNode.SetSpacing(spacing, spacing, spacing)
+    volumeNode.SetAndObserveImageData(imageData)
+    sequenceNode.SetDataNodeAtValue(volumeNode, str(frameIndex))
+
+  return sequenceNode, displacement
+
+def computeRegistrationError(outputTransformSeq, displacement, fixedFrameIndex, size, spacing=2.0, numberOfSamplePoints=500):
+  """Returns mean and maximum distance (mm) between the computed and ground truth fixed to moving point mapping."""
+  extent = np.array(size) * spacing
+  rng = np.random.RandomState(1)
+  # Avoid the image boundary, where registration is not well defined
+  samplePoints = rng.uniform(0.2, 0.8, (numberOfSamplePoints, 3)) * extent
+  errors = []
+  for itemNumber in range(outputTransformSeq.GetNumberOfDataNodes()):
+    frameIndex = int(float(outputTransformSeq.GetNthIndexValue(itemNumber)))
+    if frameIndex == fixedFrameIndex:
+      continue
+    transform = outputTransformSeq.GetNthDataNode(itemNumber).GetTransformFromParent()
+    expectedPoints = samplePoints + displacement(samplePoints, frameIndex)
+    computedPoints = np.array([transform.TransformPoint(point) for point in samplePoints])
+    errors.append(np.linalg.norm(computedPoints - expectedPoints, axis=1))
+  if not errors:
+    return None, None
+  errors = np.concatenate(errors)
+  return float(errors.mean()), float(errors.max())
+
+def getDirectorySize(path):
+  size = 0
+  for root, dirs, files in os.walk(path):
+    size += sum(os.path.getsize(os.path.join(root, filename)) for filename in files)
+  return size
+
+def getPeakMemoryUsageMB():
+  """Peak resident memory of this process and of the largest child process (elastix), in MB.
+  Each benchmark case runs in a separate process, therefore these are the peak values of a single case.
+  """
+  try:
+    import resource
+  except ImportError:
+    # not available on Windows
+    return None, None
+  # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+  scale = 1.0 / 1024 / 1024 if sys.platform == 'darwin' else 1.0 / 1024
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def runBenchmark(logic, presetIndex, size, numberOfFrames, mode, resultCacheDirectory=None):
+  """Run a single benchmark case in this process.
+  resultCacheDirectory: result cache that is used in cache-warm mode, it must have been filled by a previous run of the same case.
+  """
+  from ElastixLib.utils import getTempDirectoryBase
+
+  fixedFrameIndex = numberOfFrames // 2
+  inputVolSeq, displacement = createSyntheticVolumeSequence(size, numberOfFrames, fixedFrameIndex)
+
+  for name, value in EXECUTION_MODES[mode].items():
+    setattr(logic, name, value)
+  if logic.useResultCache:
+    if not resultCacheDirectory:
+      raise ValueError("Result cache directory is required in {0} mode".format(mode))
+    logic.resultCacheDirectory = resultCacheDirectory
+
+  # Memory used by Slicer and the input sequence, before registration is started
+  baselineMemoryMB, _ = getPeakMemoryUsageMB()
+  result = SequenceRegistrationBenchmarkRun(logic, inputVolSeq, fixedFrameIndex, presetIndex, mode).run(getTempDirectoryBase())
+
+  numberOfRegisteredFrames = numberOfFrames - 1
+  outputTransformSeq = result.pop("outputTransformSeq")
+  if logic.groupwiseNumberOfIterations > 0:
+    # Frames are registered to a template instead of the fixed frame, therefore the ground truth (motion relative
+    # to the fixed frame) does not apply
+    meanError, maxError = None, None
+    numberOfRegisteredFrames = numberOfFrames
+  else:
+    meanError, maxError = computeRegistrationError(outputTransformSeq, displacement, fixedFrameIndex, size)
+  peakMemoryMB, peakChildMemoryMB = getPeakMemoryUsageMB()
+  result.update({
+    "mode": mode,
+    "size": list(size),
+    "numberOfFrames": numberOfFrames,
+    "timePerFrameSec": result["wallTimeSec"] / numberOfRegisteredFrames,
+    "meanRegistrationErrorMm": meanError,
+    "maxRegistrationErrorMm": maxError,
+    "baselineMemoryMB": baselineMemoryMB,
+    "peakMemoryMB": peakMemoryMB,
+    "peakElastixMemoryMB": peakChildMemoryMB,
+    })
+  return result
+
+def runBenchmarkInSubprocess(args, sizeStr, numberOfFrames, mode, resultCacheDirectory=None):
+  """Run a single benchmark case in a new Slicer process, so that its peak memory usage is not affected by other cases.
+  Returns the result of the case.
+  """
+  import subprocess
+  # The launcher sets up the environment, but the application can be started directly if the launcher is not found
+  slicerExecutable = slicer.app.launcherExecutableFilePath or slicer.app.applicationFilePath()
+  resultFileHandle, resultFilePath = tempfile.mkstemp(suffix=".json")
+  os.close(resultFileHandle)
+  try:
+    command = [slicerExecutable, "--no-splash", "--no-main-window", "--python-script", os.path.abspath(__file__),
+      "--single-run", "--output", resultFilePath, "--sizes", sizeStr, "--frames", str(numberOfFrames), "--modes", mode]
+    if args.preset:
+      command += ["--preset", args.preset]
+    if resultCacheDirectory:
+      command += ["--result-cache-directory", resultCacheDirectory]
+    subprocess.check_call(command)
+    with open(resultFilePath) as resultFile:
+      return json.load(resultFile)
+  finally:
+    os.remove(resultFilePath)
+
+class SequenceRegistrationBenchmarkRun(object):
+  """Runs one registration and measures wall time and temporary disk usage."""
+
+  def __init__(self, logic, inputVolSeq, fixedFrameIndex, presetIndex, mode):
+    self.logic = logic
+    self.inputVolSeq = inputVolSeq
+    self.fixedFrameIndex = fixedFrameIndex
+    self.presetIndex = presetIndex
+    self.mode = mode
+
+  def run(self, tempDirectoryBase):
+    # Sequences are added to the scene and shown in a sequence browser, the same way as when registration is started from the GUI
+    slicer.mrmlScene.AddNode(self.inputVolSeq)
+    browserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode")
+    browserNode.SetAndObserveMasterSequenceNodeID(self.inputVolSeq.GetID())
+    # In transform-only mode output volumes are not stored, but frames are resampled on demand while browsing.
+    # In streamed mode output volumes are only written into a folder.
+    outputVolSeq = None if self.mode in ["transform-only", "streamed"] else slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+    outputTransformSeq = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode")
+    if self.mode == "streamed":
+      self.logic.outputVolumeDirectory = tempfile.mkdtemp()
+    # Keep temporary files to measure their size
+    deleteTemporaryFiles = self.logic.elastixLogic.deleteTemporaryFiles
+    self.logic.elastixLogic.deleteTemporaryFiles = False
+    existingTempDirs = set(os.listdir(tempDirectoryBase)) if os.path.isdir(tempDirectoryBase) else set()
+    try:
+      startTime = time.time()
+      registrationRun = self.logic.registerVolumeSequence(self.inputVolSeq, outputVolSeq, outputTransformSeq,
+        self.fixedFrameIndex, self.presetIndex)
+      wallTime = time.time() - startTime
+    finally:
+      self.logic.elastixLogic.deleteTemporaryFiles = deleteTemporaryFiles
+      outputDiskBytes = 0
+      if self.logic.outputVolumeDirectory:
+        outputDiskBytes = getDirectorySize(self.logic.outputVolumeDirectory)
+        shutil.rmtree(self.logic.outputVolumeDirectory, ignore_errors=True)
+        self.logic.outputVolumeDirectory = None
+      tempDiskBytes = 0
+      for tempDirName in set(os.listdir(tempDirectoryBase)) - existingTempDirs:
+        tempDir = os.path.join(tempDirectoryBase, tempDirName)
+        tempDiskBytes += getDirectorySize(tempDir)
+        shutil.rmtree(tempDir, ignore_errors=True)
+    # Total time spent in each processing step, summed over all frames
+    stageTimings = {}
+    for frame in registrationRun.getReport()["frames"]:
+      for stage, stageTime in frame["timingsSec"].items():
+        stageTimings[stage] = stageTimings.get(stage, 0.0) + stageTime
+    result = {"wallTimeSec": wallTime, "stageTimingsSec": stageTimings, "tempDiskBytes": tempDiskBytes, "outputDiskBytes": outputDiskBytes,
+      "inProcessRegistration": registrationRun.inProcessRegistration,
+      # Average number of registrations that run at the same time. For in-process registration it is only greater than 1
+      # if registrations in different threads actually run concurrently.
+      "registrationConcurrency": stageTimings.get("elastix", 0.0) / wallTime if wallTime > 0 else None,
+      "outputTransformSeq": outputTransformSeq}
+    if self.mode == "transform-only":
+      result["onDemandResamplingTimePerFrameSec"] = self.browseResampledFrames(browserNode, registrationRun)
+    return result
+
+  def browseResampledFrames(self, browserNode, registrationRun):
+    """Select each frame in the browser, which resamples the frame on demand. Returns the average time per frame."""
+    resampler = self.logic.createLazyResampler(self.inputVolSeq, registrationRun.resamplingTransformSeq)
+    try:
+      numberOfFrames = self.inputVolSeq.GetNumberOfDataNodes()
+      startTime = time.time()
+      for itemNumber in range(numberOfFrames):
+        browserNode.SetSelectedItemNumber(itemNumber)
+      return (time.time() - startTime) / numberOfFrames
+    finally:
+      resampler.stop()
+
+def main(argv):
+  import argparse
+  parser = argparse.ArgumentParser(description="Measure performance of volume sequence registration on synthetic data.")
+  parser.add_argument("--output", required=True, help="Output JSON file")
+  parser.add_argument("--preset", default=None, help="Name of the registration preset (default: first preset)")
+  parser.add_argument("--sizes", default="64x64x32,128x128x64", help="Comma-separated list of volume sizes (IxJxK)")
+  parser.add_argument("--frames", default="5,10", help="Comma-separated list of number of frames")
+  parser.add_argument("--modes", default=",".join(EXECUTION_MODES.keys()), help="Comma-separated list of execution modes")
+  # Used internally for running each case in a separate process
+  parser.add_argument("--single-run", action="store_true", help=argparse.SUPPRESS)
+  parser.add_argument("--result-cache-directory", default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  from SequenceRegistration import SequenceRegistrationLogic
+  logic = SequenceRegistrationLogic()
+  logic.logCallback = lambda text: None
+  presetIndex = logic.getRegistrationPresetIndexByName(args.preset) if args.preset else 0
+
+  if args.single_run:
+    size = [int(dimension) for dimension in args.sizes.split("x")]
+    result = runBenchmark(logic, presetIndex, size, int(args.frames), args.modes, args.result_cache_directory)
+    with open(args.output, 'w') as outputFile:
+      json.dump(result, outputFile)
+    return
+
+  results = []
+  for sizeStr in args.sizes.split(","):
+    for numberOfFrames in [int(frames) for frames in args.frames.split(",")]:
+      for mode in args.modes.split(","):
+        print("Benchmark: size={0}, frames={1}, mode={2}".format(sizeStr, numberOfFrames, mode))
+        sys.stdout.flush()
+        resultCacheDirectory = None
+        try:
+          if EXECUTION_MODES[mode].get("useResultCache"):
+            resultCacheDirectory = tempfile.mkdtemp()
+            # Fill the cache, only the second run is measured
+            runBenchmarkInSubprocess(args, sizeStr, numberOfFrames, mode, resultCacheDirectory)
+          result = runBenchmarkInSubprocess(args, sizeStr, numberOfFrames, mode, resultCacheDirectory)
+        finally:
+          if resultCacheDirectory:
+            shutil.rmtree(resultCacheDirectory, ignore_errors=True)
+        print("  {0:.1f}s ({1:.1f}s/frame), mean error: {2}".format(result["wallTimeSec"], result["timePerFrameSec"],
+          result["meanRegistrationErrorMm"]))
+        results.append(result)
+
+  report = {
+    "environment": {
+      "slicerVersion": slicer.app.applicationVersion,
+      "platform": platform.platform(),
+      "numberOfCpuCores": os.cpu_count(),
+      "preset": logic.elastixLogic.getRegistrationPresets()[presetIndex].getName(),
+      },
+    "results": results,
+    }
+  with open(args.output, 'w') as outputFile:
+    json.dump(report, outputFile, indent=2)
+  print("Results are written to "+args.output)
+
+if __name__ == "__main__":
+  try:
+    main(sys.argv[1:])
+  except Exception:
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+  sys.exit(0)